@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RecipeRecomendationBackend.settings")
+# Pod ASGI recommend i process-image obsługują widoki async (api/async_views.py); ASYNC_VIEWS=0 je wyłącza.
+os.environ.setdefault("ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
+
+# Dogrywanie dziennika zmian przepisów w tle tylko w procesach serwera (nie w manage.py).
+from api import update_log  # noqa: E402
+
+update_log.enable_background_sync()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -52,8 +53,18 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.QueryCountMiddleware",
+    "api.middleware.MetricsMiddleware",
 ]
 
+# Nagłówki X-DB-Query-Count / X-DB-Time w odpowiedziach (domyślnie tylko przy DEBUG)
+QUERY_COUNT_HEADERS = DEBUG
+# Liczniki i histogramy czasów żądań i etapów (lookup, cache, score, hydrate, render, preprocess,
+# inference...) w formacie Prometheusa pod /api/metrics/ (tylko admin)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+# Nagłówek Server-Timing z czasami etapów (widoczny w narzędziach deweloperskich przeglądarki)
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER') == '1'
+
 ROOT_URLCONF = "RecipeRecomendationBackend.urls"
 
 TEMPLATES = [
@@ -116,10 +127,86 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     #'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     #'PAGE_SIZE': 100
 }
 
+# Rekomendacje przepisów
+RECOMMEND_MAX_LIMIT = 1000
+# Maksymalna liczba list składników w jednym żądaniu /api/recommend/batch/
+RECOMMEND_BATCH_MAX_QUERIES = 1000
+
+# 'index' - odwrócony indeks w pamięci procesu,
+# 'matrix' - macierz CSR z dysku (manage.py build_recipe_matrix), mapowana w pamięć przy starcie workera,
+# 'database' - dopasowanie w Postgresie po indeksie GIN na Recipe.ingredient_ids
+RECOMMEND_BACKEND = 'index'
+# Dopóki indeks w pamięci się buduje, zapytania obsługuje backend 'database'
+RECOMMEND_COLD_FALLBACK = True
+# Cache rankingów (klucz: składniki + limit + wersja zbioru przepisów)
+RECOMMEND_CACHE_SIZE = 2048
+RECOMMEND_CACHE_TTL = 15 * 60
+RECOMMEND_CACHE_BACKEND = None  # alias z CACHES współdzielony przez workery
+RECOMMEND_CURSOR_MAX_AGE = 60 * 60  # sekundy ważności kursora stronicowania (starszy -> 400)
+RECIPE_MATRIX_PATH = BASE_DIR / 'var' / 'recipe_matrix'
+# Równoległy ranking macierzą dla bardzo dużych korpusów (api/sharding.py): liczba zakresów wierszy
+# i procesów liczących je na wspólnym mmap. 0 - bez podziału. Każdy worker gunicorna ma własną pulę,
+# więc przy podziale uruchamiaj mniej workerów (np. workers * RECOMMEND_SHARD_WORKERS <= liczba rdzeni).
+RECOMMEND_SHARDS = int(os.environ.get('RECOMMEND_SHARDS', 0))
+RECOMMEND_SHARD_WORKERS = None  # domyślnie min(RECOMMEND_SHARDS, liczba CPU)
+
+# Dziennik zmian przepisów (RecipeChange): indeks i macierz dogrywają go w tle zamiast przebudowy
+# Sekundy między odczytami dziennika; 0 - tylko po commitach w tym procesie
+INDEX_SYNC_INTERVAL = float(os.environ.get('INDEX_SYNC_INTERVAL', 2))
+RECIPE_CHANGE_RETENTION = 7 * 24 * 60 * 60  # build_recipe_matrix usuwa starsze wpisy
+# Powyżej tylu zmienionych przepisów w nakładce macierzy worker uruchamia build_recipe_matrix
+MATRIX_OVERLAY_MAX = 50000
+MATRIX_GENERATIONS_KEPT = 2
+
+# Personalizacja (personalize=true w /api/recommend/): profil składników z ulubionych użytkownika,
+# aktualizowany przyrostowo przy dodaniu/usunięciu ulubionego
+PERSONALIZATION_WEIGHT = 0.25  # personal_score = score * (1 + waga * affinity), affinity w 0..1
+PERSONALIZATION_POOL_FACTOR = 3  # przestawiamy limit * 3 najlepszych wyników bazowego rankingu
+PERSONALIZATION_MIN_POOL = 50
+PERSONALIZATION_CACHE_SIZE = 10000
+PERSONALIZATION_CACHE_TTL = 10 * 60
+# Alias z CACHES dla profili. Bez niego profil jest w LRU workera - inne workery widzą zmianę ulubionych
+# dopiero po PERSONALIZATION_CACHE_TTL; przy kilku workerach ustaw wspólny backend.
+PERSONALIZATION_CACHE_BACKEND = None
+
+# Podobne przepisy (recipes/<pk>/similar/): indeks MinHash LSH z manage.py build_similarity_index
+SIMILARITY_INDEX_PATH = BASE_DIR / 'var' / 'similarity'
+SIMILARITY_PERMUTATIONS = 64
+SIMILARITY_BANDS = 16  # 16 pasm po 4 wiersze - kandydatami zostają głównie przepisy z Jaccardem powyżej ~0.5
+SIMILARITY_MAX_BUCKET = 2000  # najwyżej tylu kandydatów z jednego kubełka (ogranicza czas zapytania)
+SIMILARITY_GENERATIONS_KEPT = 2
+
+# Detekcja składników na zdjęciach (YOLO)
+DETECTION_MODEL_PATH = BASE_DIR / 'api' / 'best.pt'
+DETECTION_WORKERS = 1  # wątki robocze, każdy z własną instancją modelu
+DETECTION_BATCH_SIZE = 8
+DETECTION_BATCH_WAIT_MS = 10  # ile czekać na kolejne obrazy do paczki
+DETECTION_QUEUE_SIZE = 32  # po przekroczeniu process_image zwraca 429
+DETECTION_TIMEOUT = 30  # sekundy
+DETECTION_IMAGE_SIZE = 640  # dłuższy bok obrazu podawanego do modelu (imgsz YOLO)
+DETECTION_MIN_CONFIDENCE = 0.5  # /api/recipes-from-image/: etykiety poniżej progu nie trafiają do rekomendacji
+# Cache wyników po hashu przesłanego pliku i wersji wag
+DETECTION_WEIGHTS_VERSION = None  # None - wyliczana z rozmiaru i mtime DETECTION_MODEL_PATH
+DETECTION_CACHE_SIZE = 1024
+DETECTION_CACHE_TTL = 60 * 60
+DETECTION_CACHE_BACKEND = None  # alias z CACHES (np. Redis) współdzielony przez workery
+# Widoki async (api/async_views.py) dla /api/recommend/ i /api/process-image/ - włączane przez asgi.py
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+ASYNC_SCORING_WORKERS = 4  # wątki liczące rankingi dla widoków async
+ASYNC_PREPROCESS_WORKERS = 4  # wątki hashujące i dekodujące zdjęcia
+ASYNC_RECOMMEND_CONCURRENCY = 256  # żądania w toku na proces, ponad limit 429
+ASYNC_PROCESS_IMAGE_CONCURRENCY = 64
+# Model ładuje się leniwie przy pierwszym zdjęciu; DETECTION_PREWARM=1 ładuje go w tle przy starcie procesu
+DETECTION_PREWARM = os.environ.get('DETECTION_PREWARM') == '1'
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RecipeRecomendationBackend.settings")
 
 application = get_wsgi_application()
+
+# Dogrywanie dziennika zmian przepisów w tle tylko w procesach serwera (nie w manage.py).
+from api import update_log  # noqa: E402
+
+update_log.enable_background_sync()
@@ -2,3 +2,20 @@ from django.contrib import admin
 from rest_framework.authtoken.models import Token
 
 # Register your models here.
+
+from api.models import Recipe, RecipeDetail
+
+
+class RecipeDetailInline(admin.StackedInline):
+    # Zapis ner przelicza ingredient_ids przepisu (api.vocabulary.recipe_detail_saved).
+    model = RecipeDetail
+    can_delete = False
+
+
+@admin.register(Recipe)
+class RecipeAdmin(admin.ModelAdmin):
+    # Zapisy i usunięcia trafiają do dziennika zmian przez sygnały Recipe (api/update_log.py).
+    list_display = ('id', 'title', 'ingredient_count')
+    search_fields = ('title',)
+    readonly_fields = ('ingredient_ids', 'ingredient_count')
+    inlines = [RecipeDetailInline]
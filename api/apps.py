@@ -1,6 +1,28 @@
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from api import personalization, update_log, vocabulary
+        from api.models import FavouriteRecipe, Recipe, RecipeDetail
+
+        post_save.connect(vocabulary.recipe_detail_saved, sender=RecipeDetail)
+        pre_save.connect(update_log.recipe_pre_save, sender=Recipe)
+        post_save.connect(update_log.recipe_post_save, sender=Recipe)
+        post_delete.connect(update_log.recipe_post_delete, sender=Recipe)
+        post_save.connect(personalization.favourite_saved, sender=FavouriteRecipe)
+        post_delete.connect(personalization.favourite_deleted, sender=FavouriteRecipe)
+
+        # Macierz (RECOMMEND_BACKEND='matrix') ładuje się leniwie przy pierwszym zapytaniu albo
+        # w recipe_matrix.warmup() z hooka serwera - nie przy każdym manage.py.
+        if getattr(settings, 'DETECTION_PREWARM', False):
+            from api import detection
+
+            threading.Thread(target=detection.warmup, name='detector-warmup', daemon=True).start()
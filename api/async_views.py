@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .detection import DetectorBusy, InvalidImage, detect_async, detected_labels, parse_confidence
+from .executors import Overloaded, get_limit, run_in_executor
+from .metrics import stage
+from .renderers import FastJSONRenderer, NDJSONRenderer, ndjson_lines
+from .recommendations import parse_limit, recommend
+from . import views
+from .views import recommendation_payload
+
+
+def same_schema_as(view):
+    """
+    Dokumentacja OpenAPI widoku async = dokumentacja widoku DRF z views.py (te same @extend_schema).
+    drf_spectacular opisuje tylko widoki DRF, więc podpinamy klasę, którą @api_view zbudował dla
+    odpowiednika - bez tego pod ASGI ścieżki znikają ze schematu.
+    """
+    def decorator(f):
+        f.cls, f.initkwargs = view.cls, view.initkwargs
+        return f
+    return decorator
+
+
+def render(data, code=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=code)
+
+
+def accepts_ndjson(request):
+    return request.GET.get('format') == 'ndjson' or NDJSONRenderer.media_type in request.headers.get('Accept', '')
+
+
+def _authenticate(request):
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except exceptions.AuthenticationFailed as e:
+        return str(e.detail)
+    if not user.is_authenticated:
+        return str(exceptions.NotAuthenticated.default_detail)
+    request.user = user
+    return None
+
+
+async def authentication_error(request):
+    """
+    Uwierzytelnienie jak w DRF (DEFAULT_AUTHENTICATION_CLASSES); zwraca odpowiedź 401 albo None.
+    Po udanym uwierzytelnieniu użytkownik jest w request.user.
+    """
+    detail = await sync_to_async(_authenticate)(request)
+    if detail is None:
+        return None
+    response = render({"detail": detail}, status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def _stream(lines):
+    for line in lines:
+        yield line
+
+
+def _multipart(request):
+    request.FILES  # parsuje multipart i wypełnia request.POST
+    return request
+
+
+# Widoki dla serwera ASGI (ASYNC_VIEWS=True): te same ścieżki, wejście i odpowiedzi co w views.py,
+# ale ranking liczy pula 'scoring', dekodowanie zdjęć pula 'preprocess', a na wynik modelu
+# czekamy na future z BatchingDetector - pętla zdarzeń nie blokuje wątku na czas żądania.
+@same_schema_as(views.recommend_recipes)
+@csrf_exempt
+@require_POST
+async def recommend_recipes(request):
+    error = await authentication_error(request)
+    if error is not None:
+        return error
+
+    try:
+        with stage('parse'):
+            data = json.loads(request.body or b'{}')
+    except ValueError:
+        return render({"error": "Invalid JSON"}, status.HTTP_400_BAD_REQUEST)
+    if not isinstance(data, dict):
+        return render({"error": "Invalid JSON"}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        with get_limit('recommend'):
+            payload, code = await run_in_executor('scoring', recommendation_payload, data, request.user)
+    except Overloaded:
+        return render({"error": "Too many requests in progress, try again later"}, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    if code == status.HTTP_200_OK and accepts_ndjson(request):
+        if isinstance(payload, list):
+            return StreamingHttpResponse(_stream(ndjson_lines(payload)), content_type=NDJSONRenderer.media_type)
+        return HttpResponse(NDJSONRenderer().render(payload), content_type=NDJSONRenderer.media_type)
+
+    return render(payload, code)
+
+
+@same_schema_as(views.process_image)
+@csrf_exempt
+@require_POST
+async def process_image(request):
+    error = await authentication_error(request)
+    if error is not None:
+        return error
+
+    try:
+        with get_limit('process_image'):
+            # Treść żądania jest już wczytana przez ASGIHandler; parsowanie multipart też poza pętlą.
+            image_file = (await run_in_executor('preprocess', _multipart, request)).FILES.get('image')
+            if not image_file:
+                return render({"error": "Image is required"}, status.HTTP_400_BAD_REQUEST)
+            ingredients = await detect_async(image_file)
+    except InvalidImage:
+        return render({"error": "Invalid image"}, status.HTTP_400_BAD_REQUEST)
+    except (DetectorBusy, Overloaded):
+        return render({"error": "Too many images in progress, try again later"}, status.HTTP_429_TOO_MANY_REQUESTS)
+    except (FutureTimeoutError, asyncio.TimeoutError):
+        return render({"error": "Image processing timed out"}, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if not ingredients:
+        return render({"error": "No ingredients detected"}, status.HTTP_400_BAD_REQUEST)
+
+    return render({"ingredients": ingredients})
+
+
+@same_schema_as(views.recipes_from_image)
+@csrf_exempt
+@require_POST
+async def recipes_from_image(request):
+    started = time.perf_counter()
+    error = await authentication_error(request)
+    if error is not None:
+        return error
+
+    timings = {}
+    try:
+        with get_limit('process_image'):
+            request_data = await run_in_executor('preprocess', _multipart, request)
+            image_file = request_data.FILES.get('image')
+            if not image_file:
+                return render({"error": "Image is required"}, status.HTTP_400_BAD_REQUEST)
+            try:
+                limit = parse_limit(request_data.POST.get('limit'))
+                min_confidence = parse_confidence(
+                    request_data.POST.get('min_confidence'), settings.DETECTION_MIN_CONFIDENCE
+                )
+            except ValueError as e:
+                return render({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+            ingredients = await detect_async(image_file, timings)
+    except InvalidImage:
+        return render({"error": "Invalid image"}, status.HTTP_400_BAD_REQUEST)
+    except (DetectorBusy, Overloaded):
+        return render({"error": "Too many images in progress, try again later"}, status.HTTP_429_TOO_MANY_REQUESTS)
+    except (FutureTimeoutError, asyncio.TimeoutError):
+        return render({"error": "Image processing timed out"}, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if not ingredients:
+        return render({"error": "No ingredients detected"}, status.HTTP_400_BAD_REQUEST)
+
+    labels = detected_labels(ingredients, min_confidence)
+    recommendation_started = time.perf_counter()
+    recommendations = await run_in_executor('scoring', recommend, labels, limit) if labels else []
+    finished = time.perf_counter()
+    timings['recommendation'] = round((finished - recommendation_started) * 1000, 2)
+    timings['total'] = round((finished - started) * 1000, 2)
+
+    return render({
+        "ingredients": ingredients,
+        "labels": labels,
+        "recommendations": recommendations,
+        "timings_ms": timings,
+    })
@@ -0,0 +1,836 @@
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+
+from api.ingredients import canonicalize
+from api.loadtest import percentile, summarize
+from api.models import FavouriteRecipe, Recipe, RecipeChange, RecipeDetail
+
+
+WORKLOADS = {}
+
+
+def workload(name):
+    def decorator(func):
+        WORKLOADS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, inputs):
+    timings = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        timings.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(timings)
+    return {
+        'runs': len(timings),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p90_ms': round(percentile(ordered, 0.90), 3),
+        'p99_ms': round(percentile(ordered, 0.99), 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def sample_ingredient_lists(count, size, seed=0):
+    """Losuje listy składników z ner istniejących przepisów, żeby zapytania miały trafienia."""
+    rng = random.Random(seed)
+    ids = list(Recipe.objects.values_list('id', flat=True)[:10000])
+    if not ids:
+        return []
+    ners = RecipeDetail.objects.filter(
+        recipe_id__in=rng.sample(ids, min(len(ids), count * 4))
+    ).values_list('ner', flat=True)
+    pool = sorted({term for ner in ners if isinstance(ner, list) for term in ner})
+    return [rng.sample(pool, min(size, len(pool))) for _ in range(count)]
+
+
+def legacy_recommend(ingredients, limit=100):
+    """Pierwotna implementacja recommend_recipes (OR z icontains + pętla w Pythonie) - punkt odniesienia."""
+    user_ingredients_set = set(ingredients)
+
+    query = Q()
+    for ing in ingredients:
+        query |= Q(ner__icontains=ing)
+
+    recommendations = []
+    for recipe_id, ner in RecipeDetail.objects.filter(query).values_list('recipe_id', 'ner'):
+        recipe_ingredients = set(ner)
+        match_count = len(user_ingredients_set & recipe_ingredients)
+        if match_count == 0:
+            continue
+        recommendations.append({
+            "id": recipe_id,
+            "match_count": match_count,
+            "match_percentage": round((match_count / len(recipe_ingredients)) * 100, 2),
+        })
+
+    recommendations.sort(key=lambda x: (-x['match_percentage'], -x['match_count']))
+    return recommendations[:limit]
+
+
+@workload('ner_query')
+def ner_query(options):
+    """Zapytanie icontains (stare) vs && na ingredient_ids z indeksem GIN."""
+    from api.recommendations import score_with_database
+    from api.vocabulary import get_vocabulary
+
+    queries = sample_ingredient_lists(options['queries'], options['ingredients'])
+    vocabulary = get_vocabulary()
+    return {
+        'recipes': Recipe.objects.count(),
+        'ingredients_per_query': options['ingredients'],
+        'icontains': measure(legacy_recommend, queries),
+        'gin_overlap': measure(lambda ingredients: score_with_database(vocabulary.lookup(ingredients), 100), queries),
+    }
+
+
+STARTUP_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+import api.urls
+{extra}
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'ultralytics_imported': 'ultralytics' in sys.modules,
+    'torch_imported': 'torch' in sys.modules,
+}}))
+"""
+
+
+def run_startup(extra, runs):
+    timings, last = [], {}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SNIPPET.format(extra=extra)],
+            cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True, check=True,
+        ).stdout
+        last = json.loads(output.strip().splitlines()[-1])
+        timings.append(last.pop('seconds') * 1000)
+    return {
+        'runs': runs,
+        'mean_ms': round(statistics.fmean(timings), 1),
+        'min_ms': round(min(timings), 1),
+        **last,
+    }
+
+
+@workload('startup')
+def startup(options):
+    """
+    Czas django.setup() + import api.urls w świeżym procesie. Wariant 'with_detector'
+    dodatkowo ładuje model - tyle kosztował każdy start, gdy YOLO ładowało się przy imporcie views.
+    """
+    runs = max(1, min(options['queries'], 5))
+    return {
+        'import_api_urls': run_startup('', runs),
+        'import_api_urls_with_detector': run_startup(
+            'from api.detection import get_detector; get_detector()', runs
+        ),
+    }
+
+
+def make_sample_jpeg(width, height, orientation=None, seed=0):
+    import io
+
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width // 8, height // 8), 64).resize((width, height)).convert('RGB')
+    image = Image.blend(image, noise, 0.5)
+    for _ in range(20):
+        x, y = rng.randrange(width), rng.randrange(height)
+        image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (x, y, x + width // 10, y + height // 10))
+
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+@workload('image_preprocess')
+def image_preprocess(options):
+    """Pełne dekodowanie zdjęcia (jak wcześniej w process_image) vs prepare_image z draft + EXIF."""
+    import io
+
+    from PIL import Image, ImageOps
+
+    from api.imaging import prepare_image
+
+    target = settings.DETECTION_IMAGE_SIZE
+    runs = max(1, min(options['queries'], 20))
+    results = {}
+    for label, (width, height) in {'12mp': (4032, 3024), '48mp': (8000, 6000)}.items():
+        data = make_sample_jpeg(width, height, orientation=6)
+
+        def full_decode(_):
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+            image.load()
+            return image
+
+        def prepared(_):
+            return prepare_image(io.BytesIO(data), target)[0]
+
+        full, small = full_decode(None), prepared(None)
+        results[label] = {
+            'file_mb': round(len(data) / 2 ** 20, 2),
+            'full_decode': {**measure(full_decode, range(runs)), 'image_mb': round(len(full.tobytes()) / 2 ** 20, 1)},
+            'prepare_image': {**measure(prepared, range(runs)), 'image_mb': round(len(small.tobytes()) / 2 ** 20, 1)},
+            'input_size': small.size,
+        }
+    return results
+
+
+def synthetic_recipe(i, rng, pool):
+    ner = rng.sample(pool, rng.randint(3, 12))
+    return {
+        'title': f'Synthetic recipe {i}',
+        'ingredients': [f'{rng.randint(1, 4)} c. {name}' for name in ner],
+        'directions': [f'Step {step}: mix everything and wait.' for step in range(rng.randint(3, 10))],
+        'link': f'www.example.com/synthetic/{i}',
+        'source': 'Synthetic',
+        'ner': ner,
+        'site': 'www.example.com',
+    }, []
+
+
+@workload('serialization')
+def serialization(options):
+    """Serializery DRF + JSONRenderer vs słowniki z .values() + FastJSONRenderer dla 1000 ulubionych."""
+    from rest_framework.renderers import JSONRenderer
+
+    from api.renderers import FastJSONRenderer
+    from api.serializers import (
+        FavouriteRecipeSerializer, FavouriteRecipeSummarySerializer, favourite_dicts, favourite_summary_dicts,
+    )
+
+    runs = max(1, min(options['queries'], 20))
+    rng = random.Random(0)
+    pool = [f'ingredient {n}' for n in range(300)]
+
+    with transaction.atomic():
+        user = User.objects.create_user(username=f'benchmark-{time.time_ns()}')
+        recipes = Recipe.objects.bulk_create_with_detail([synthetic_recipe(i, rng, pool) for i in range(1000)])
+        FavouriteRecipe.objects.bulk_create([FavouriteRecipe(user=user, recipe=recipe) for recipe in recipes])
+        favourites = FavouriteRecipe.objects.filter(user=user)
+
+        results = {
+            'favourites': len(recipes),
+            'summary_list': {
+                'drf': measure(lambda _: JSONRenderer().render(
+                    FavouriteRecipeSummarySerializer(favourites.select_related('recipe__detail'), many=True).data
+                ), range(runs)),
+                'fast': measure(lambda _: FastJSONRenderer().render(
+                    favourite_summary_dicts(favourites)
+                ), range(runs)),
+            },
+            'full_list': {
+                'drf': measure(lambda _: JSONRenderer().render(
+                    FavouriteRecipeSerializer(favourites.select_related('recipe__detail'), many=True).data
+                ), range(runs)),
+                'fast': measure(lambda _: FastJSONRenderer().render(
+                    favourite_dicts(favourites)
+                ), range(runs)),
+            },
+        }
+        transaction.set_rollback(True)
+    return results
+
+
+def table_stats(cursor, model):
+    table = model._meta.db_table
+    cursor.execute(f'ANALYZE {table}')
+    cursor.execute(
+        'SELECT reltuples, relpages, pg_relation_size(oid), pg_total_relation_size(oid) '
+        'FROM pg_class WHERE oid = %s::regclass',
+        [table],
+    )
+    rows, pages, heap, total = cursor.fetchone()
+    rows = max(int(rows), 0)
+    return {
+        'rows': rows,
+        'pages': pages,
+        'rows_per_page': round(rows / pages, 1) if pages else None,
+        'heap_mb': round(heap / 2 ** 20, 2),
+        'total_mb': round(total / 2 ** 20, 2),  # z TOAST i indeksami
+    }
+
+
+@workload('recipe_storage')
+def recipe_storage(options):
+    """
+    Podział przepisu na wąską tabelę Recipe i RecipeDetail: wiersze na stronę i rozmiary tabel,
+    oraz bufory czytane przy pobraniu strony wyników (id, title, link dla 100 przepisów) -
+    z samej tabeli Recipe ('hot') i razem z kolumnami JSON ('wide', tyle czytał wiersz sprzed podziału).
+    Bufory i hit_ratio pochodzą z EXPLAIN (ANALYZE, BUFFERS); hit_ratio zależy od shared_buffers
+    i od tego, co jest już w cache - przy ograniczonej pamięci decyduje buffers_per_row.
+    """
+    recipe_table, detail_table = Recipe._meta.db_table, RecipeDetail._meta.db_table
+    statements = {
+        'hot': f'SELECT id, title, link FROM {recipe_table} WHERE id = ANY(%s)',
+        'wide': (
+            f'SELECT r.id, r.title, r.link, d.ingredients::text, d.directions::text, d.ner::text, d.source, d.site '
+            f'FROM {recipe_table} AS r JOIN {detail_table} AS d ON d.recipe_id = r.id WHERE r.id = ANY(%s)'
+        ),
+    }
+
+    rng = random.Random(0)
+    ids = list(Recipe.objects.values_list('id', flat=True))
+    pages = [rng.sample(ids, min(100, len(ids))) for _ in range(options['queries'])] if ids else []
+
+    results = {'recipes': len(ids)}
+    with connection.cursor() as cursor:
+        tables = {'hot': table_stats(cursor, Recipe), 'detail': table_stats(cursor, RecipeDetail)}
+        both = (tables['hot']['pages'] or 0) + (tables['detail']['pages'] or 0)
+        tables['rows_per_page_unsplit'] = round(tables['hot']['rows'] / both, 1) if both else None
+        results['tables'] = tables
+
+        for name, statement in statements.items():
+            hits = reads = rows = 0
+            for page in pages:
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}', [page])
+                plan = cursor.fetchone()[0]
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+                hits += plan['Shared Hit Blocks']
+                reads += plan['Shared Read Blocks']
+                rows += plan['Actual Rows']
+
+            def fetch(page, statement=statement):
+                cursor.execute(statement, [page])
+                cursor.fetchall()
+
+            results[name] = {
+                **measure(fetch, pages),
+                'buffers_per_row': round((hits + reads) / rows, 2) if rows else None,
+                'hit_ratio': round(hits / (hits + reads), 4) if hits + reads else None,
+            }
+    return results
+
+
+@workload('similar_recipes')
+def similar_recipes(options):
+    """
+    Podobne przepisy: dokładne top-10 po Jaccardzie (cała macierz) vs MinHash LSH w kilku konfiguracjach.
+    recall to część dokładnego top-10 znaleziona przez LSH, similarity_ratio - suma podobieństw LSH
+    względem dokładnej (odporna na remisy na granicy top-10).
+    """
+    from api.recipe_matrix import RecipeMatrix
+    from api.similarity import SimilarityIndex, brute_force_similar
+
+    limit = 10
+    rows = list(Recipe.objects.order_by('id').values_list('id', 'ingredient_ids'))
+    rng = random.Random(0)
+    sample = rng.sample([row for row in rows if row[1]], min(options['queries'], len(rows)))
+    matrix = RecipeMatrix.build(rows)
+
+    exact = {}
+    brute_force = measure(
+        lambda row: exact.__setitem__(row[0], brute_force_similar(matrix, row[1], limit, exclude=row[0])), sample
+    )
+    results = {'recipes': len(rows), 'brute_force': brute_force}
+
+    for permutations, bands in ((64, 8), (64, 16), (64, 32), (128, 32)):
+        started = time.perf_counter()
+        index = SimilarityIndex.build(rows, permutations, bands)
+        build_seconds = time.perf_counter() - started
+
+        found = {}
+        timing = measure(
+            lambda row: found.__setitem__(row[0], index.similar(
+                row[1], limit, exclude=row[0], max_bucket=settings.SIMILARITY_MAX_BUCKET
+            )),
+            sample,
+        )
+        recall, ratio = [], []
+        for recipe_id, expected in exact.items():
+            if not expected:
+                continue
+            expected_ids = {similar_id for similar_id, _ in expected}
+            recall.append(len(expected_ids & {similar_id for similar_id, _ in found[recipe_id]}) / len(expected))
+            ratio.append(sum(similarity for _, similarity in found[recipe_id]) / sum(s for _, s in expected))
+        results[f'lsh_{permutations}x{bands}'] = {
+            'build_s': round(build_seconds, 2),
+            'recall': round(statistics.fmean(recall), 3) if recall else None,
+            'similarity_ratio': round(statistics.fmean(ratio), 3) if ratio else None,
+            **timing,
+        }
+    return results
+
+
+@workload('personalization')
+def personalization(options):
+    """
+    Narzut personalize=true: bazowy ranking vs ten sam ranking przestawiony według profilu z ulubionych.
+    Oba przy ciepłym cache rankingów, więc różnica to pobranie większej puli, składników puli i sortowanie.
+    """
+    from api.personalization import get_profile_cache, load_profile, recommend_personalized
+    from api.ranking import DEFAULT_RANKING
+    from api.recommendations import DEFAULT_LIMIT, recommend
+
+    inputs = sample_ingredient_lists(options['queries'], 5)
+    if not inputs:
+        return {'error': 'brak przepisów w bazie'}
+    rng = random.Random(0)
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:10000])
+    favourite_ids = rng.sample(recipe_ids, min(50, len(recipe_ids)))
+
+    with transaction.atomic():
+        user = User.objects.create_user(username=f'benchmark-{time.time_ns()}')
+        FavouriteRecipe.objects.bulk_create([FavouriteRecipe(user=user, recipe_id=pk) for pk in favourite_ids])
+        for ingredients in inputs:
+            recommend_personalized(ingredients, user.id, DEFAULT_LIMIT, DEFAULT_RANKING)
+
+        results = {
+            'favourites': FavouriteRecipe.objects.filter(user=user).count(),
+            'profile_load': measure(lambda _: load_profile(user.id), range(min(options['queries'], 20))),
+            'base': measure(lambda ingredients: recommend(ingredients, DEFAULT_LIMIT), inputs),
+            'personalized': measure(
+                lambda ingredients: recommend_personalized(ingredients, user.id, DEFAULT_LIMIT, DEFAULT_RANKING),
+                inputs,
+            ),
+        }
+        results['overhead_p50_ms'] = round(results['personalized']['p50_ms'] - results['base']['p50_ms'], 3)
+        get_profile_cache().local.clear()
+        transaction.set_rollback(True)
+    return results
+
+
+# Syntetyczny korpus przepisów (manage.py benchmark --corpus-size 10000|100000|1000000).
+# Przepisy są generowane paczkami po CORPUS_CHUNK z ziarnem zależnym tylko od numeru paczki,
+# więc korpus 100k zawiera dokładnie korpus 10k, a wyniki z różnych commitów są porównywalne.
+# Popularność składników ma rozkład Zipfa - jak w RecipeNLG, gdzie sól czy jajka są w co
+# drugim przepisie, a większość składników w pojedynczych.
+
+SYNTHETIC_SOURCE = 'Synthetic benchmark'
+CORPUS_CHUNK = 10000
+CORPUS_INGREDIENTS = 5000
+
+_corpus_names = None
+
+
+def corpus_names():
+    global _corpus_names
+    if _corpus_names is None:
+        _corpus_names = [canonicalize(f'synthetic ingredient {k}') for k in range(CORPUS_INGREDIENTS)]
+    return _corpus_names
+
+
+def corpus_chunk(number, seed=0):
+    """Zwraca CORPUS_CHUNK par (pola Recipe, nazwy składników) - w formacie wyniku parse_row."""
+    import numpy as np
+
+    rng = np.random.default_rng([seed, number])
+    popularity = 1 / np.arange(1, CORPUS_INGREDIENTS + 1)
+    cdf = np.cumsum(popularity) / popularity.sum()
+    sizes = rng.integers(3, 16, CORPUS_CHUNK)
+    draws = np.searchsorted(cdf, rng.random(int(sizes.sum())))
+
+    names = corpus_names()
+    parsed = []
+    for i, drawn in enumerate(np.split(draws, np.cumsum(sizes)[:-1])):
+        n = number * CORPUS_CHUNK + i
+        ner = [names[k] for k in dict.fromkeys(drawn.tolist())]
+        parsed.append(({
+            'title': f'Synthetic recipe {n}',
+            'ingredients': [f'{1 + n % 4} c. {name}' for name in ner],
+            'directions': ['Mix everything.', 'Cook for 20 minutes.'],
+            'link': f'www.example.com/benchmark/{n}',
+            'source': SYNTHETIC_SOURCE,
+            'ner': ner,
+            'site': 'www.example.com',
+        }, set(ner)))
+    return parsed
+
+
+def drop_corpus():
+    """
+    Usuwa syntetyczny korpus jednym DELETE (bez ładowania milionów obiektów dla sygnałów);
+    wpisy dziennika zmian dopisuje jednym INSERT ... SELECT.
+    """
+    from api import update_log
+
+    synthetic = f'SELECT recipe_id FROM {RecipeDetail._meta.db_table} WHERE source = %s'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {RecipeChange._meta.db_table} (recipe_id, old_ingredient_ids, ingredient_ids, created_at) '
+            f'SELECT id, ingredient_ids, NULL, now() FROM {Recipe._meta.db_table} WHERE id IN ({synthetic})',
+            [SYNTHETIC_SOURCE],
+        )
+        cursor.execute(
+            f'DELETE FROM {FavouriteRecipe._meta.db_table} WHERE recipe_id IN ({synthetic})', [SYNTHETIC_SOURCE],
+        )
+        cursor.execute(
+            f'WITH deleted AS (DELETE FROM {RecipeDetail._meta.db_table} WHERE source = %s RETURNING recipe_id) '
+            f'DELETE FROM {Recipe._meta.db_table} WHERE id IN (SELECT recipe_id FROM deleted)',
+            [SYNTHETIC_SOURCE],
+        )
+        deleted = cursor.rowcount
+    # Wpisy dopisane wprost w SQL (bez record_changes) - indeks / macierz tego procesu dogrywają je od razu.
+    update_log.sync_now()
+    return deleted
+
+
+def ensure_corpus(size, log=print):
+    """
+    Doprowadza syntetyczny korpus w bazie do size przepisów, dopisując brakujące paczki.
+    Zwraca True, jeśli tabela Recipe się zmieniła (trzeba przebudować indeks/macierz).
+    """
+    from api.import_recipes import write_chunk
+
+    existing = RecipeDetail.objects.filter(source=SYNTHETIC_SOURCE).count()
+    if existing == size:
+        return False
+    if existing > size or existing % CORPUS_CHUNK:
+        log(f"Usuwanie korpusu {existing} przepisów")
+        drop_corpus()
+        existing = 0
+
+    started = time.perf_counter()
+    for number in range(existing // CORPUS_CHUNK, -(-size // CORPUS_CHUNK)):
+        parsed = corpus_chunk(number)[:size - number * CORPUS_CHUNK]
+        write_chunk(parsed, log)
+        log(f"Korpus: {number * CORPUS_CHUNK + len(parsed)}/{size} ({time.perf_counter() - started:.0f} s)")
+    return True
+
+
+def prepare_backend():
+    """Przebudowuje w tym procesie strukturę używaną przez RECOMMEND_BACKEND po zmianie korpusu."""
+    if settings.RECOMMEND_BACKEND == 'index':
+        from api.ingredient_index import rebuild_index
+
+        rebuild_index()
+    elif settings.RECOMMEND_BACKEND == 'matrix':
+        from api.recipe_matrix import rebuild_matrix
+
+        rebuild_matrix()
+
+
+@workload('recommend_latency')
+def recommend_latency(options):
+    """
+    Percentyle czasu widoku recommend_recipes (parsowanie, ranking, hydratacja, renderowanie JSON)
+    dla list o różnej liczbie składników: 'cold' - pusty cache wyników przed każdym zapytaniem,
+    'warm' - te same zapytania ponownie, z cache.
+    """
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from api.recommendations import get_result_cache
+    from api.views import recommend_recipes
+
+    factory = APIRequestFactory()
+    user = User(username='benchmark')
+
+    def call(ingredients):
+        request = factory.post('/api/recommend/', {'ingredients': ingredients, 'limit': options['limit']}, format='json')
+        force_authenticate(request, user)
+        response = recommend_recipes(request)
+        response.render()
+        if response.status_code != 200:
+            raise RuntimeError(f"recommend_recipes: {response.status_code} {response.content[:200]!r}")
+
+    def cold(ingredients):
+        get_result_cache().local.clear()
+        call(ingredients)
+
+    queries = {size: sample_ingredient_lists(options['queries'], size, seed=size) for size in options['ingredient_sizes']}
+    if not any(queries.values()):
+        return {'error': 'brak przepisów w bazie'}
+
+    # Pierwsze zapytanie buduje indeks/ładuje macierz - mierzone osobno.
+    started = time.perf_counter()
+    call(next(lists for lists in queries.values() if lists)[0])
+    results = {
+        'recipes': Recipe.objects.count(),
+        'backend': settings.RECOMMEND_BACKEND,
+        'limit': options['limit'],
+        'first_request_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    for size, lists in queries.items():
+        if lists:
+            results[f'{size}_ingredients'] = {'cold': measure(cold, lists), 'warm': measure(call, lists)}
+    return results
+
+
+@workload('sharded_scoring')
+def sharded_scoring(options):
+    """
+    Ranking macierzą jednego zapytania w procesie workera vs ShardedScorer z kolejnymi liczbami shardów.
+    Macierz jest budowana z bazy do katalogu tymczasowego (z --corpus-size najlepiej 1000000+);
+    speedup = p50 jednego procesu / p50 z shardami. Powyżej liczby rdzeni (cpu_count) przestaje rosnąć.
+    """
+    import tempfile
+
+    from api.recipe_matrix import LiveMatrix, RecipeMatrix
+    from api.sharding import ShardedScorer
+    from api.vocabulary import get_vocabulary
+
+    vocabulary = get_vocabulary()
+    queries = [
+        vocabulary.lookup(ingredients)
+        for ingredients in sample_ingredient_lists(options['queries'], options['ingredients'])
+    ]
+    k = options['limit']
+    cpus = os.cpu_count() or 1
+    shard_counts = options['shards'] or [n for n in (1, 2, 4, 8, 16, 32) if n <= max(cpus, 2)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        RecipeMatrix.from_database().save(directory)
+        live = LiveMatrix(RecipeMatrix.load(directory), Path(directory))
+        expected = [live.top_k(ingredient_ids, k) for ingredient_ids in queries]
+        single = measure(lambda ingredient_ids: live.top_k(ingredient_ids, k), queries)
+        results = {'recipes': len(live.base.recipe_ids), 'cpu_count': cpus, 'single_process': single}
+
+        for shards in shard_counts:
+            scorer = ShardedScorer(shards)
+            try:
+                # Rozgrzewka: procesy puli mapują pokolenie i przygotowują swoje shardy.
+                for _ in range(3):
+                    scorer.top_k_many(live, queries[:1], k)
+                timing = measure(lambda ingredient_ids: scorer.top_k_many(live, [ingredient_ids], k), queries)
+                matches = scorer.top_k_many(live, queries, k) == expected
+            finally:
+                scorer.close()
+            results[f'shards_{shards}'] = {
+                **timing,
+                'speedup': round(single['p50_ms'] / timing['p50_ms'], 2) if timing['p50_ms'] else None,
+                'matches_single_process': matches,
+            }
+    return results
+
+
+def write_recipe_csv(path, rows, seed=1):
+    """Plik w formacie RecipeNLG z przepisami korpusu (innym ziarnem niż korpus w bazie)."""
+    import csv
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['', 'title', 'ingredients', 'directions', 'link', 'source', 'NER', 'site'])
+        for number in range(-(-rows // CORPUS_CHUNK)):
+            for i, (fields, _) in enumerate(corpus_chunk(number, seed)[:rows - number * CORPUS_CHUNK]):
+                writer.writerow([
+                    number * CORPUS_CHUNK + i, fields['title'], json.dumps(fields['ingredients']),
+                    json.dumps(fields['directions']), fields['link'], fields['source'],
+                    json.dumps(fields['ner']), fields['site'],
+                ])
+
+
+@workload('import_throughput')
+def import_throughput(options):
+    """
+    Przepustowość import_recipes_from_csv (czytanie, parsowanie w puli procesów, bulk_create)
+    dla syntetycznego CSV. Import jest wycofywany - baza zostaje bez zmian.
+    """
+    import tempfile
+
+    from api.import_recipes import import_recipes_from_csv
+    from api.vocabulary import get_vocabulary
+
+    rows = options['import_rows']
+    # Składniki korpusu zapisujemy przed transakcją - wycofane wiersze Ingredient zostałyby w słowniku w pamięci.
+    vocabulary = get_vocabulary()
+    vocabulary.add_names(set(corpus_names()) - vocabulary.ids.keys())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'recipes.csv')
+        write_recipe_csv(path, rows)
+        size_mb = os.path.getsize(path) / 2 ** 20
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            success, failed = import_recipes_from_csv(
+                path, chunk_size=options['chunk_size'], workers=options['workers'], log=lambda *args: None
+            )
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+    return {
+        'rows': rows,
+        'csv_mb': round(size_mb, 1),
+        'chunk_size': options['chunk_size'],
+        'workers': options['workers'] or os.cpu_count(),
+        'imported': success,
+        'failed': failed,
+        'seconds': round(elapsed, 2),
+        'rows_per_s': round(rows / elapsed, 1),
+    }
+
+
+class StubBoxes:
+    def __init__(self):
+        self.xyxy = [[10.0, 20.0, 110.0, 140.0]]
+        self.cls = [0]
+        self.conf = [0.9]
+
+
+class StubResult:
+    names = {0: 'tomato'}
+
+    def __init__(self):
+        self.boxes = StubBoxes()
+
+
+class StubModel:
+    """Zamiast YOLO: jedno wykrycie na obraz i stały czas inferencji na paczkę."""
+
+    def __init__(self, inference_ms):
+        self.inference_ms = inference_ms
+
+    def predict(self, images, verbose=False):
+        time.sleep(self.inference_ms / 1000)
+        return [StubResult() for _ in images]
+
+
+@workload('process_image_throughput')
+def process_image_throughput(options):
+    """
+    Przepustowość widoku process_image przy concurrency równoległych klientach: dekodowanie
+    i skalowanie zdjęć, kolejka BatchingDetector i odpowiedź - z modelem-atrapą (--stub-inference-ms)
+    albo prawdziwym, małym modelem (--detection-model). Każde zdjęcie jest inne, więc cache nie pomaga.
+    """
+    import threading
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from api import detection
+    from api.views import process_image
+
+    if options['detection_model']:
+        from ultralytics import YOLO
+
+        def model_factory():
+            return YOLO(options['detection_model'])
+    else:
+        def model_factory():
+            return StubModel(options['stub_inference_ms'])
+
+    image_bytes = make_sample_jpeg(1600, 1200)
+    factory = APIRequestFactory()
+    user = User(username='benchmark')
+    counter = iter(range(options['images']))
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            # Doklejony ogon zmienia hash treści, a dekoder JPEG go ignoruje.
+            upload = SimpleUploadedFile('photo.jpg', image_bytes + str(i).encode(), 'image/jpeg')
+            request = factory.post('/api/process-image/', {'image': upload}, format='multipart')
+            force_authenticate(request, user)
+            started = time.perf_counter()
+            response = process_image(request)
+            response.render()
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+
+    # Detektor i wersja wag (część klucza cache) podmienione tylko na czas pomiaru.
+    previous = detection._detector, detection._weights_version
+    detection._weights_version = options['detection_model'] or 'benchmark-stub'
+    detection._detector = detector = detection.BatchingDetector(
+        model_factory,
+        batch_size=settings.DETECTION_BATCH_SIZE,
+        max_wait=settings.DETECTION_BATCH_WAIT_MS / 1000,
+        queue_size=settings.DETECTION_QUEUE_SIZE,
+        workers=settings.DETECTION_WORKERS,
+    )
+    try:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        detection._detector, detection._weights_version = previous
+
+    stats = detector.stats()
+    return {
+        'model': options['detection_model'] or f"stub ({options['stub_inference_ms']} ms/paczka)",
+        'concurrency': options['concurrency'],
+        **summarize(latencies, statuses, elapsed),
+        'avg_batch_size': stats['avg_batch_size'],
+    }
+
+
+def run_metadata(options):
+    """Kontekst pomiaru zapisywany obok wyników - do porównań między commitami."""
+    import datetime
+    import platform
+
+    def git(*args):
+        try:
+            return subprocess.run(
+                ['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(status) if status is not None else None,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'recommend_backend': settings.RECOMMEND_BACKEND,
+        'recipes': Recipe.objects.count(),
+        'corpus_size': options['corpus_size'],
+        'queries': options['queries'],
+    }
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, current):
+    """
+    Porównanie dwóch przebiegów (wynikowych JSON-ów) - zmiany czasów (*_ms, *_s) i przepustowości
+    (*_rps, *_per_s). Zwraca listę (klucz, poprzednio, teraz, zmiana w %, czy to poprawa).
+    """
+    before, after = flatten(baseline.get('results', baseline)), flatten(current.get('results', current))
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        if key.endswith(('_rps', '_per_s')):
+            lower_is_better = False
+        elif key.endswith(('_ms', '_s')):
+            lower_is_better = True
+        else:
+            continue
+        old, new = before[key], after[key]
+        change = round((new - old) / old * 100, 1) if old else None
+        improved = change is not None and (change < 0 if lower_is_better else change > 0)
+        rows.append((key, old, new, change, improved))
+    return rows
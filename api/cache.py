@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+class LRUCache:
+    """Cache w pamięci procesu: najwyżej max_entries wpisów, każdy ważny przez ttl sekund."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ResultCache:
+    """
+    Dwupoziomowy cache wyników: lokalne LRU + opcjonalnie wspólny backend z settings.CACHES
+    (np. Redis), dzięki któremu trafienia widzą wszystkie workery. max_entries=0 wyłącza lokalne LRU.
+    """
+
+    MISSING = object()
+
+    def __init__(self, prefix, max_entries, ttl, backend=None):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = LRUCache(max_entries, ttl)
+        self.shared = caches[backend] if backend else None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.local.get(key, self.MISSING)
+        if value is not self.MISSING:
+            self.hits += 1
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(f'{self.prefix}:{key}', self.MISSING)
+            if value is not self.MISSING:
+                self.shared_hits += 1
+                self.local.set(key, value)
+                return value
+
+        self.misses += 1
+        return self.MISSING
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(f'{self.prefix}:{key}', value, self.ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(f'{self.prefix}:{key}')
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'entries': len(self.local),
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from statistics import median
+
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+
+from api import metrics
+from api.cache import ResultCache
+from api.executors import run_in_executor
+from api.imaging import prepare_image, scale_box
+
+
+class DetectorBusy(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class BatchingDetector:
+    """
+    Kolejka zapytań do modelu YOLO: wątki robocze zbierają obrazy przez max_wait sekund
+    (albo do batch_size sztuk) i wywołują predict na całej paczce.
+    Każdy wątek ma własną instancję modelu - YOLO nie jest bezpieczny wątkowo.
+    """
+
+    def __init__(self, model_factory, batch_size=8, max_wait=0.01, queue_size=32, workers=1):
+        self.model_factory = model_factory
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batches = 0
+        self.images = 0
+        self.recent = deque(maxlen=256)  # (rozmiar paczki, czas predict w sekundach)
+        self.stats_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, args=(model_factory(),), name=f'detector-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, image):
+        future = Future()
+        try:
+            self.queue.put_nowait((image, future))
+        except queue.Full:
+            raise DetectorBusy()
+        return future
+
+    def predict(self, image, timeout=None):
+        future = self.submit(image)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def _collect_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, model):
+        while True:
+            batch = [(image, future) for image, future in self._collect_batch() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            images = [image for image, _ in batch]
+            futures = [future for _, future in batch]
+
+            started = time.perf_counter()
+            try:
+                results = model.predict(images, verbose=False)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - started
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+            with self.stats_lock:
+                self.batches += 1
+                self.images += len(images)
+                self.recent.append((len(images), elapsed))
+
+    def stats(self):
+        with self.stats_lock:
+            recent = list(self.recent)
+            batches, images = self.batches, self.images
+
+        latencies = sorted(elapsed * 1000 for _, elapsed in recent)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'workers': len(self.threads),
+            'batches': batches,
+            'images': images,
+            'avg_batch_size': round(images / batches, 2) if batches else 0,
+            'recent_batch_sizes': [size for size, _ in recent[-20:]],
+            'batch_latency_p50_ms': round(median(latencies), 2) if latencies else None,
+            'batch_latency_p95_ms': round(latencies[int(len(latencies) * 0.95)], 2) if latencies else None,
+        }
+
+
+def load_model():
+    # ultralytics (a z nim torch) importujemy dopiero tutaj - procesy bez detekcji go nie ładują.
+    from ultralytics import YOLO
+
+    return YOLO(settings.DETECTION_MODEL_PATH)
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = BatchingDetector(
+                    load_model,
+                    batch_size=settings.DETECTION_BATCH_SIZE,
+                    max_wait=settings.DETECTION_BATCH_WAIT_MS / 1000,
+                    queue_size=settings.DETECTION_QUEUE_SIZE,
+                    workers=settings.DETECTION_WORKERS,
+                )
+    return _detector
+
+
+def is_loaded():
+    return _detector is not None
+
+
+def warmup():
+    """
+    Ładuje modele i wykonuje jedno puste predict (inicjalizacja torch), żeby pierwsze
+    prawdziwe zapytanie nie płaciło za start. Do wywołania np. z hooka post_fork gunicorna.
+    """
+    get_detector().predict(Image.new('RGB', (64, 64)), timeout=settings.DETECTION_TIMEOUT)
+
+
+_weights_version = None
+_result_cache = None
+
+
+def weights_version():
+    """Wersja wag do klucza cache: z ustawień albo z rozmiaru i czasu modyfikacji pliku modelu."""
+    global _weights_version
+    if _weights_version is None:
+        _weights_version = getattr(settings, 'DETECTION_WEIGHTS_VERSION', None)
+        if not _weights_version:
+            stat = os.stat(settings.DETECTION_MODEL_PATH)
+            _weights_version = f'{stat.st_size}-{stat.st_mtime_ns}'
+    return _weights_version
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(
+            'detection',
+            max_entries=settings.DETECTION_CACHE_SIZE,
+            ttl=settings.DETECTION_CACHE_TTL,
+            backend=settings.DETECTION_CACHE_BACKEND,
+        )
+    return _result_cache
+
+
+def content_key(image_file):
+    digest = hashlib.sha256()
+    for chunk in image_file.chunks():
+        digest.update(chunk)
+    image_file.seek(0)
+    return f'{digest.hexdigest()}:{weights_version()}:{settings.DETECTION_IMAGE_SIZE}'
+
+
+def detect(image_file, timings=None):
+    """
+    Zwraca listę wykrytych składników ({label, confidence, box}) dla przesłanego pliku.
+    Wynik jest cache'owany po hashu zawartości - ponownie przesłane zdjęcie nie jest nawet dekodowane.
+    Do słownika timings (jeśli podany) trafiają czasy etapów 'preprocess' i 'inference' w ms.
+    """
+    started = time.perf_counter()
+    key, ingredients, image, scale = _lookup_or_prepare(image_file)
+    started = _record(timings, 'preprocess', started)
+    if ingredients is not ResultCache.MISSING:
+        return ingredients
+
+    results = get_detector().predict(image, timeout=settings.DETECTION_TIMEOUT)
+    ingredients = _store_result(key, results, scale)
+    _record(timings, 'inference', started)
+    return ingredients
+
+
+async def detect_async(image_file, timings=None):
+    """
+    detect() dla widoków async: hashowanie i dekodowanie idą do puli 'preprocess',
+    a na wynik modelu czekamy na future z BatchingDetector bez blokowania wątku.
+    """
+    started = time.perf_counter()
+    key, ingredients, image, scale = await run_in_executor('preprocess', _lookup_or_prepare, image_file)
+    started = _record(timings, 'preprocess', started)
+    if ingredients is not ResultCache.MISSING:
+        return ingredients
+
+    detector = get_detector() if is_loaded() else await run_in_executor('preprocess', get_detector)
+    future = detector.submit(image)
+    try:
+        results = await asyncio.wait_for(asyncio.wrap_future(future), timeout=settings.DETECTION_TIMEOUT)
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise FutureTimeoutError()
+    ingredients = await run_in_executor('preprocess', _store_result, key, results, scale)
+    _record(timings, 'inference', started)
+    return ingredients
+
+
+def _record(timings, stage, since):
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = round((now - since) * 1000, 2)
+    metrics.record(stage, now - since)
+    return now
+
+
+def _lookup_or_prepare(image_file):
+    """Zwraca (klucz, wynik z cache albo MISSING, obraz, skala) - obraz tylko przy chybieniu."""
+    key = content_key(image_file)
+    ingredients = get_result_cache().get(key)
+    if ingredients is not ResultCache.MISSING:
+        return key, ingredients, None, None
+
+    try:
+        image, scale = prepare_image(image_file, settings.DETECTION_IMAGE_SIZE)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImage() from e
+    return key, ResultCache.MISSING, image, scale
+
+
+def _store_result(key, results, scale):
+    ingredients = []
+    if results.boxes is not None:
+        for box, cls, conf in zip(results.boxes.xyxy, results.boxes.cls, results.boxes.conf):
+            ingredients.append({
+                "label": results.names[int(cls)],
+                "confidence": round(float(conf), 3),
+                "box": [round(float(coord), 2) for coord in scale_box(box, scale)]
+            })
+
+    get_result_cache().set(key, ingredients)
+    return ingredients
+
+
+def parse_confidence(value, default):
+    if value in (None, ''):
+        return default
+    try:
+        confidence = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("min_confidence must be a number between 0 and 1")
+    if not 0 <= confidence <= 1:
+        raise ValueError("min_confidence must be a number between 0 and 1")
+    return confidence
+
+
+def detected_labels(ingredients, min_confidence):
+    """Etykiety z pewnością >= min_confidence, bez powtórzeń, w kolejności wykrycia."""
+    return list(dict.fromkeys(item['label'] for item in ingredients if item['confidence'] >= min_confidence))
@@ -0,0 +1,89 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+# Pule wątków dla widoków async: nazwa -> ustawienie z liczbą wątków.
+EXECUTOR_SETTINGS = {
+    'scoring': 'ASYNC_SCORING_WORKERS',
+    'preprocess': 'ASYNC_PREPROCESS_WORKERS',
+}
+
+# Limity równoległych żądań w widokach async: nazwa -> ustawienie.
+LIMIT_SETTINGS = {
+    'recommend': 'ASYNC_RECOMMEND_CONCURRENCY',
+    'process_image': 'ASYNC_PROCESS_IMAGE_CONCURRENCY',
+}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimit:
+    """
+    Licznik żądań w toku dla jednej pętli zdarzeń. Ponad limit od razu Overloaded (429),
+    zamiast ustawiać kolejne żądania w kolejce do puli wątków.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+
+    def __enter__(self):
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise Overloaded()
+        self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.in_flight -= 1
+
+    def stats(self):
+        return {'limit': self.limit, 'in_flight': self.in_flight, 'rejected': self.rejected}
+
+
+_executors = {}
+_limits = {}
+_lock = threading.Lock()
+
+
+def get_executor(name):
+    if name not in _executors:
+        with _lock:
+            if name not in _executors:
+                _executors[name] = ThreadPoolExecutor(
+                    max_workers=getattr(settings, EXECUTOR_SETTINGS[name]), thread_name_prefix=f'async-{name}'
+                )
+    return _executors[name]
+
+
+def get_limit(name):
+    if name not in _limits:
+        with _lock:
+            if name not in _limits:
+                _limits[name] = ConcurrencyLimit(getattr(settings, LIMIT_SETTINGS[name]))
+    return _limits[name]
+
+
+def _with_connection_cleanup(func):
+    # Wątki puli nie dostają sygnałów request_started/finished - połączenia z bazą sprzątamy sami.
+    def wrapper(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+async def run_in_executor(name, func, *args):
+    """Uruchamia func w dedykowanej puli name (z kontekstem i obsługą połączeń jak sync_to_async)."""
+    return await sync_to_async(
+        _with_connection_cleanup(func), thread_sensitive=False, executor=get_executor(name)
+    )(*args)
@@ -0,0 +1,58 @@
+import fcntl
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Pokolenia struktur zapisywanych na dysk (macierz przepisów): każde budowane jest w osobnym
+# katalogu root/generations/<nazwa>, a plik root/CURRENT wskazuje bieżące. Podmiana CURRENT
+# (os.replace) jest atomowa - workery przełączają się na nowe pokolenie przy najbliższej synchronizacji,
+# a pliki starego, usunięte z dysku, zostają dostępne dla procesów, które jeszcze je mapują.
+
+
+def current_generation(root):
+    """Katalog bieżącego pokolenia; bez pliku CURRENT - sam root (układ sprzed pokoleń)."""
+    root = Path(root)
+    try:
+        name = (root / 'CURRENT').read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return root
+    return root / 'generations' / name
+
+
+def publish(root, write, keep=2):
+    """Zapisuje nowe pokolenie funkcją write(katalog), przestawia CURRENT i usuwa najstarsze pokolenia."""
+    root = Path(root)
+    now = time.time_ns()
+    name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now // 10**9))}.{now % 10**9:09d}-{os.getpid()}"
+    path = root / 'generations' / name
+    write(path)
+
+    pointer = root / f'CURRENT.{os.getpid()}.tmp'
+    pointer.write_text(name, encoding='utf-8')
+    os.replace(pointer, root / 'CURRENT')
+
+    generations = sorted(p for p in (root / 'generations').iterdir() if p.is_dir())
+    for old in generations[:-keep]:
+        if old != path:
+            shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+@contextmanager
+def exclusive(root):
+    """Blokada budowania pokolenia (flock) - zwraca False, jeśli buduje już inny proces."""
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / 'build.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
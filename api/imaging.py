@@ -0,0 +1,33 @@
+from PIL import ExifTags, Image, ImageOps
+
+
+# Orientacje EXIF, w których obraz po obrocie ma zamienioną szerokość z wysokością.
+SWAPPED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def prepare_image(image_file, target_size):
+    """
+    Wczytuje zdjęcie od razu w rozmiarze wejścia modelu: JPEG dekodowany jest w zmniejszonej
+    skali (Image.draft), potem obrót wg EXIF i jedno skalowanie do target_size po dłuższym boku.
+
+    Zwraca (obraz, (skala_x, skala_y)) - mnożniki przeliczające współrzędne z obrazu
+    wejściowego na oryginalną rozdzielczość (po uwzględnieniu orientacji EXIF).
+    """
+    image = Image.open(image_file)
+    width, height = image.size
+    if image.getexif().get(ExifTags.Base.Orientation, 1) in SWAPPED_ORIENTATIONS:
+        width, height = height, width
+
+    image.draft('RGB', (target_size, target_size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((target_size, target_size))
+
+    return image, (width / image.width, height / image.height)
+
+
+def scale_box(box, scale):
+    scale_x, scale_y = scale
+    x1, y1, x2, y2 = box
+    return [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
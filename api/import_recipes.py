@@ -1,32 +1,179 @@
-import csv
 import ast
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.db import DatabaseError, transaction
+
+from api.ingredients import canonical_names
 from api.models import Recipe
+from api.update_log import record_changes
+from api.vocabulary import get_vocabulary
+
+
+def parse_list(value):
+    # Kolumny RecipeNLG to prawie zawsze poprawny JSON - ast.literal_eval tylko jako zapas.
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+def parse_row(row):
+    ner = parse_list(row['NER'])
+    return {
+        'title': row['title'][:255],
+        'ingredients': parse_list(row['ingredients']),
+        'directions': parse_list(row['directions']),
+        'link': row['link'],
+        'source': row['source'],
+        'ner': ner,
+        'site': row['site'],
+    }, canonical_names(ner)
+
 
-def import_recipes_from_csv(csv_file_path):
-    success = 0
-    failed = 0
+def parse_chunk(rows):
+    """Uruchamiane w puli procesów: parsuje wiersze, błędy zbiera zamiast przerywać chunk."""
+    parsed, errors = [], []
+    for row in rows:
+        try:
+            parsed.append(parse_row(row))
+        except Exception as e:
+            errors.append((row.get('title', '[brak tytułu]'), str(e)))
+    return parsed, errors
 
+
+def read_chunks(csv_file_path, chunk_size, skip_rows=0):
     with open(csv_file_path, mode='r', encoding='utf-8') as csvfile:
         reader = csv.DictReader(csvfile)
-        for row in reader:
-            try:
-                ingredients = ast.literal_eval(row['ingredients'])
-                directions = ast.literal_eval(row['directions'])
-                ner = ast.literal_eval(row['NER'])
-
-                Recipe.objects.create(
-                    title=row['title'][:255],
-                    ingredients=ingredients,
-                    directions=directions,
-                    link=row['link'],
-                    source=row['source'],
-                    ner=ner,
-                    site=row['site']
-                )
-                success += 1
-            except Exception as e:
-                print(f"⚠️ Błąd w wierszu: {row.get('title', '[brak tytułu]')}")
-                print(f"   Powód: {e}")
-                failed += 1
-
-    print(f"\n✅ Zakończono import: {success} dodanych, {failed} pominiętych.")
\ No newline at end of file
+        for _ in islice(reader, skip_rows):
+            pass
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield rows
+
+
+def load_checkpoint(checkpoint_path, source):
+    """
+    Checkpoint pamięta plik źródłowy i liczbę przetworzonych wierszy CSV (nie chunków), więc wznowienie
+    nie zależy od --chunk-size. Checkpoint innego pliku (albo w starym formacie) nie jest wznawiany.
+    """
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('source') != source or 'rows' not in checkpoint:
+            raise ValueError(
+                f"Checkpoint {checkpoint_path} dotyczy innego importu ({checkpoint.get('source')}); "
+                f"użyj --restart albo innego --checkpoint."
+            )
+        return checkpoint
+    return {'source': source, 'rows': 0, 'chunks': 0, 'success': 0, 'failed': 0, 'finished': False}
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    if not checkpoint_path:
+        return
+    tmp_path = f'{checkpoint_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def report_row_error(title, reason, log):
+    log(f"⚠️ Błąd w wierszu: {title}")
+    log(f"   Powód: {reason}")
+
+
+def write_chunk(parsed, log):
+    """Zapisuje chunk jednym bulk_create (przepisy i szczegóły); gdy baza odrzuci paczkę, zapisuje wiersz po wierszu."""
+    vocabulary = get_vocabulary()
+    vocabulary.add_names({name for _, names in parsed for name in names} - vocabulary.ids.keys())
+
+    rows = [(fields, sorted(vocabulary.ids[name] for name in names)) for fields, names in parsed]
+    try:
+        with transaction.atomic():
+            recipes = Recipe.objects.bulk_create_with_detail(rows)
+            record_changes([(recipe.pk, None, recipe.ingredient_ids) for recipe in recipes])
+        return len(recipes), 0
+    except DatabaseError:
+        pass
+
+    success = failed = 0
+    for row in rows:
+        try:
+            with transaction.atomic():
+                recipe, = Recipe.objects.bulk_create_with_detail([row])
+                record_changes([(recipe.pk, None, recipe.ingredient_ids)])
+            success += 1
+        except DatabaseError as e:
+            report_row_error(row[0]['title'], e, log)
+            failed += 1
+    return success, failed
+
+
+def import_recipes_from_csv(csv_file_path, chunk_size=2000, workers=None, checkpoint_path=None, log=print):
+    """
+    Strumieniowy import CSV z RecipeNLG: wiersze są czytane chunkami, parsowane w puli procesów
+    i zapisywane przez bulk_create. Po każdym zapisanym chunku aktualizowany jest checkpoint,
+    więc przerwany import można wznowić od pierwszego niezapisanego wiersza.
+    """
+    checkpoint = load_checkpoint(checkpoint_path, os.path.abspath(csv_file_path))
+    if checkpoint['finished']:
+        log(f"Import {csv_file_path} był już zakończony (checkpoint: {checkpoint_path}).")
+        return checkpoint['success'], checkpoint['failed']
+    if checkpoint['rows']:
+        log(f"Wznawianie od wiersza {checkpoint['rows']}.")
+
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    imported_rows = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+        chunks = read_chunks(csv_file_path, chunk_size, skip_rows=checkpoint['rows'])
+        pending = []
+
+        # Najwyżej 2 chunki na proces w locie - plik nie jest wczytywany w całości do pamięci.
+        for rows in chunks:
+            pending.append(executor.submit(parse_chunk, rows))
+            if len(pending) < workers * 2:
+                continue
+            imported_rows += _write_parsed(pending.pop(0).result(), checkpoint, checkpoint_path, log)
+            _report_progress(checkpoint, imported_rows, started, log)
+
+        for future in pending:
+            imported_rows += _write_parsed(future.result(), checkpoint, checkpoint_path, log)
+            _report_progress(checkpoint, imported_rows, started, log)
+
+    checkpoint['finished'] = True
+    save_checkpoint(checkpoint_path, checkpoint)
+
+    log(f"\n✅ Zakończono import: {checkpoint['success']} dodanych, {checkpoint['failed']} pominiętych.")
+    return checkpoint['success'], checkpoint['failed']
+
+
+def _write_parsed(result, checkpoint, checkpoint_path, log):
+    parsed, errors = result
+    for title, reason in errors:
+        report_row_error(title, reason, log)
+
+    success, failed = write_chunk(parsed, log) if parsed else (0, 0)
+    checkpoint['rows'] += len(parsed) + len(errors)
+    checkpoint['chunks'] += 1
+    checkpoint['success'] += success
+    checkpoint['failed'] += failed + len(errors)
+    save_checkpoint(checkpoint_path, checkpoint)
+    return len(parsed) + len(errors)
+
+
+def _report_progress(checkpoint, imported_rows, started, log):
+    elapsed = time.perf_counter() - started
+    log(
+        f"chunk {checkpoint['chunks']}: {checkpoint['success']} dodanych, {checkpoint['failed']} pominiętych "
+        f"({imported_rows / elapsed:.0f} wierszy/s)"
+    )
@@ -0,0 +1,237 @@
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import connection
+
+from api import update_log
+from api.models import Recipe
+from api.ranking import idf
+
+
+class IngredientIndex:
+    """
+    Odwrócony indeks składników trzymany w pamięci procesu:
+    Ingredient.id -> posortowana lista id przepisów (posting list)
+    oraz liczba unikalnych składników każdego przepisu.
+    Wagi idf (dla rankingu 'idf') są liczone przy pierwszym użyciu i potem utrzymywane przyrostowo.
+    Zmiany przepisów dochodzą przyrostowo z dziennika RecipeChange (follower, apply_changes).
+    """
+
+    def __init__(self):
+        self.follower = None
+        self.postings = {}
+        self.sizes = array('H')
+        self.idf = None  # Ingredient.id -> idf
+        self.weights = None  # recipe_id -> suma idf składników przepisu
+        self.recipe_count = 0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, rows):
+        index = cls()
+        postings = {}
+        for recipe_id, ingredient_ids in rows:
+            index._set_size(recipe_id, len(ingredient_ids))
+            for ingredient_id in ingredient_ids:
+                postings.setdefault(ingredient_id, []).append(recipe_id)
+
+        index.postings = {ingredient_id: array('q', sorted(ids)) for ingredient_id, ids in postings.items()}
+        return index
+
+    @classmethod
+    def from_database(cls):
+        # Pozycja w dzienniku sprzed odczytu - zmiany zatwierdzone w trakcie budowy zostaną dograne.
+        position = update_log.latest_change_id()
+        rows = Recipe.objects.order_by('id').values_list('id', 'ingredient_ids').iterator(chunk_size=5000)
+        index = cls.build(rows)
+        index.follower = update_log.ChangeFollower(position)
+        return index
+
+    def _set_size(self, recipe_id, size):
+        if recipe_id >= len(self.sizes):
+            self.sizes.extend([0] * (recipe_id + 1 - len(self.sizes)))
+        self.sizes[recipe_id] = min(size, 0xFFFF)
+
+    def size(self, recipe_id):
+        return self.sizes[recipe_id] if recipe_id < len(self.sizes) else 0
+
+    def add(self, recipe_id, ingredient_ids):
+        with self.lock:
+            for ingredient_id in ingredient_ids:
+                posting = self.postings.setdefault(ingredient_id, array('q'))
+                position = bisect_left(posting, recipe_id)
+                if position == len(posting) or posting[position] != recipe_id:
+                    insort(posting, recipe_id)
+            self._set_size(recipe_id, len(ingredient_ids))
+            if self.weights is not None:
+                self._set_weight(recipe_id, ingredient_ids)
+
+    def remove(self, recipe_id, ingredient_ids):
+        with self.lock:
+            for ingredient_id in ingredient_ids:
+                posting = self.postings.get(ingredient_id)
+                if posting is None:
+                    continue
+                position = bisect_left(posting, recipe_id)
+                if position < len(posting) and posting[position] == recipe_id:
+                    del posting[position]
+                if not posting:
+                    del self.postings[ingredient_id]
+            if recipe_id < len(self.sizes):
+                self.sizes[recipe_id] = 0
+            if self.weights is not None and recipe_id < len(self.weights) and self.weights[recipe_id]:
+                self.weights[recipe_id] = 0
+                self.recipe_count -= 1
+
+    def apply_changes(self, changes):
+        """Wpisy dziennika [(recipe_id, stare ingredient_ids, nowe)] - None oznacza brak przepisu."""
+        for recipe_id, old_ingredient_ids, ingredient_ids in changes:
+            with self.lock:
+                if old_ingredient_ids is not None:
+                    self.remove(recipe_id, old_ingredient_ids)
+                if ingredient_ids is not None:
+                    self.add(recipe_id, ingredient_ids)
+
+    def match(self, ingredient_ids):
+        """Zwraca {recipe_id: liczba dopasowanych składników} - scalanie posting list."""
+        counts = Counter()
+        with self.lock:
+            for ingredient_id in ingredient_ids:
+                posting = self.postings.get(ingredient_id)
+                if posting:
+                    counts.update(posting)
+        return counts
+
+    def match_many(self, queries):
+        """
+        match() dla wielu zapytań: każda posting lista jest odczytywana raz
+        i doliczana do wszystkich zapytań, które zawierają dany składnik.
+        """
+        counts = [Counter() for _ in queries]
+        positions = defaultdict(list)
+        for position, ingredient_ids in enumerate(queries):
+            for ingredient_id in ingredient_ids:
+                positions[ingredient_id].append(position)
+
+        with self.lock:
+            for ingredient_id, query_positions in positions.items():
+                posting = self.postings.get(ingredient_id)
+                if not posting:
+                    continue
+                for position in query_positions:
+                    counts[position].update(posting)
+        return counts
+
+    def match_arrays(self, ingredient_ids, weighted=False):
+        """
+        match() w wersji NumPy: (recipe_ids, match_count, total_ingredients), a z weighted=True
+        dodatkowo sumy idf dopasowanych składników i wszystkich składników przepisu.
+        Posting listy są sklejane i zliczane przez np.bincount - bez pętli po przepisach.
+        """
+        if weighted:
+            self.ensure_weights()
+
+        with self.lock:
+            found = [ingredient_id for ingredient_id in ingredient_ids if self.postings.get(ingredient_id)]
+            if not found:
+                empty = np.empty(0, dtype=np.int64)
+                return (empty, empty, empty) + ((empty, empty) if weighted else ())
+
+            # Widoki np.frombuffer blokują zmianę rozmiaru tablic - muszą zniknąć przed zwolnieniem blokady.
+            postings = [np.frombuffer(self.postings[ingredient_id], dtype=np.int64) for ingredient_id in found]
+            recipe_ids = np.concatenate(postings)
+            sizes = np.frombuffer(self.sizes, dtype=np.uint16)
+            counts = np.bincount(recipe_ids, minlength=len(sizes))
+            rows = np.flatnonzero(counts[:len(sizes)] * sizes)
+            result = (rows, counts[rows], sizes[rows])
+            if weighted:
+                weights = np.repeat([self.idf[ingredient_id] for ingredient_id in found], [len(p) for p in postings])
+                matched = np.bincount(recipe_ids, weights=weights, minlength=len(sizes))[rows]
+                result += (matched, np.frombuffer(self.weights, dtype=np.float64)[rows])
+            del postings, sizes
+        return result
+
+    def ensure_weights(self):
+        with self.lock:
+            if self.weights is not None:
+                return
+            sizes = np.frombuffer(self.sizes, dtype=np.uint16)
+            self.recipe_count = int(np.count_nonzero(sizes))
+            del sizes
+            self.idf = {
+                ingredient_id: idf(self.recipe_count, len(posting)) for ingredient_id, posting in self.postings.items()
+            }
+            weights = np.zeros(len(self.sizes), dtype=np.float64)
+            for ingredient_id, posting in self.postings.items():
+                weights[np.frombuffer(posting, dtype=np.int64)] += self.idf[ingredient_id]
+            self.weights = array('d', weights.tobytes())
+
+    def _set_weight(self, recipe_id, ingredient_ids):
+        # Nowe składniki dostają idf według bieżącego stanu; wagi już znanych zostają do przebudowy indeksu.
+        for ingredient_id in ingredient_ids:
+            if ingredient_id not in self.idf:
+                self.idf[ingredient_id] = idf(self.recipe_count, len(self.postings.get(ingredient_id, ())))
+        if recipe_id >= len(self.weights):
+            self.weights.extend([0.0] * (recipe_id + 1 - len(self.weights)))
+        if not self.weights[recipe_id]:
+            self.recipe_count += 1
+        self.weights[recipe_id] = sum(self.idf[ingredient_id] for ingredient_id in ingredient_ids)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = IngredientIndex.from_database()
+        update_log.register(refresh)
+    return _index
+
+
+def is_ready():
+    return _index is not None
+
+
+def build_in_background():
+    if _index is not None or _index_lock.locked():
+        return
+    threading.Thread(target=_build_and_close_connection, name='ingredient-index-build', daemon=True).start()
+
+
+def _build_and_close_connection():
+    try:
+        get_index()
+    finally:
+        connection.close()
+
+
+def rebuild_index():
+    """Pełna przebudowa (np. w testach) - przy pracy ciągłej indeks nadąża za dziennikiem zmian."""
+    global _index
+    index = IngredientIndex.from_database()
+    with _index_lock:
+        _index = index
+    update_log.register(refresh)
+    return index
+
+
+def refresh():
+    """Dogrywa do indeksu nowe wpisy dziennika (update_log.sync_now / wątek w tle)."""
+    index = _index
+    if index is not None and index.follower is not None:
+        index.follower.follow(index.apply_changes)
+
+
+def log_version():
+    """Stan dziennika zawarty w indeksie (ChangeFollower.version), None - indeks niezbudowany."""
+    index = _index
+    if index is None or index.follower is None:
+        return None
+    return index.follower.version
@@ -0,0 +1,95 @@
+import re
+
+
+# Słowa, których nie sprowadzamy do liczby pojedynczej.
+UNCOUNTABLE = {
+    'asparagus', 'couscous', 'hummus', 'molasses', 'swiss', 'brussels', 'grits', 'oats',
+    'greens', 'hops', 'lemongrass', 'bass', 'citrus', 'octopus', 'haricots verts',
+}
+
+IRREGULAR_PLURALS = {
+    'leaves': 'leaf',
+    'loaves': 'loaf',
+    'halves': 'half',
+    'knives': 'knife',
+    'geese': 'goose',
+    'mice': 'mouse',
+    'teeth': 'tooth',
+    'feet': 'foot',
+    'cookies': 'cookie',
+    'pies': 'pie',
+    'ties': 'tie',
+}
+
+# Synonim -> forma kanoniczna (obie strony już po normalizacji i singularyzacji).
+SYNONYMS = {
+    'scallion': 'green onion',
+    'spring onion': 'green onion',
+    'cilantro': 'coriander',
+    'fresh cilantro': 'coriander',
+    'garbanzo bean': 'chickpea',
+    'garbanzo': 'chickpea',
+    'aubergine': 'eggplant',
+    'courgette': 'zucchini',
+    'capsicum': 'bell pepper',
+    'confectioners sugar': 'powdered sugar',
+    "confectioners' sugar": 'powdered sugar',
+    'icing sugar': 'powdered sugar',
+    'caster sugar': 'superfine sugar',
+    'bicarbonate of soda': 'baking soda',
+    'all-purpose flour': 'flour',
+    'all purpose flour': 'flour',
+    'plain flour': 'flour',
+    'oleo': 'margarine',
+    'ground beef': 'minced beef',
+    'hamburger': 'minced beef',
+    'hamburger meat': 'minced beef',
+    'prawn': 'shrimp',
+    'rocket': 'arugula',
+    'corn starch': 'cornstarch',
+    'cornflour': 'cornstarch',
+    'double cream': 'heavy cream',
+    'whipping cream': 'heavy cream',
+    'heavy whipping cream': 'heavy cream',
+    'oleomargarine': 'margarine',
+}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_ingredient(name):
+    return _WHITESPACE.sub(' ', str(name).lower()).strip()
+
+
+def singularize(word):
+    if word in UNCOUNTABLE or len(word) <= 3:
+        return word
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('oes') or word.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def canonicalize(name):
+    """
+    Sprowadza nazwę składnika do postaci kanonicznej:
+    małe litery, pojedyncze spacje, ostatnie słowo w liczbie pojedynczej, tabela synonimów.
+    """
+    name = normalize_ingredient(name)
+    if not name or name in UNCOUNTABLE:
+        return name
+
+    *head, last = name.split(' ')
+    name = ' '.join(head + [singularize(last)])
+    return SYNONYMS.get(name, name)
+
+
+def canonical_names(ner):
+    if not isinstance(ner, (list, tuple)):
+        return set()
+    return {term for term in map(canonicalize, ner) if term}
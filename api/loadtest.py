@@ -0,0 +1,127 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+class Target:
+    """Jedno wdrożenie do porównania, np. wsgi=http://127.0.0.1:8000."""
+
+    def __init__(self, label, url):
+        self.label = label
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+
+    def connect(self, timeout):
+        return self.connection_class(self.host, self.port, timeout=timeout)
+
+
+def recommend_request(ingredient_lists, limit):
+    def build(i):
+        body = json.dumps({'ingredients': ingredient_lists[i % len(ingredient_lists)], 'limit': limit}).encode()
+        return '/api/recommend/', 'application/json', body
+    return build
+
+
+def process_image_request(image_bytes, unique=False):
+    """Z unique=True każde zdjęcie ma doklejony inny ogon - omija cache detekcji po hashu treści."""
+    def build(i):
+        boundary = uuid.uuid4().hex
+        data = image_bytes + (f'{i}'.encode() if unique else b'')
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="photo.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        )
+        return '/api/process-image/', f'multipart/form-data; boundary={boundary}', body
+    return build
+
+
+def send(connection, target, token, path, content_type, body, upload_kbps=None):
+    connection.putrequest('POST', target.prefix + path)
+    connection.putheader('Authorization', f'Token {token}')
+    connection.putheader('Content-Type', content_type)
+    connection.putheader('Content-Length', str(len(body)))
+    connection.endheaders()
+
+    if not upload_kbps:
+        connection.send(body)
+    else:
+        # Wolny klient (np. telefon na słabym łączu): treść wysyłana po kawałku co 100 ms.
+        step = max(1, int(upload_kbps * 1024 / 10))
+        for offset in range(0, len(body), step):
+            connection.send(body[offset:offset + step])
+            time.sleep(0.1)
+
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def run_load(target, token, build_request, concurrency, duration, upload_kbps=None, timeout=60):
+    """
+    concurrency wątków-klientów (każdy z własnym połączeniem keep-alive) wysyła żądania przez
+    duration sekund. Zwraca przepustowość, percentyle opóźnień i liczniki statusów HTTP.
+    """
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    counter = iter(range(10 ** 9))
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = target.connect(timeout)
+        while time.monotonic() < deadline:
+            with lock:
+                i = next(counter)
+            path, content_type, body = build_request(i)
+            started = time.perf_counter()
+            try:
+                code = send(connection, target, token, path, content_type, body, upload_kbps)
+            except (OSError, http.client.HTTPException) as e:
+                code = type(e).__name__
+                connection.close()
+                connection = target.connect(timeout)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                statuses[code] += 1
+                if code == 200:
+                    latencies.append(elapsed)
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': sum(statuses.values()),
+        'ok': len(latencies),
+        'statuses': {str(code): count for code, count in sorted(statuses.items(), key=str)},
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+    }
+    if latencies:
+        summary.update({
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(latencies[-1], 2),
+        })
+    return summary
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import WORKLOADS, compare, drop_corpus, ensure_corpus, prepare_backend, run_metadata
+
+
+class Command(BaseCommand):
+    help = (
+        "Uruchamia benchmarki gorących ścieżek API i wypisuje wyniki jako JSON (z commitem i konfiguracją).\n"
+        "Z --corpus-size zapisuje w bazie syntetyczny korpus przepisów - uruchamiaj na osobnej bazie, np.\n"
+        "  manage.py benchmark recommend_latency import_throughput process_image_throughput "
+        "--corpus-size 100000 --output bench/$(git rev-parse --short HEAD).json\n"
+        "  manage.py benchmark recommend_latency --corpus-size 100000 --compare bench/<poprzedni>.json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('workloads', nargs='*', help=f"Spośród: {', '.join(sorted(WORKLOADS))}. Domyślnie wszystkie.")
+        parser.add_argument('--queries', type=int, default=50, help="Liczba zapytań na pomiar.")
+        parser.add_argument('--ingredients', type=int, default=5, help="Liczba składników w zapytaniu.")
+        parser.add_argument(
+            '--ingredient-sizes', type=int, nargs='+', default=[1, 3, 5, 10, 20],
+            help="Długości list składników dla recommend_latency.",
+        )
+        parser.add_argument('--limit', type=int, default=100, help="limit w zapytaniach recommend_latency.")
+        parser.add_argument(
+            '--corpus-size', type=int, default=None,
+            help="Liczba syntetycznych przepisów w bazie (np. 10000, 100000, 1000000); brakujące są dopisywane.",
+        )
+        parser.add_argument('--drop-corpus', action='store_true', help="Usuwa syntetyczny korpus po pomiarach.")
+        parser.add_argument('--import-rows', type=int, default=20000, help="Wiersze CSV dla import_throughput.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="chunk_size importu.")
+        parser.add_argument('--workers', type=int, default=None, help="Procesy parsujące importu (domyślnie CPU).")
+        parser.add_argument('--images', type=int, default=200, help="Liczba zdjęć dla process_image_throughput.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Równolegli klienci process_image.")
+        parser.add_argument('--stub-inference-ms', type=float, default=20, help="Czas paczki modelu-atrapy.")
+        parser.add_argument(
+            '--shards', type=int, nargs='+', default=None,
+            help="Liczby shardów dla sharded_scoring (domyślnie potęgi dwójki do liczby CPU).",
+        )
+        parser.add_argument('--detection-model', default=None, help="Plik wag YOLO zamiast modelu-atrapy.")
+        parser.add_argument('--output', default=None, help="Zapisuje wyniki do pliku JSON.")
+        parser.add_argument('--compare', default=None, help="Plik JSON poprzedniego przebiegu do porównania.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['workloads']) - set(WORKLOADS)
+        if unknown:
+            raise CommandError(f"Nieznane benchmarki: {', '.join(sorted(unknown))}")
+        if options['corpus_size'] is not None and options['corpus_size'] < 1:
+            raise CommandError("--corpus-size musi być dodatnie.")
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        if options['corpus_size'] and ensure_corpus(options['corpus_size'], log=self.stderr.write):
+            prepare_backend()
+
+        try:
+            results = {}
+            for name in options['workloads'] or sorted(WORKLOADS):
+                self.stderr.write(f"-> {name}")
+                results[name] = WORKLOADS[name](options)
+            report = {'meta': run_metadata(options), 'results': results}
+        finally:
+            if options['drop_corpus']:
+                self.stderr.write(f"Usunięto {drop_corpus()} syntetycznych przepisów")
+                prepare_backend()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+        if baseline is not None:
+            self.stderr.write(f"Porównanie z {options['compare']} ({baseline.get('meta', {}).get('commit')}):")
+            for key, old, new, change, improved in compare(baseline, report):
+                marker = '+' if improved else ('-' if change else ' ')
+                self.stderr.write(f" {marker} {key}: {old} -> {new} ({'' if change is None else f'{change:+}%'})")
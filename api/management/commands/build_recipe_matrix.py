@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from api import update_log
+from api.generations import exclusive
+from api.recipe_matrix import RecipeMatrix, matrix_path, publish_matrix
+
+
+class Command(BaseCommand):
+    help = (
+        "Buduje macierz CSR przepisy x składniki z Recipe.ner i publikuje ją jako nowe pokolenie "
+        "w RECIPE_MATRIX_PATH - workery przełączają się na nie w tle. Usuwa też stare wpisy dziennika zmian."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=None,
+            help="Zapisuje samą macierz do podanego katalogu (bez pokoleń i bez czyszczenia dziennika).",
+        )
+        parser.add_argument('--quiet', action='store_true', help="Bez komunikatu, gdy buduje już inny proces.")
+
+    def handle(self, *args, **options):
+        if options['output']:
+            matrix = RecipeMatrix.from_database()
+            matrix.save(options['output'])
+            self.report(matrix, options['output'])
+            return
+
+        with exclusive(matrix_path()) as acquired:
+            if not acquired:
+                if not options['quiet']:
+                    self.stderr.write("Macierz buduje już inny proces.")
+                return
+            path = publish_matrix()
+            pruned = update_log.prune()
+        self.report(RecipeMatrix.load(path), path)
+        self.stdout.write(f"Usunięto {pruned} starych wpisów dziennika zmian")
+
+    def report(self, matrix, path):
+        self.stdout.write(self.style.SUCCESS(
+            f"Zapisano macierz {matrix.matrix.shape[0]} x {matrix.matrix.shape[1]} "
+            f"({matrix.matrix.nnz} niezerowych) do {path}"
+        ))
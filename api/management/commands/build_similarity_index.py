@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.generations import exclusive
+from api.similarity import SimilarityIndex, index_path, publish_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Buduje indeks MinHash LSH podobnych przepisów z Recipe.ingredient_ids i publikuje go jako nowe "
+        "pokolenie w SIMILARITY_INDEX_PATH - workery przełączają się na nie przy następnym zapytaniu."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=None,
+            help="Zapisuje sam indeks do podanego (nowego) katalogu, bez pokoleń - nie dla katalogu, z którego "
+                 "czytają workery.",
+        )
+        parser.add_argument('--permutations', type=int, default=settings.SIMILARITY_PERMUTATIONS)
+        parser.add_argument('--bands', type=int, default=settings.SIMILARITY_BANDS)
+
+    def handle(self, *args, **options):
+        if options['output']:
+            path = options['output']
+            index = SimilarityIndex.from_database(options['permutations'], options['bands'])
+            index.save(path)
+        else:
+            with exclusive(index_path()) as acquired:
+                if not acquired:
+                    raise CommandError("Indeks buduje już inny proces.")
+                index, path = publish_index(options['permutations'], options['bands'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Zapisano indeks {len(index.recipe_ids)} przepisów ({options['permutations']} permutacji, "
+            f"{options['bands']} pasm) do {path}"
+        ))
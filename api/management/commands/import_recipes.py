@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.import_recipes import import_recipes_from_csv
+
+
+class Command(BaseCommand):
+    help = "Importuje przepisy z pliku CSV (format RecipeNLG). Przerwany import można wznowić."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help="Ścieżka do pliku CSV.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Liczba wierszy w chunku / bulk_create.")
+        parser.add_argument('--workers', type=int, default=None, help="Liczba procesów parsujących (domyślnie liczba CPU).")
+        parser.add_argument('--checkpoint', default=None, help="Plik checkpointu (domyślnie <csv_file>.checkpoint.json).")
+        parser.add_argument('--restart', action='store_true', help="Ignoruje istniejący checkpoint i zaczyna od początku.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size musi być dodatnie.")
+
+        checkpoint = options['checkpoint'] or f"{options['csv_file']}.checkpoint.json"
+        if options['restart']:
+            Path(checkpoint).unlink(missing_ok=True)
+
+        try:
+            import_recipes_from_csv(
+                options['csv_file'],
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                checkpoint_path=checkpoint,
+                log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import make_sample_jpeg, sample_ingredient_lists
+from api.loadtest import Target, process_image_request, recommend_request, run_load
+
+
+FALLBACK_INGREDIENTS = [['eggs', 'milk', 'flour'], ['chicken', 'garlic', 'onion', 'rice'], ['butter', 'sugar']]
+
+
+class Command(BaseCommand):
+    help = (
+        "Test obciążeniowy działających serwerów: porównuje przepustowość i p99 tych samych żądań "
+        "na kilku wdrożeniach, np.\n"
+        "  gunicorn RecipeRecomendationBackend.wsgi -w 4 -b :8000\n"
+        "  uvicorn RecipeRecomendationBackend.asgi:application --workers 4 --port 8001\n"
+        "  manage.py loadtest wsgi=http://127.0.0.1:8000 asgi=http://127.0.0.1:8001 --token ..."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help="Wdrożenia w postaci etykieta=url.")
+        parser.add_argument('--token', required=True, help="Token użytkownika (api/token/).")
+        parser.add_argument('--endpoint', default='recommend', help="recommend albo process-image.")
+        parser.add_argument('--concurrency', type=int, default=32, help="Liczba równoległych klientów.")
+        parser.add_argument('--duration', type=float, default=20, help="Czas pomiaru w sekundach.")
+        parser.add_argument('--warmup', type=float, default=2, help="Rozgrzewka przed pomiarem (s).")
+        parser.add_argument('--ingredients', type=int, default=5, help="Liczba składników w zapytaniu.")
+        parser.add_argument('--limit', type=int, default=100)
+        parser.add_argument('--image', help="Plik JPEG dla process-image (domyślnie syntetyczny 12 Mpx).")
+        parser.add_argument('--unique-images', action='store_true', help="Omija cache detekcji.")
+        parser.add_argument('--upload-kbps', type=float, help="Symuluje wolnych klientów (KiB/s na żądanie).")
+
+    def handle(self, *args, **options):
+        targets = []
+        for value in options['targets']:
+            label, sep, url = value.partition('=')
+            if not sep or not url:
+                raise CommandError(f"Niepoprawne wdrożenie {value!r}, oczekiwano etykieta=url")
+            targets.append(Target(label, url))
+
+        if options['endpoint'] == 'recommend':
+            ingredient_lists = sample_ingredient_lists(200, options['ingredients']) or FALLBACK_INGREDIENTS
+            build_request = recommend_request(ingredient_lists, options['limit'])
+        elif options['endpoint'] == 'process-image':
+            if options['image']:
+                with open(options['image'], 'rb') as f:
+                    image_bytes = f.read()
+            else:
+                image_bytes = make_sample_jpeg(4032, 3024)
+            build_request = process_image_request(image_bytes, unique=options['unique_images'])
+        else:
+            raise CommandError(f"Nieznany endpoint: {options['endpoint']}")
+
+        results = {}
+        for target in targets:
+            self.stderr.write(f"-> {target.label}")
+            if options['warmup']:
+                run_load(target, options['token'], build_request, options['concurrency'], options['warmup'])
+            results[target.label] = run_load(
+                target, options['token'], build_request, options['concurrency'], options['duration'],
+                upload_kbps=options['upload_kbps'],
+            )
+            summary = results[target.label]
+            self.stderr.write(
+                f"   {summary['throughput_rps']} req/s, p50 {summary.get('p50_ms')} ms, "
+                f"p99 {summary.get('p99_ms')} ms, statusy {summary['statuses']}"
+            )
+        self.stdout.write(json.dumps(results, indent=2))
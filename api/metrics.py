@@ -0,0 +1,205 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+
+# Pomiary etapów żądania (stage) i metryki w formacie tekstowym Prometheusa (/api/metrics/).
+# Bez METRICS_ENABLED i SERVER_TIMING_HEADER middleware nie jest ładowany, a stage() zwraca
+# wspólny pusty kontekst - koszt to jeden odczyt ContextVar na etap.
+# Metryki są per proces: przy kilku workerach gunicorna każdy wystawia własne liczniki.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Histogram jak w prometheus_client: liczniki kubełków (skumulowane przy eksporcie), suma i liczba."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            values = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self.values.items())
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                lines.append(f'{self.name}_bucket{format_labels(names, labels + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+requests_total = Counter(
+    'recipes_http_requests_total', 'Liczba żądań HTTP.', ('view', 'method', 'status'),
+)
+request_duration = Histogram(
+    'recipes_http_request_duration_seconds', 'Czas obsługi żądania (bez strumieniowania treści).', ('view',),
+)
+stage_duration = Histogram(
+    'recipes_stage_duration_seconds', 'Czas etapów obsługi żądania.', ('view', 'stage'), STAGE_BUCKETS,
+)
+
+METRICS = [requests_total, request_duration, stage_duration]
+
+
+class RequestTimings:
+    """Czasy etapów jednego żądania w sekundach; powtórzony etap się sumuje."""
+
+    __slots__ = ('stages',)
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+_current = ContextVar('request_timings', default=None)
+_noop = nullcontext()
+
+
+class Stage:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+
+
+def stage(name):
+    """with stage('score'): ... - mierzy etap, jeśli bieżące żądanie jest instrumentowane."""
+    timings = _current.get()
+    if timings is None:
+        return _noop
+    return Stage(timings, name)
+
+
+def record(name, seconds):
+    """Dopisuje zmierzony już etap (np. z detect()) do bieżącego żądania."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def start_request():
+    """Zwraca (timings, token) - token do _current.reset po zakończeniu żądania."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def observe_request(view, method, status_code, seconds, timings):
+    requests_total.inc((view, method, str(status_code)))
+    request_duration.observe(seconds, (view,))
+    for name, stage_seconds in timings.stages.items():
+        stage_duration.observe(stage_seconds, (view, name))
+
+
+def server_timing(timings, seconds):
+    """Wartość nagłówka Server-Timing: etapy i total w milisekundach."""
+    entries = [f'{name};dur={stage_seconds * 1000:.2f}' for name, stage_seconds in timings.stages.items()]
+    entries.append(f'total;dur={seconds * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def metric_lines(name, documentation, value, kind='gauge'):
+    if value is None:
+        return []
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {format_value(value)}']
+
+
+def runtime_lines():
+    """Stan cache i kolejki detekcji - odczytywany dopiero przy pobraniu metryk."""
+    from api import detection
+    from api.recommendations import cache_stats
+
+    recommend = cache_stats()
+    lines = [
+        *metric_lines('recipes_recommend_cache_hits_total', 'Trafienia cache rankingów.',
+                     recommend['hits'] + recommend['shared_hits'], 'counter'),
+        *metric_lines('recipes_recommend_cache_misses_total', 'Chybienia cache rankingów.', recommend['misses'], 'counter'),
+        *metric_lines('recipes_recommend_cache_entries', 'Wpisy lokalnego cache rankingów.', recommend['entries']),
+    ]
+    if detection.is_loaded():
+        detector = detection.get_detector().stats()
+        lines += [
+            *metric_lines('recipes_detection_queue_depth', 'Obrazy czekające na model.', detector['queue_depth']),
+            *metric_lines('recipes_detection_images_total', 'Obrazy przetworzone przez model.', detector['images'], 'counter'),
+            *metric_lines('recipes_detection_batches_total', 'Wywołania predict.', detector['batches'], 'counter'),
+        ]
+    return lines
+
+
+def exposition():
+    lines = []
+    for metric in METRICS:
+        lines += metric.expose()
+    lines += runtime_lines()
+    return '\n'.join(lines) + '\n'
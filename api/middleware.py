@@ -0,0 +1,105 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from api import metrics
+
+
+class QueryCounter:
+    """
+    Liczy zapytania SQL i czas spędzony w bazie (wszystkie połączenia) w obrębie bloku with.
+    Używane przez QueryCountMiddleware i w testach.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+
+class QueryCountMiddleware:
+    """Dodaje do odpowiedzi nagłówki X-DB-Query-Count i X-DB-Time (ms)."""
+
+    def __init__(self, get_response):
+        # Wyłączony nie trafia do łańcucha - pod ASGI nie wymusza przejścia widoków async przez wątek.
+        if not getattr(settings, 'QUERY_COUNT_HEADERS', settings.DEBUG):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryCounter() as queries:
+            response = self.get_response(request)
+        response['X-DB-Query-Count'] = str(queries.count)
+        response['X-DB-Time'] = f'{queries.duration * 1000:.2f}'
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Zbiera czasy etapów żądania (api.metrics.stage) i całego żądania. Z METRICS_ENABLED zapisuje je
+    w metrykach (/api/metrics/), z SERVER_TIMING_HEADER dodaje nagłówek Server-Timing.
+    Gdy oba są wyłączone, middleware nie jest ładowany. Obsługuje widoki sync i async.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.metrics = getattr(settings, 'METRICS_ENABLED', False)
+        self.server_timing = getattr(settings, 'SERVER_TIMING_HEADER', False)
+        if not (self.metrics or self.server_timing):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, seconds):
+        if self.metrics:
+            match = request.resolver_match
+            view = (match.url_name or match.view_name) if match else 'unmatched'
+            metrics.observe_request(view, request.method, response.status_code, seconds, timings)
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing(timings, seconds)
+        return response
@@ -0,0 +1,187 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+# Scalone 0006_recipe_ner_normalized i 0007_ingredient_ids: kolumna ner_normalized (wypełniana
+# i indeksowana w 0006) była usuwana w 0007, więc nowe bazy od razu dostają ingredient_ids.
+
+import re
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+# Kopia api.ingredients z chwili powstania migracji - późniejsze zmiany kanonizacji (nowe synonimy,
+# reguły liczby mnogiej) nie mogą zmieniać wyniku migracji, która już przeszła na innych bazach.
+
+# Słowa, których nie sprowadzamy do liczby pojedynczej.
+UNCOUNTABLE = {
+    'asparagus', 'couscous', 'hummus', 'molasses', 'swiss', 'brussels', 'grits', 'oats',
+    'greens', 'hops', 'lemongrass', 'bass', 'citrus', 'octopus', 'haricots verts',
+}
+
+IRREGULAR_PLURALS = {
+    'leaves': 'leaf',
+    'loaves': 'loaf',
+    'halves': 'half',
+    'knives': 'knife',
+    'geese': 'goose',
+    'mice': 'mouse',
+    'teeth': 'tooth',
+    'feet': 'foot',
+    'cookies': 'cookie',
+    'pies': 'pie',
+    'ties': 'tie',
+}
+
+# Synonim -> forma kanoniczna (obie strony już po normalizacji i singularyzacji).
+SYNONYMS = {
+    'scallion': 'green onion',
+    'spring onion': 'green onion',
+    'cilantro': 'coriander',
+    'fresh cilantro': 'coriander',
+    'garbanzo bean': 'chickpea',
+    'garbanzo': 'chickpea',
+    'aubergine': 'eggplant',
+    'courgette': 'zucchini',
+    'capsicum': 'bell pepper',
+    'confectioners sugar': 'powdered sugar',
+    "confectioners' sugar": 'powdered sugar',
+    'icing sugar': 'powdered sugar',
+    'caster sugar': 'superfine sugar',
+    'bicarbonate of soda': 'baking soda',
+    'all-purpose flour': 'flour',
+    'all purpose flour': 'flour',
+    'plain flour': 'flour',
+    'oleo': 'margarine',
+    'ground beef': 'minced beef',
+    'hamburger': 'minced beef',
+    'hamburger meat': 'minced beef',
+    'prawn': 'shrimp',
+    'rocket': 'arugula',
+    'corn starch': 'cornstarch',
+    'cornflour': 'cornstarch',
+    'double cream': 'heavy cream',
+    'whipping cream': 'heavy cream',
+    'heavy whipping cream': 'heavy cream',
+    'oleomargarine': 'margarine',
+}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_ingredient(name):
+    return _WHITESPACE.sub(' ', str(name).lower()).strip()
+
+
+def singularize(word):
+    if word in UNCOUNTABLE or len(word) <= 3:
+        return word
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('oes') or word.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def canonicalize(name):
+    name = normalize_ingredient(name)
+    if not name or name in UNCOUNTABLE:
+        return name
+
+    *head, last = name.split(' ')
+    name = ' '.join(head + [singularize(last)])
+    return SYNONYMS.get(name, name)
+
+
+def canonical_names(ner):
+    if not isinstance(ner, (list, tuple)):
+        return set()
+    return {term for term in map(canonicalize, ner) if term}
+
+
+def fill_ingredient_ids(apps, schema_editor):
+    Ingredient = apps.get_model("api", "Ingredient")
+    Recipe = apps.get_model("api", "Recipe")
+
+    vocabulary = {}
+    batch = []
+
+    def flush():
+        names = {
+            name for _, recipe_names in batch for name in recipe_names
+        } - vocabulary.keys()
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in names])
+        vocabulary.update(
+            Ingredient.objects.filter(name__in=names).values_list("name", "id")
+        )
+        Recipe.objects.bulk_update(
+            [
+                Recipe(
+                    id=recipe_id,
+                    ingredient_ids=sorted(vocabulary[name] for name in recipe_names),
+                )
+                for recipe_id, recipe_names in batch
+            ],
+            ["ingredient_ids"],
+        )
+        batch.clear()
+
+    for recipe_id, ner in (
+        Recipe.objects.order_by("id").values_list("id", "ner").iterator(chunk_size=5000)
+    ):
+        batch.append((recipe_id, canonical_names(ner)))
+        if len(batch) >= 5000:
+            flush()
+    if batch:
+        flush()
+
+
+class Migration(migrations.Migration):
+
+    replaces = [
+        ("api", "0006_recipe_ner_normalized"),
+        ("api", "0007_ingredient_ids"),
+    ]
+
+    dependencies = [
+        ("api", "0005_favouriterecipe"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Ingredient",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="ingredient_ids",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.IntegerField(),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.RunPython(fill_ingredient_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["ingredient_ids"], name="recipe_ingredient_ids_gin"
+            ),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_recipechange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecipeDetail",
+            fields=[
+                (
+                    "recipe",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="detail",
+                        serialize=False,
+                        to="api.recipe",
+                    ),
+                ),
+                ("ingredients", models.JSONField()),
+                ("directions", models.JSONField()),
+                ("source", models.CharField(max_length=255)),
+                ("ner", models.JSONField()),
+                ("site", models.URLField(blank=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="ingredient_count",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        # Przeniesienie kolumn jednym INSERT ... SELECT. Miejsce po usuniętych kolumnach Postgres
+        # odzyskuje dopiero po VACUUM FULL api_recipe (albo pg_repack) - wtedy rośnie liczba wierszy na stronę.
+        migrations.RunSQL(
+            sql=[
+                "INSERT INTO api_recipedetail (recipe_id, ingredients, directions, source, ner, site) "
+                "SELECT id, ingredients, directions, source, ner, site FROM api_recipe",
+                "UPDATE api_recipe SET ingredient_count = cardinality(ingredient_ids)",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        # Przed usunięciem kolumny stają się nullable - przy cofaniu migracji wracają jako nullable
+        # (dodanie kolumny NOT NULL bez domyślnej wartości do niepustej tabeli się nie uda),
+        # dane są kopiowane z api_recipedetail i dopiero wtedy wraca NOT NULL.
+        migrations.AlterField(
+            model_name="recipe",
+            name="ingredients",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="directions",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="source",
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="ner",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="site",
+            field=models.URLField(blank=True, null=True),
+        ),
+        migrations.RunSQL(
+            sql=migrations.RunSQL.noop,
+            reverse_sql=[
+                "UPDATE api_recipe AS r SET ingredients = d.ingredients, directions = d.directions, "
+                "source = d.source, ner = d.ner, site = d.site FROM api_recipedetail AS d WHERE d.recipe_id = r.id",
+            ],
+        ),
+        migrations.RemoveField(
+            model_name="recipe",
+            name="directions",
+        ),
+        migrations.RemoveField(
+            model_name="recipe",
+            name="ingredients",
+        ),
+        migrations.RemoveField(
+            model_name="recipe",
+            name="ner",
+        ),
+        migrations.RemoveField(
+            model_name="recipe",
+            name="site",
+        ),
+        migrations.RemoveField(
+            model_name="recipe",
+            name="source",
+        ),
+    ]
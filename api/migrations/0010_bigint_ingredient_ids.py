@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:59
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+# Ingredient.id to BigAutoField - tablice id składników muszą to pomieścić. ALTER COLUMN ... TYPE bigint[]
+# przepisuje api_recipe i przebudowuje indeks GIN pod blokadą ACCESS EXCLUSIVE - na dużej bazie w oknie serwisowym.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_recipe_detail"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recipe",
+            name="ingredient_ids",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipechange",
+            name="ingredient_ids",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(), null=True, size=None
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipechange",
+            name="old_ingredient_ids",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(), null=True, size=None
+            ),
+        ),
+    ]
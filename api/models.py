@@ -1,18 +1,91 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models, transaction
+
+
+class Ingredient(models.Model):
+    name = models.CharField(max_length=255, unique=True)  # nazwa kanoniczna (api.ingredients.canonicalize)
+
+    def __str__(self):
+        return self.name
+
+
+# Kolumny przepisu czytane tylko w szczegółach (RecipeDetailView) - trzymane w osobnej tabeli,
+# żeby listy, ulubione i hydratacja rankingów czytały wąskie wiersze bez blobów JSON (TOAST).
+DETAIL_FIELDS = ('ingredients', 'directions', 'source', 'ner', 'site')
+
+
+def split_recipe_fields(fields):
+    """Pola przepisu w formacie parse_row -> (pola Recipe, pola RecipeDetail)."""
+    hot = {name: value for name, value in fields.items() if name not in DETAIL_FIELDS}
+    return hot, {name: fields[name] for name in DETAIL_FIELDS if name in fields}
+
+
+class RecipeQuerySet(models.QuerySet):
+    def create_with_detail(self, **fields):
+        """Tworzy Recipe i RecipeDetail w jednej transakcji; ingredient_ids są liczone z ner."""
+        from api.vocabulary import get_vocabulary
+
+        hot, detail = split_recipe_fields(fields)
+        ingredient_ids = get_vocabulary().resolve(detail.get('ner', []))
+        with transaction.atomic(using=self.db):
+            recipe = self.create(**hot, ingredient_ids=ingredient_ids, ingredient_count=len(ingredient_ids))
+            recipe.detail = RecipeDetail.objects.using(self.db).create(recipe=recipe, **detail)
+        return recipe
+
+    def bulk_create_with_detail(self, rows):
+        """rows: [(pola przepisu, ingredient_ids)] - dwa INSERT-y zamiast dwóch na przepis, bez sygnałów."""
+        recipes, details = [], []
+        for fields, ingredient_ids in rows:
+            hot, detail = split_recipe_fields(fields)
+            recipes.append(Recipe(**hot, ingredient_ids=ingredient_ids, ingredient_count=len(ingredient_ids)))
+            details.append(detail)
+        self.bulk_create(recipes)
+        RecipeDetail.objects.using(self.db).bulk_create([
+            RecipeDetail(recipe=recipe, **detail) for recipe, detail in zip(recipes, details)
+        ])
+        return recipes
 
 
 class Recipe(models.Model):
     title = models.CharField(max_length=255)
+    link = models.URLField(blank=True)
+    ingredient_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, editable=False)  # Ingredient.id z ner
+    ingredient_count = models.PositiveSmallIntegerField(default=0, editable=False)  # len(ingredient_ids)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['ingredient_ids'], name='recipe_ingredient_ids_gin'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class RecipeDetail(models.Model):
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='detail')
     ingredients = models.JSONField()  # lista stringów
     directions = models.JSONField()
-    link = models.URLField(blank=True)
     source = models.CharField(max_length=255)
     ner = models.JSONField()  # czyste składniki (bez ilości)
     site = models.URLField(blank=True)
 
     def __str__(self):
-        return self.title
+        return str(self.recipe_id)
+
+
+class RecipeChange(models.Model):
+    """
+    Dziennik zmian przepisów (api.update_log): poprzednie i nowe Recipe.ingredient_ids.
+    None w ingredient_ids - przepis usunięty, None w old_ingredient_ids - nowy przepis.
+    """
+    recipe_id = models.BigIntegerField()  # bez klucza obcego - wpis przeżywa usunięcie przepisu
+    old_ingredient_ids = ArrayField(models.BigIntegerField(), null=True)
+    ingredient_ids = ArrayField(models.BigIntegerField(), null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
 
 class FavouriteRecipe(models.Model):
@@ -0,0 +1,116 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from api.cache import ResultCache
+from api.metrics import stage
+from api.models import FavouriteRecipe, Recipe
+from api.recommendations import recommend
+
+
+# Profil użytkownika: ile jego ulubionych przepisów zawiera dany składnik.
+# Przechowywany jako {'favourites': n, 'ingredients': {Ingredient.id: liczba}} w cache 'profile'.
+# Zmiana ulubionych (perform_create, destroy) usuwa profil z cache po commicie - następny odczyt
+# przelicza go z FavouriteRecipe. Profil nie jest poprawiany w miejscu: worker z nieaktualną kopią
+# zapisałby ją z powrotem do wspólnego cache, gubiąc zmiany z innych workerów.
+
+_profile_cache = None
+
+
+def get_profile_cache():
+    global _profile_cache
+    if _profile_cache is None:
+        backend = settings.PERSONALIZATION_CACHE_BACKEND
+        _profile_cache = ResultCache(
+            'profile',
+            # Ze wspólnym backendem bez lokalnego LRU - usunięcie profilu w jednym workerze
+            # nie dotarłoby do lokalnych kopii pozostałych.
+            max_entries=0 if backend else settings.PERSONALIZATION_CACHE_SIZE,
+            ttl=settings.PERSONALIZATION_CACHE_TTL,
+            backend=backend,
+        )
+    return _profile_cache
+
+
+def load_profile(user_id):
+    ingredients = Counter()
+    favourites = 0
+    rows = FavouriteRecipe.objects.filter(user_id=user_id).values_list('recipe__ingredient_ids', flat=True)
+    for ingredient_ids in rows:
+        ingredients.update(ingredient_ids)
+        favourites += 1
+    return {'favourites': favourites, 'ingredients': dict(ingredients)}
+
+
+def get_profile(user_id):
+    cache = get_profile_cache()
+    profile = cache.get(user_id)
+    if profile is ResultCache.MISSING:
+        profile = load_profile(user_id)
+        cache.set(user_id, profile)
+    return profile
+
+
+def invalidate_profile(user_id):
+    get_profile_cache().delete(user_id)
+
+
+def favourite_saved(sender, instance, created, **kwargs):
+    if created:
+        user_id = instance.user_id
+        transaction.on_commit(lambda: invalidate_profile(user_id))
+
+
+def favourite_deleted(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_profile(user_id))
+
+
+def affinity(profile, ingredient_ids):
+    """Średnia po składnikach przepisu: jaka część ulubionych użytkownika go zawiera (0..1)."""
+    if not ingredient_ids or not profile['favourites']:
+        return 0.0
+    ingredients = profile['ingredients']
+    return sum(ingredients.get(ingredient_id, 0) for ingredient_id in ingredient_ids) / (
+        len(ingredient_ids) * profile['favourites']
+    )
+
+
+def personalize(recommendations, profile, limit):
+    """
+    Przestawia ranking według personal_score = score * (1 + PERSONALIZATION_WEIGHT * affinity).
+    Podbicie jest ograniczone, więc wystarczy przeliczyć pulę kandydatów z bazowego rankingu.
+    """
+    if not profile['favourites'] or not recommendations:
+        return recommendations[:limit]
+
+    weight = settings.PERSONALIZATION_WEIGHT
+    ingredient_sets = dict(
+        Recipe.objects.filter(id__in=[recipe['id'] for recipe in recommendations]).values_list('id', 'ingredient_ids')
+    )
+
+    personalized = []
+    for recipe in recommendations:
+        recipe_affinity = affinity(profile, ingredient_sets.get(recipe['id']))
+        score = recipe.get('score', recipe['match_percentage'])
+        personalized.append({
+            **recipe,
+            "affinity": round(recipe_affinity, 4),
+            "personal_score": round(score * (1 + weight * recipe_affinity), 4),
+        })
+
+    personalized.sort(key=lambda recipe: (-recipe['personal_score'], -recipe['match_count'], recipe['id']))
+    return personalized[:limit]
+
+
+def candidate_pool(limit):
+    pool = max(limit * settings.PERSONALIZATION_POOL_FACTOR, settings.PERSONALIZATION_MIN_POOL)
+    return min(pool, settings.RECOMMEND_MAX_LIMIT)
+
+
+def recommend_personalized(ingredients, user_id, limit, ranking):
+    """Bazowy ranking (z cache, wspólny dla wszystkich) dla większej puli + przestawienie według profilu."""
+    recommendations = recommend(ingredients, candidate_pool(limit), ranking)
+    with stage('personalize'):
+        return personalize(recommendations, get_profile(user_id), limit)
@@ -0,0 +1,100 @@
+import heapq
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+# Sposób oceniania przepisów:
+# 'match_percentage' - match_count / total_ingredients (domyślny, jak dotąd),
+# 'idf'              - jak match_percentage, ale każdy składnik waży idf (sól mniej niż szafran),
+# 'jaccard'          - |zapytanie ∩ przepis| / |zapytanie ∪ przepis|,
+# 'missing'          - tylko przepisy, którym brakuje najwyżej max_missing składników, od najmniej brakujących.
+RANKING_MODES = ('match_percentage', 'idf', 'jaccard', 'missing')
+
+Ranking = namedtuple('Ranking', ['mode', 'max_missing'], defaults=['match_percentage', None])
+
+DEFAULT_RANKING = Ranking()
+
+
+def idf(recipe_count, document_frequency):
+    # Wygładzone idf (jak w scikit-learn) - zawsze > 0, więc każdy trafiony składnik coś wnosi.
+    return math.log((1 + recipe_count) / (1 + document_frequency)) + 1
+
+
+def ranking_key(item):
+    recipe_id, match_count, total, match_percentage, score = item
+    return -score, -match_count, recipe_id
+
+
+def score_arrays(ranking, match_counts, totals, query_size, matched_weights=None, recipe_weights=None):
+    """
+    Ocena przepisów w trybie ranking dla tablic NumPy.
+    Zwraca (maska zachowanych przepisów albo None, match_percentage, score).
+    Większy score = wyżej w rankingu; w trybie 'missing' score to -liczba brakujących składników.
+    Tryb 'idf' wymaga sum wag dopasowanych składników i wszystkich składników przepisu.
+    """
+    match_counts, totals = match_counts.astype(np.int64), totals.astype(np.int64)
+    percentages = np.round(match_counts / totals * 100, 2)
+
+    if ranking.mode == 'match_percentage':
+        return None, percentages, percentages
+    if ranking.mode == 'idf':
+        return None, percentages, np.round(matched_weights / recipe_weights * 100, 2)
+    if ranking.mode == 'jaccard':
+        return None, percentages, np.round(match_counts / (query_size + totals - match_counts), 4)
+    if ranking.mode == 'missing':
+        missing = totals - match_counts
+        return missing <= ranking.max_missing, percentages, -missing
+    raise ValueError(f"Unknown ranking {ranking.mode!r}")
+
+
+def top_k(scored, k):
+    """
+    Wybiera k najlepszych wyników z iterowalnego strumienia krotek
+    (recipe_id, match_count, total_ingredients, match_percentage, score),
+    trzymając w pamięci najwyżej k kandydatów (kopiec).
+
+    Kolejność jak przy sortowaniu po (-score, -match_count);
+    remisy rozstrzyga rosnące id przepisu.
+    """
+    return heapq.nsmallest(k, scored, key=ranking_key)
+
+
+def top_k_arrays(recipe_ids, match_counts, totals, percentages, k, scores=None):
+    """
+    Odpowiednik top_k dla tablic NumPy: częściowa selekcja (np.partition)
+    odcina wszystko poniżej k-tego wyniku, a sortowany jest tylko ten podzbiór.
+    Bez scores ranking jest po match_percentage.
+    """
+    if scores is None:
+        scores = percentages
+
+    if len(recipe_ids) > k:
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = np.flatnonzero(scores >= threshold)
+        recipe_ids, match_counts, totals, percentages, scores = (
+            recipe_ids[keep], match_counts[keep], totals[keep], percentages[keep], scores[keep]
+        )
+
+    order = np.lexsort((recipe_ids, -match_counts, -scores))[:k]
+    return list(zip(
+        recipe_ids[order].tolist(),
+        match_counts[order].tolist(),
+        totals[order].tolist(),
+        percentages[order].tolist(),
+        scores[order].tolist(),
+    ))
+
+
+def rank_arrays(ranking, k, query_size, recipe_ids, match_counts, totals, matched_weights=None, recipe_weights=None):
+    """score_arrays + top_k_arrays: jedna wektorowa ocena i selekcja k najlepszych."""
+    keep, percentages, scores = score_arrays(
+        ranking, match_counts, totals, query_size, matched_weights, recipe_weights
+    )
+    match_counts, totals = match_counts.astype(np.int64), totals.astype(np.int64)
+    if keep is not None:
+        recipe_ids, match_counts, totals, percentages, scores = (
+            recipe_ids[keep], match_counts[keep], totals[keep], percentages[keep], scores[keep]
+        )
+    return top_k_arrays(recipe_ids, match_counts, totals, percentages, k, scores)
@@ -0,0 +1,397 @@
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+
+from api import update_log
+from api.generations import current_generation, publish
+from api.models import Recipe
+from api.ranking import DEFAULT_RANKING, rank_arrays
+
+
+ARRAYS = ('ingredient_ids', 'recipe_ids', 'indptr', 'indices', 'data', 'sizes')
+
+
+def dense_columns(rows):
+    """
+    (recipe_ids, indptr, słownik, kolumny) z wierszy (recipe_id, ingredient_ids). Słownik to posortowane
+    Ingredient.id występujące w przepisach, kolumna składnika - jego pozycja w słowniku. Id są bigint
+    i nie muszą być ciągłe, więc nie nadają się wprost na numery kolumn.
+    """
+    recipe_ids, indptr, ids = [], [0], []
+    for recipe_id, ingredient_ids in rows:
+        recipe_ids.append(recipe_id)
+        ids.extend(sorted(ingredient_ids))
+        indptr.append(len(ids))
+
+    vocabulary, columns = np.unique(np.array(ids, dtype=np.int64), return_inverse=True)
+    return (
+        np.array(recipe_ids, dtype=np.int64),
+        np.array(indptr, dtype=np.int64),
+        vocabulary,
+        columns.astype(np.int32),
+    )
+
+
+def lookup_columns(vocabulary, ingredient_ids):
+    """(kolumny, maska): pozycje Ingredient.id w słowniku i które z nich w nim są."""
+    ingredient_ids = np.asarray(ingredient_ids, dtype=np.int64)
+    if not len(vocabulary):
+        return np.zeros(len(ingredient_ids), dtype=np.int64), np.zeros(len(ingredient_ids), dtype=bool)
+    columns = np.searchsorted(vocabulary, ingredient_ids).clip(max=len(vocabulary) - 1)
+    return columns, vocabulary[columns] == ingredient_ids
+
+
+class RecipeMatrix:
+    """
+    Macierz rzadka CSR przepisy x składniki zbudowana z Recipe.ingredient_ids.
+    Wiersz i odpowiada przepisowi recipe_ids[i], kolumna j - składnikowi o Ingredient.id == ingredient_ids[j].
+    """
+
+    def __init__(self, ingredient_ids, recipe_ids, indptr, indices, data, sizes, log_position=None):
+        self.ingredient_ids = ingredient_ids
+        self.columns = len(ingredient_ids)
+        self.log_position = log_position  # pozycja w dzienniku zmian, od której macierz jest aktualna
+        self.recipe_ids = recipe_ids
+        self.sizes = sizes
+        self._weights = None
+        self._weights_lock = threading.Lock()
+        self.matrix = sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(recipe_ids), self.columns), copy=False
+        )
+
+    @classmethod
+    def build(cls, rows):
+        recipe_ids, indptr, vocabulary, indices = dense_columns(rows)
+        return cls(
+            vocabulary,
+            recipe_ids,
+            indptr,
+            indices,
+            np.ones(len(indices), dtype=np.float32),
+            np.diff(indptr).astype(np.float32),
+        )
+
+    @classmethod
+    def from_database(cls):
+        # Pozycja przed odczytem: zmiany zatwierdzone w trakcie zostaną po prostu dograne jeszcze raz.
+        position = update_log.latest_change_id()
+        rows = Recipe.objects.order_by('id').values_list('id', 'ingredient_ids').iterator(chunk_size=5000)
+        matrix = cls.build(rows)
+        matrix.log_position = position
+        return matrix
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            'ingredient_ids': self.ingredient_ids,
+            'recipe_ids': self.recipe_ids,
+            'indptr': self.matrix.indptr,
+            'indices': self.matrix.indices,
+            'data': self.matrix.data,
+            'sizes': self.sizes,
+        }
+        for name, values in arrays.items():
+            np.save(path / f'{name}.npy', values)
+        with open(path / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'log_position': self.log_position}, f)
+
+    @classmethod
+    def load(cls, path):
+        """Tablice są mapowane w pamięć (mmap) - workery współdzielą te same strony."""
+        path = Path(path)
+        with open(path / 'meta.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r') for name in ARRAYS if (path / f'{name}.npy').exists()
+        }
+        if 'ingredient_ids' not in arrays:
+            # Pokolenie sprzed słownika: kolumna j to składnik o Ingredient.id == j.
+            arrays['ingredient_ids'] = np.arange(meta['columns'], dtype=np.int64)
+        return cls(**arrays, log_position=meta.get('log_position'))
+
+    def query_columns(self, ingredient_ids):
+        """Kolumny składników zapytania; składniki spoza macierzy są pomijane."""
+        columns, known = lookup_columns(self.ingredient_ids, list(ingredient_ids))
+        return columns[known]
+
+    def query_vector(self, ingredient_ids):
+        vector = np.zeros(self.columns, dtype=np.float32)
+        vector[self.query_columns(ingredient_ids)] = 1
+        return vector
+
+    def match(self, ingredient_ids):
+        """Zwraca (wiersze, match_count, total_ingredients) dla przepisów z co najmniej jednym trafieniem."""
+        counts = self.matrix @ self.query_vector(ingredient_ids)
+        rows = np.flatnonzero(counts)
+        return rows, counts[rows], self.sizes[rows]
+
+    def match_weighted(self, ingredient_ids):
+        """
+        match() plus sumy idf dopasowanych składników i wszystkich składników przepisu -
+        oba iloczyny w jednym przejściu po macierzy (wektor zapytania i jego wersja ważona jako dwie kolumny).
+        """
+        idf, weights = self.ingredient_weights()
+        query = self.query_vector(ingredient_ids)
+        product = self.matrix @ np.column_stack([query, query * idf])
+        rows = np.flatnonzero(product[:, 0])
+        return rows, product[rows, 0], self.sizes[rows], product[rows, 1], weights[rows]
+
+    def ingredient_weights(self):
+        """(idf kolumn, suma idf każdego wiersza) - liczone przy pierwszym użyciu rankingu 'idf'."""
+        if self._weights is None:
+            with self._weights_lock:
+                if self._weights is None:
+                    document_frequency = np.bincount(self.matrix.indices, minlength=self.columns)
+                    recipe_count = np.count_nonzero(self.sizes)
+                    idf = np.log((1 + recipe_count) / (1 + document_frequency)) + 1
+                    self._weights = idf, self.matrix @ idf
+        return self._weights
+
+    def match_columns(self, ingredient_ids, ranking=DEFAULT_RANKING):
+        """(wiersze, *kolumny dla rank_arrays) - match albo match_weighted zależnie od rankingu."""
+        if ranking.mode == 'idf':
+            return self.match_weighted(ingredient_ids)
+        return self.match(ingredient_ids)
+
+    def match_many(self, queries, ranking=DEFAULT_RANKING):
+        """
+        match_columns dla wszystkich zapytań naraz: jeden iloczyn macierzy rzadkich A @ Q,
+        Q to składniki x zapytania. Zwraca listę (wiersze, *kolumny) w kolejności zapytań.
+        """
+        columns, positions = [], []
+        for position, ingredient_ids in enumerate(queries):
+            query_columns = self.query_columns(ingredient_ids).tolist()
+            columns.extend(query_columns)
+            positions.extend([position] * len(query_columns))
+
+        def product(values):
+            queries_matrix = sparse.csc_matrix((values, (columns, positions)), shape=(self.columns, len(queries)))
+            result = (self.matrix @ queries_matrix).tocsc()
+            result.sort_indices()
+            return result
+
+        counts = product(np.ones(len(columns), dtype=np.float32))
+        if ranking.mode == 'idf':
+            # idf > 0, więc iloczyn ważony ma te same niezerowe pozycje co counts.
+            idf, weights = self.ingredient_weights()
+            matched = product(idf[columns])
+
+        results = []
+        for position in range(len(queries)):
+            start, end = counts.indptr[position], counts.indptr[position + 1]
+            rows = counts.indices[start:end]
+            arrays = [rows, counts.data[start:end], self.sizes[rows]]
+            if ranking.mode == 'idf':
+                arrays += [matched.data[start:end], weights[rows]]
+            results.append(arrays)
+        return results
+
+    def fit_weights(self, ingredient_ids, idf, recipe_count):
+        """
+        Przejmuje idf innej macierzy (pokolenia bazowego, jej słownik to ingredient_ids);
+        składniki spoza niej dostają idf jak przy df=0.
+        """
+        fitted = np.full(self.columns, np.log(1 + recipe_count) + 1)
+        columns, known = lookup_columns(ingredient_ids, self.ingredient_ids)
+        fitted[known] = idf[columns[known]]
+        self._weights = fitted, self.matrix @ fitted
+
+    def top_k(self, ingredient_ids, k, ranking=DEFAULT_RANKING):
+        rows, *columns = self.match_columns(ingredient_ids, ranking)
+        return rank_arrays(ranking, k, len(ingredient_ids), self.recipe_ids[rows], *columns)
+
+    def top_k_many(self, queries, k, ranking=DEFAULT_RANKING):
+        return [
+            rank_arrays(ranking, k, len(ingredient_ids), self.recipe_ids[rows], *columns)
+            for ingredient_ids, (rows, *columns) in zip(queries, self.match_many(queries, ranking))
+        ]
+
+
+class LiveMatrix:
+    """
+    Pokolenie macierzy z dysku (mmap, wspólne dla workerów) plus zmiany dograne z dziennika.
+    Zmienione i usunięte przepisy są ukrywane w macierzy bazowej, a ich bieżące wersje trafiają
+    do małej macierzy-nakładki w pamięci procesu. Stan (maska, nakładka) jest podmieniany jednym
+    przypisaniem, więc zapytania nie czekają na dogrywanie zmian. Wagi idf nakładki pochodzą
+    z pokolenia bazowego - dokładne wartości wrócą po zbudowaniu następnego.
+    """
+
+    def __init__(self, base, generation=None):
+        self.base = base
+        self.generation = generation
+        self.follower = update_log.ChangeFollower(base.log_position or 0)
+        self.changed = {}  # recipe_id -> aktualne ingredient_ids, None - przepis usunięty
+        # (maska ukrytych wierszy bazy, nakładka, id zmienionych przepisów)
+        self.state = (None, None, np.empty(0, dtype=np.int64))
+
+    def apply_changes(self, changes):
+        for recipe_id, _, ingredient_ids in changes:
+            self.changed[recipe_id] = ingredient_ids
+
+        base = self.base
+        changed_ids = np.fromiter(self.changed, dtype=np.int64, count=len(self.changed))
+        rows = np.searchsorted(base.recipe_ids, changed_ids)
+        rows = rows[rows < len(base.recipe_ids)]
+        rows = rows[np.isin(base.recipe_ids[rows], changed_ids)]
+        hidden = np.zeros(len(base.recipe_ids), dtype=bool)
+        hidden[rows] = True
+
+        overlay = RecipeMatrix.build(sorted(
+            (recipe_id, ingredient_ids) for recipe_id, ingredient_ids in self.changed.items()
+            if ingredient_ids is not None
+        ))
+        if base._weights is not None:
+            self.fit_overlay_weights(overlay)
+        self.state = (hidden, overlay, changed_ids)
+
+    def combine(self, ingredient_ids, k, ranking, hidden, base_match, overlay, overlay_match):
+        rows, *columns = base_match
+        recipe_ids = self.base.recipe_ids[rows]
+        if hidden is not None:
+            visible = ~hidden[rows]
+            recipe_ids, columns = recipe_ids[visible], [column[visible] for column in columns]
+        if overlay is not None and len(overlay_match[0]):
+            overlay_rows, *overlay_columns = overlay_match
+            recipe_ids = np.concatenate([recipe_ids, overlay.recipe_ids[overlay_rows]])
+            columns = [np.concatenate(pair) for pair in zip(columns, overlay_columns)]
+        return rank_arrays(ranking, k, len(ingredient_ids), recipe_ids, *columns)
+
+    def top_k(self, ingredient_ids, k, ranking=DEFAULT_RANKING):
+        hidden, overlay, _ = self.state
+        if ranking.mode == 'idf' and overlay is not None and overlay._weights is None:
+            self.fit_overlay_weights(overlay)
+        overlay_match = overlay.match_columns(ingredient_ids, ranking) if overlay is not None else None
+        return self.combine(
+            ingredient_ids, k, ranking, hidden, self.base.match_columns(ingredient_ids, ranking), overlay, overlay_match,
+        )
+
+    def top_k_many(self, queries, k, ranking=DEFAULT_RANKING):
+        hidden, overlay, _ = self.state
+        if ranking.mode == 'idf' and overlay is not None and overlay._weights is None:
+            self.fit_overlay_weights(overlay)
+        base_matches = self.base.match_many(queries, ranking)
+        overlay_matches = overlay.match_many(queries, ranking) if overlay is not None else [None] * len(queries)
+        return [
+            self.combine(ingredient_ids, k, ranking, hidden, base_match, overlay, overlay_match)
+            for ingredient_ids, base_match, overlay_match in zip(queries, base_matches, overlay_matches)
+        ]
+
+    def fit_overlay_weights(self, overlay):
+        idf, _ = self.base.ingredient_weights()
+        overlay.fit_weights(self.base.ingredient_ids, idf, np.count_nonzero(self.base.sizes))
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+_compaction_started = 0.0
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_INTERVAL = 60  # sekundy między próbami uruchomienia przebudowy z jednego procesu
+
+
+def matrix_path():
+    return Path(getattr(settings, 'RECIPE_MATRIX_PATH', Path(settings.BASE_DIR) / 'var' / 'recipe_matrix'))
+
+
+def is_published():
+    """Czy w RECIPE_MATRIX_PATH jest opublikowane pokolenie (sam katalog z build.lock się nie liczy)."""
+    return (current_generation(matrix_path()) / 'meta.json').exists()
+
+
+def load_live():
+    generation = current_generation(matrix_path())
+    live = LiveMatrix(RecipeMatrix.load(generation), generation)
+    live.follower.follow(live.apply_changes)
+    return live
+
+
+def get_matrix():
+    global _matrix
+    if _matrix is None:
+        with _matrix_lock:
+            if _matrix is None:
+                _matrix = load_live()
+        update_log.register(refresh)
+    return _matrix
+
+
+def warmup():
+    """
+    Ładuje opublikowaną macierz przed pierwszym zapytaniem. Do wywołania np. z hooka post_fork
+    gunicorna; bez pokolenia na dysku nic nie robi (zwraca False).
+    """
+    if not is_published():
+        return False
+    get_matrix()
+    return True
+
+
+def publish_matrix():
+    """Buduje macierz z bazy i publikuje ją jako nowe pokolenie w RECIPE_MATRIX_PATH."""
+    matrix = RecipeMatrix.from_database()
+    return publish(matrix_path(), matrix.save, keep=settings.MATRIX_GENERATIONS_KEPT)
+
+
+def rebuild_matrix():
+    """Publikuje nowe pokolenie macierzy i od razu przełącza na nie ten proces."""
+    global _matrix
+    publish_matrix()
+    live = load_live()
+    with _matrix_lock:
+        _matrix = live
+    update_log.register(refresh)
+    return live
+
+
+def refresh():
+    """
+    Wywoływane przez update_log.sync_now: przełącza na nowe pokolenie, jeśli zostało opublikowane
+    (najpierw dogrywa do niego dziennik, potem podmienia referencję), inaczej dogrywa dziennik do nakładki.
+    Stare pokolenie znika z pamięci razem z ostatnim zapytaniem, które go używa.
+    """
+    global _matrix
+    live = _matrix
+    if not isinstance(live, LiveMatrix):
+        return
+
+    if current_generation(matrix_path()) != live.generation:
+        live = load_live()
+        with _matrix_lock:
+            _matrix = live
+    else:
+        live.follower.follow(live.apply_changes)
+    maybe_compact(live)
+
+
+def log_version():
+    """Stan dziennika zawarty w macierzy tego procesu (jak ingredient_index.log_version)."""
+    matrix = get_matrix()
+    if isinstance(matrix, LiveMatrix):
+        return matrix.follower.version
+    return str(matrix.log_position) if matrix.log_position is not None else None
+
+
+def maybe_compact(live):
+    """Gdy nakładka urośnie ponad MATRIX_OVERLAY_MAX przepisów, buduje nowe pokolenie w osobnym procesie."""
+    global _compaction_started
+    if len(live.changed) < settings.MATRIX_OVERLAY_MAX:
+        return
+    if time.monotonic() - _compaction_started < COMPACTION_INTERVAL:
+        return
+    _compaction_started = time.monotonic()
+    logger.info("Recipe matrix overlay has %d recipes, building a new generation", len(live.changed))
+    # build_recipe_matrix bierze blokadę - przy kilku workerach zbuduje tylko jeden.
+    subprocess.Popen(
+        [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'build_recipe_matrix', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
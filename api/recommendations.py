@@ -0,0 +1,355 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import F, FloatField, IntegerField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Round
+
+from api import ingredient_index, update_log
+from api.cache import ResultCache
+from api.metrics import stage
+from api.models import Recipe
+from api.ranking import DEFAULT_RANKING, RANKING_MODES, Ranking, rank_arrays, top_k
+from api.vocabulary import get_vocabulary
+
+
+DEFAULT_LIMIT = 100
+
+
+def score(index, counts):
+    for recipe_id, match_count in counts.items():
+        total = index.size(recipe_id)
+        if total == 0:
+            continue
+        match_percentage = round((match_count / total) * 100, 2)
+        yield recipe_id, match_count, total, match_percentage, match_percentage
+
+
+def cold_fallback(ranking):
+    # Indeks jeszcze się nie zbudował - liczymy w bazie, a indeks buduje się w tle.
+    # Baza nie zna wag idf, więc ranking 'idf' czeka na zbudowanie indeksu.
+    if ingredient_index.is_ready() or not getattr(settings, 'RECOMMEND_COLD_FALLBACK', True):
+        return False
+    if ranking.mode == 'idf':
+        return False
+    ingredient_index.build_in_background()
+    return True
+
+
+def score_with_index(ingredient_ids, limit, ranking=DEFAULT_RANKING):
+    if cold_fallback(ranking):
+        return score_with_database(ingredient_ids, limit, ranking)
+
+    index = ingredient_index.get_index()
+    if ranking == DEFAULT_RANKING:
+        return top_k(score(index, index.match(ingredient_ids)), limit)
+    arrays = index.match_arrays(ingredient_ids, weighted=ranking.mode == 'idf')
+    return rank_arrays(ranking, limit, len(ingredient_ids), *arrays)
+
+
+def score_many_with_index(queries, limit, ranking=DEFAULT_RANKING):
+    if cold_fallback(ranking):
+        return [score_with_database(ingredient_ids, limit, ranking) for ingredient_ids in queries]
+
+    index = ingredient_index.get_index()
+    if ranking == DEFAULT_RANKING:
+        return [top_k(score(index, counts), limit) for counts in index.match_many(queries)]
+    return [score_with_index(ingredient_ids, limit, ranking) for ingredient_ids in queries]
+
+
+def score_with_matrix(ingredient_ids, limit, ranking=DEFAULT_RANKING):
+    from api import sharding
+    from api.recipe_matrix import get_matrix
+
+    if sharding.get_scorer() is not None:
+        return sharding.top_k_many(get_matrix(), [ingredient_ids], limit, ranking)[0]
+    return get_matrix().top_k(ingredient_ids, limit, ranking)
+
+
+def score_many_with_matrix(queries, limit, ranking=DEFAULT_RANKING):
+    from api import sharding
+    from api.recipe_matrix import get_matrix
+
+    return sharding.top_k_many(get_matrix(), queries, limit, ranking)
+
+
+def score_with_database(ingredient_ids, limit, ranking=DEFAULT_RANKING):
+    """Dopasowanie po stronie Postgresa: && na ingredient_ids (indeks GIN), ranking z ORDER BY i LIMIT."""
+    if not ingredient_ids:
+        return []
+    if ranking.mode == 'idf':
+        raise ValueError("ranking 'idf' is not available with the database backend")
+
+    rows = (
+        Recipe.objects
+        .filter(ingredient_ids__overlap=ingredient_ids)
+        .annotate(
+            match_count=RawSQL(
+                'SELECT count(*) FROM unnest("api_recipe"."ingredient_ids") AS i WHERE i = ANY(%s)',
+                (list(ingredient_ids),),
+                output_field=IntegerField(),
+            ),
+            total_ingredients=F('ingredient_count'),
+        )
+        .annotate(
+            match_percentage=Cast(
+                Round(F('match_count') * 100.0 / F('total_ingredients'), 2), output_field=FloatField()
+            ),
+        )
+    )
+    if ranking.mode == 'match_percentage':
+        rows = rows.annotate(score=F('match_percentage'))
+    elif ranking.mode == 'jaccard':
+        union = Value(len(ingredient_ids)) + F('total_ingredients') - F('match_count')
+        rows = rows.annotate(score=Cast(Round(F('match_count') * 1.0 / union, 4), output_field=FloatField()))
+    elif ranking.mode == 'missing':
+        rows = rows.annotate(score=F('match_count') - F('total_ingredients')).filter(score__gte=-ranking.max_missing)
+
+    rows = (
+        rows.order_by('-score', '-match_count', 'id')
+        .values_list('id', 'match_count', 'total_ingredients', 'match_percentage', 'score')[:limit]
+    )
+    return list(rows)
+
+
+def score_many_with_database(queries, limit, ranking=DEFAULT_RANKING):
+    return [score_with_database(ingredient_ids, limit, ranking) for ingredient_ids in queries]
+
+
+BACKENDS = {
+    'index': score_with_index,
+    'matrix': score_with_matrix,
+    'database': score_with_database,
+}
+
+# Warianty dla wielu zapytań naraz (jedno przejście po indeksie / macierzy dla całej paczki).
+BATCH_BACKENDS = {
+    'index': score_many_with_index,
+    'matrix': score_many_with_matrix,
+    'database': score_many_with_database,
+}
+
+
+def recommend(ingredients, limit=DEFAULT_LIMIT, ranking=DEFAULT_RANKING):
+    with stage('lookup'):
+        ingredient_ids = get_vocabulary().lookup(ingredients)
+    return ranked(ingredient_ids, limit, ranking=ranking)[0]
+
+
+def ranked(ingredient_ids, limit, version=None, ranking=DEFAULT_RANKING):
+    """
+    Zwraca (ranking, wersja zbioru przepisów). Podanie wersji (z kursora) pozwala dokończyć
+    stronicowanie rankingu policzonego wcześniej, dopóki jest w cache.
+    """
+    cache = get_result_cache()
+    versions = [dataset_version()]
+    if version is not None and version != versions[0]:
+        versions.insert(0, version)
+
+    for candidate in versions:
+        with stage('cache'):
+            cached = cache.get(cache_key(ingredient_ids, limit, candidate, ranking))
+        if cached is not ResultCache.MISSING:
+            recommendations, compute_seconds = cached
+            savings['seconds'] += compute_seconds
+            return recommendations, candidate
+
+    version = versions[-1]
+    key = cache_key(ingredient_ids, limit, version, ranking)
+    started = time.perf_counter()
+    recommendations = compute_recommendations(ingredient_ids, limit, ranking)
+    cache.set(key, (recommendations, time.perf_counter() - started))
+    return recommendations, version
+
+
+def recommend_many(ingredient_lists, limit=DEFAULT_LIMIT, ranking=DEFAULT_RANKING):
+    """
+    Rekomendacje dla wielu list składników naraz - wynik jak recommend() dla każdej listy.
+    Identyczne (po kanonizacji) zapytania liczone są raz, trafienia biorą się z cache,
+    a pozostałe zapytania są liczone w jednym przejściu backendu i hydratowane jednym zapytaniem.
+    """
+    vocabulary = get_vocabulary()
+    with stage('lookup'):
+        queries = [tuple(vocabulary.lookup(ingredients)) for ingredients in ingredient_lists]
+    cache = get_result_cache()
+    version = dataset_version()
+
+    results, missing = {}, []
+    with stage('cache'):
+        for ingredient_ids in dict.fromkeys(queries):
+            cached = cache.get(cache_key(ingredient_ids, limit, version, ranking))
+            if cached is ResultCache.MISSING:
+                missing.append(ingredient_ids)
+                continue
+            results[ingredient_ids], compute_seconds = cached
+            savings['seconds'] += compute_seconds
+
+    if missing:
+        started = time.perf_counter()
+        backend = BATCH_BACKENDS[getattr(settings, 'RECOMMEND_BACKEND', 'index')]
+        with stage('score'):
+            scored = backend(missing, limit, ranking)
+        with stage('hydrate'):
+            computed = hydrate(scored, ranking)
+        compute_seconds = (time.perf_counter() - started) / len(missing)
+        for ingredient_ids, recommendations in zip(missing, computed):
+            results[ingredient_ids] = recommendations
+            cache.set(cache_key(ingredient_ids, limit, version, ranking), (recommendations, compute_seconds))
+
+    return [results[ingredient_ids] for ingredient_ids in queries]
+
+
+def paginate(ingredient_ids, limit, page_size, offset=0, version=None, ranking=DEFAULT_RANKING):
+    """Strona rankingu w formacie PaginatedRecipeMatchSerializer; next/previous to nieprzezroczyste kursory."""
+    recommendations, version = ranked(ingredient_ids, limit, version, ranking)
+
+    def cursor(position):
+        state = {'i': ingredient_ids, 'l': limit, 's': page_size, 'o': position, 'v': version, 'r': list(ranking)}
+        return signing.dumps(state, salt=CURSOR_SALT, compress=True)
+
+    end = offset + page_size
+    return {
+        'count': len(recommendations),
+        'next': cursor(end) if end < len(recommendations) else None,
+        'previous': cursor(max(offset - page_size, 0)) if offset > 0 else None,
+        'results': recommendations[offset:end],
+    }
+
+
+def paginate_cursor(value):
+    """Rzuca signing.BadSignature dla zmienionego, obcego lub przeterminowanego kursora."""
+    state = signing.loads(value, salt=CURSOR_SALT, max_age=settings.RECOMMEND_CURSOR_MAX_AGE)
+    ranking = Ranking(*state['r']) if 'r' in state else DEFAULT_RANKING
+    return paginate(state['i'], state['l'], state['s'], state['o'], state['v'], ranking)
+
+
+def compute_recommendations(ingredient_ids, limit, ranking=DEFAULT_RANKING):
+    backend = BACKENDS[getattr(settings, 'RECOMMEND_BACKEND', 'index')]
+    with stage('score'):
+        scored = backend(ingredient_ids, limit, ranking)
+    with stage('hydrate'):
+        return hydrate([scored], ranking)[0]
+
+
+def hydrate(scored_lists, ranking=DEFAULT_RANKING):
+    """
+    Dokleja tytuł i link do wyników (recipe_id, match_count, total, match_percentage, score) - jedno zapytanie.
+    Poza domyślnym rankingiem dochodzi pole score ('idf', 'jaccard') albo missing_count ('missing').
+    """
+    # Tylko wybrane przepisy są pobierane z bazy - reszta rankingu liczy się z indeksu.
+    recipe_ids = {recipe_id for scored in scored_lists for recipe_id, *_ in scored}
+    recipes = Recipe.objects.only('id', 'title', 'link').in_bulk(recipe_ids)
+
+    hydrated = []
+    for scored in scored_lists:
+        recommendations = []
+        for recipe_id, match_count, total, match_percentage, score in scored:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recommendation = {
+                "id": recipe.id,
+                "title": recipe.title,
+                "match_count": match_count,
+                "total_ingredients": total,
+                "match_percentage": match_percentage,
+                "link": recipe.link
+            }
+            if ranking.mode == 'missing':
+                recommendation["missing_count"] = -score
+            elif ranking.mode != 'match_percentage':
+                recommendation["score"] = score
+            recommendations.append(recommendation)
+        hydrated.append(recommendations)
+
+    return hydrated
+
+
+# Cache wyników: klucz to wersja zbioru przepisów + posortowane id składników + limit.
+# Wersją jest stan dziennika zmian, który struktura licząca ranking w tym procesie (indeks, macierz)
+# już zawiera - proces, który nie dograł jeszcze zmian, liczy i zapisuje pod starszą wersją, więc
+# we wspólnym cache nie nadpisze nowszej. Dla rankingów liczonych w bazie jest to ostatnie id
+# dziennika znane procesowi (update_log.known_change_id) - bez zapytania przy każdym żądaniu.
+
+CURSOR_SALT = 'api.recommendations.cursor'
+
+_result_cache = None
+savings = {'seconds': 0.0}
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(
+            'recommend',
+            max_entries=settings.RECOMMEND_CACHE_SIZE,
+            ttl=settings.RECOMMEND_CACHE_TTL,
+            backend=settings.RECOMMEND_CACHE_BACKEND,
+        )
+    return _result_cache
+
+
+def dataset_version():
+    backend = getattr(settings, 'RECOMMEND_BACKEND', 'index')
+    version = None
+    if backend == 'matrix':
+        from api import recipe_matrix
+
+        version = recipe_matrix.log_version()
+    elif backend == 'index':
+        # Bez indeksu (cold_fallback) ranking liczy baza - jak dla backendu 'database'.
+        version = ingredient_index.log_version()
+    if version is None:
+        version = str(update_log.known_change_id())
+    return version
+
+
+def cache_key(ingredient_ids, limit, version, ranking=DEFAULT_RANKING):
+    digest = hashlib.sha1(','.join(map(str, ingredient_ids)).encode()).hexdigest()
+    return f'{version}:{limit}:{ranking.mode}:{ranking.max_missing}:{digest}'
+
+
+def cache_stats():
+    stats = get_result_cache().stats()
+    hits = stats['hits'] + stats['shared_hits']
+    stats['saved_ms_total'] = round(savings['seconds'] * 1000, 1)
+    stats['saved_ms_per_hit'] = round(savings['seconds'] * 1000 / hits, 2) if hits else None
+    return stats
+
+
+def parse_limit(value, name='limit', default=DEFAULT_LIMIT):
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+    max_limit = getattr(settings, 'RECOMMEND_MAX_LIMIT', 1000)
+    if limit < 1 or limit > max_limit:
+        raise ValueError(f"{name} must be between 1 and {max_limit}")
+    return limit
+
+
+def parse_ranking(mode, max_missing=None):
+    if mode in (None, ''):
+        mode = DEFAULT_RANKING.mode
+    if mode not in RANKING_MODES:
+        raise ValueError(f"ranking must be one of: {', '.join(RANKING_MODES)}")
+    if mode == 'idf' and getattr(settings, 'RECOMMEND_BACKEND', 'index') == 'database':
+        raise ValueError("ranking 'idf' is not available with the database backend")
+
+    if mode != 'missing':
+        if max_missing is not None:
+            raise ValueError("max_missing is only allowed with ranking 'missing'")
+        return Ranking(mode)
+
+    try:
+        max_missing = int(max_missing or 0)
+    except (TypeError, ValueError):
+        raise ValueError("max_missing must be a non-negative integer")
+    if max_missing < 0:
+        raise ValueError("max_missing must be a non-negative integer")
+    return Ranking(mode, max_missing)
@@ -0,0 +1,46 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.metrics import stage
+
+try:
+    import orjson
+except ImportError:  # opcjonalna zależność - bez niej zostaje zwykły JSONRenderer
+    orjson = None
+
+
+def ndjson_lines(items):
+    for item in items:
+        yield json.dumps(item, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Jeden obiekt JSON na linię (application/x-ndjson); lista jest rozbijana na elementy."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with stage('render'):
+            return b''.join(ndjson_lines(data if isinstance(data, list) else [data]))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer oparty na orjson. Typy, których orjson nie zna (np. leniwe tłumaczenia),
+    przechodzą przez enkoder DRF. Przy wcięciach (browsable API) i bez orjson - zwykły JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('render'):
+            if orjson is None or data is None:
+                return super().render(data, accepted_media_type, renderer_context)
+            if self.get_indent(accepted_media_type, renderer_context or {}):
+                return super().render(data, accepted_media_type, renderer_context)
+            return orjson.dumps(data, default=JSONEncoder().default)
@@ -2,7 +2,7 @@ from django.contrib.auth.models import User
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
-from api.models import Recipe, FavouriteRecipe
+from api.models import DETAIL_FIELDS, Recipe, FavouriteRecipe
 
 
 class RegisterSerializer(ModelSerializer):
@@ -16,13 +16,32 @@ class RegisterSerializer(ModelSerializer):
 
 
 class RecipeSerializer(serializers.ModelSerializer):
+    """Pełny przepis (RecipeDetailView)."""
+    ingredients = serializers.JSONField(source='detail.ingredients', read_only=True)
+    directions = serializers.JSONField(source='detail.directions', read_only=True)
+    source = serializers.CharField(source='detail.source', read_only=True)
+    ner = serializers.JSONField(source='detail.ner', read_only=True)
+    site = serializers.CharField(source='detail.site', read_only=True)
+
+    class Meta:
+        model = Recipe
+        fields = [
+            'id', 'title', 'ingredients', 'directions', 'link', 'source', 'ner', 'site', 'ingredient_ids',
+            'ingredient_count',
+        ]
+
+
+class RecipeSummarySerializer(serializers.ModelSerializer):
+    # Z RecipeDetail tylko ner - queryset musi mieć select_related('recipe__detail').
+    ner = serializers.JSONField(source='detail.ner', read_only=True)
+
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = ['id', 'title', 'link', 'ner', 'ingredient_count']
 
 
 class FavouriteRecipeSerializer(serializers.ModelSerializer):
-    recipe = RecipeSerializer(read_only=True)
+    recipe = RecipeSummarySerializer(read_only=True)
     recipe_id = serializers.PrimaryKeyRelatedField(
         queryset=Recipe.objects.all(), write_only=True, source='recipe'
     )
@@ -33,12 +52,6 @@ class FavouriteRecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
 
-class RecipeSummarySerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Recipe
-        fields = ['id', 'title', 'ner']
-
-
 class FavouriteRecipeSummarySerializer(serializers.ModelSerializer):
     recipe = RecipeSummarySerializer(read_only=True)
 
@@ -51,13 +64,59 @@ class RecipeMatchSerializer(RecipeSummarySerializer):
     match_count = serializers.IntegerField()
     total_ingredients = serializers.IntegerField()
     match_percentage = serializers.FloatField()
+    score = serializers.FloatField(required=False, help_text="Tylko dla ranking=idf i ranking=jaccard.")
+    missing_count = serializers.IntegerField(required=False, help_text="Tylko dla ranking=missing.")
+    affinity = serializers.FloatField(required=False, help_text="Tylko dla personalize=true.")
+    personal_score = serializers.FloatField(required=False, help_text="Tylko dla personalize=true.")
 
     class Meta(RecipeSummarySerializer.Meta):
-        fields = RecipeSummarySerializer.Meta.fields + ['match_count', 'total_ingredients', 'match_percentage']
+        fields = [
+            'id', 'title', 'link', 'match_count', 'total_ingredients', 'match_percentage', 'score', 'missing_count',
+            'affinity', 'personal_score',
+        ]
 
 
 class PaginatedRecipeMatchSerializer(serializers.Serializer):
     count = serializers.IntegerField()
     next = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
-    results = RecipeMatchSerializer(many=True)
\ No newline at end of file
+    results = RecipeMatchSerializer(many=True)
+
+# Szybka ścieżka dla endpointów tylko do odczytu: słowniki budowane wprost z .values(),
+# bez introspekcji pól DRF dla każdego obiektu. Pola i ich kolejność są takie jak w serializerach wyżej.
+
+RECIPE_FIELDS = list(RecipeSerializer().fields)
+RECIPE_COLUMNS = [
+    f'detail__{field}' if field in DETAIL_FIELDS else field for field in RECIPE_FIELDS
+]
+SUMMARY_FIELDS = list(RecipeSummarySerializer().fields)
+SUMMARY_COLUMNS = [
+    f'recipe__detail__{field}' if field in DETAIL_FIELDS else f'recipe__{field}' for field in SUMMARY_FIELDS
+]
+
+
+def recipe_dict(queryset, **lookup):
+    row = queryset.filter(**lookup).values_list(*RECIPE_COLUMNS).first()
+    if row is None:
+        raise queryset.model.DoesNotExist()
+    return dict(zip(RECIPE_FIELDS, row))
+
+
+def favourite_summary_dicts(queryset):
+    rows = queryset.values_list('id', *SUMMARY_COLUMNS)
+    return [{'id': row[0], 'recipe': dict(zip(SUMMARY_FIELDS, row[1:]))} for row in rows]
+
+
+def favourite_dicts(queryset):
+    rows = queryset.values_list('id', 'user_id', *SUMMARY_COLUMNS)
+    return [
+        {'id': row[0], 'user': row[1], 'recipe': dict(zip(SUMMARY_FIELDS, row[2:]))}
+        for row in rows
+    ]
+
+
+def favourite_dict(queryset, **lookup):
+    favourites = favourite_dicts(queryset.filter(**lookup)[:1])
+    if not favourites:
+        raise queryset.model.DoesNotExist()
+    return favourites[0]
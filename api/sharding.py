@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import django
+import numpy as np
+from django.conf import settings
+
+from api.ranking import DEFAULT_RANKING, rank_arrays, top_k
+from api.recipe_matrix import LiveMatrix, RecipeMatrix
+
+
+# Ranking macierzą (RECOMMEND_BACKEND='matrix') liczony równolegle dla bardzo dużych korpusów.
+# Wiersze pokolenia macierzy są dzielone na RECOMMEND_SHARDS ciągłych zakresów o podobnej liczbie
+# niezerowych (przepisy są posortowane po id, więc to zakresy id). Procesy puli mapują te same pliki
+# pokolenia (mmap) - strony są współdzielone przez page cache, nic nie jest kopiowane - i zwracają
+# top-K swojego zakresu. Rodzic scala je w globalne top-K razem z nakładką zmian z dziennika,
+# której procesy puli nie znają (dostają tylko id zmienionych przepisów do pominięcia).
+
+
+def shard_bounds(indptr, shards):
+    """Granice [start, end) zakresów wierszy o zbliżonej liczbie niezerowych."""
+    rows = len(indptr) - 1
+    targets = np.linspace(0, indptr[-1], shards + 1)
+    bounds = np.searchsorted(indptr, targets, side='left').clip(0, rows)
+    bounds[0], bounds[-1] = 0, rows
+    bounds = np.maximum.accumulate(bounds)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+class MatrixShard(RecipeMatrix):
+    """Wiersze [start, end) pokolenia - widoki na tablice mmap, kopiowany jest tylko indptr."""
+
+    def __init__(self, matrix, start, end):
+        indptr = matrix.matrix.indptr
+        low, high = indptr[start], indptr[end]
+        super().__init__(
+            matrix.ingredient_ids,
+            matrix.recipe_ids[start:end],
+            np.asarray(indptr[start:end + 1]) - low,
+            matrix.matrix.indices[low:high],
+            matrix.matrix.data[low:high],
+            matrix.sizes[start:end],
+        )
+        self.generation = matrix
+        self.start, self.end = start, end
+
+    def ingredient_weights(self):
+        # idf z całego pokolenia (w shardzie liczność dokumentów byłaby inna), liczone raz na proces
+        # i tylko dla rankingu 'idf'; sumy wierszy shardu to wycinek sum pokolenia.
+        if self._weights is None:
+            idf, weights = self.generation.ingredient_weights()
+            self._weights = idf, weights[self.start:self.end]
+        return self._weights
+
+
+# Stan procesu puli: załadowane pokolenie i jego shardy (pokolenie zmienia się rzadko).
+_generation = None
+_shards = {}
+
+
+def worker_shard(path, bounds):
+    global _generation
+    if _generation is None or _generation[0] != path:
+        _generation = path, RecipeMatrix.load(path)
+        _shards.clear()
+    shard = _shards.get(bounds)
+    if shard is None:
+        shard = _shards[bounds] = MatrixShard(_generation[1], *bounds)
+    return shard
+
+
+def score_shard(path, bounds, queries, k, ranking, hidden):
+    """Uruchamiane w puli: top-K każdego zapytania w jednym zakresie wierszy, bez przepisów z hidden."""
+    shard = worker_shard(path, bounds)
+    results = []
+    for ingredient_ids, (rows, *columns) in zip(queries, shard.match_many(queries, ranking)):
+        recipe_ids = shard.recipe_ids[rows]
+        if len(hidden):
+            visible = ~np.isin(recipe_ids, hidden)
+            recipe_ids, columns = recipe_ids[visible], [column[visible] for column in columns]
+        results.append(rank_arrays(ranking, k, len(ingredient_ids), recipe_ids, *columns))
+    return results
+
+
+class ShardedScorer:
+    def __init__(self, shards, workers=None):
+        self.shards = shards
+        # forkserver: procesy puli nie dziedziczą wątków, blokad ani połączeń z bazą workera serwera.
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers or shards,
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=django.setup,
+        )
+
+    def top_k_many(self, live, queries, k, ranking=DEFAULT_RANKING):
+        _, overlay, changed_ids = live.state
+        path = str(live.generation)
+        futures = [
+            self.pool.submit(score_shard, path, bounds, queries, k, ranking, changed_ids)
+            for bounds in shard_bounds(live.base.matrix.indptr, self.shards)
+        ]
+        partial = []
+        if overlay is not None:
+            if ranking.mode == 'idf' and overlay._weights is None:
+                live.fit_overlay_weights(overlay)
+            partial.append(overlay.top_k_many(queries, k, ranking))
+        partial += [future.result() for future in futures]
+        return [top_k(chain.from_iterable(lists), k) for lists in zip(*partial)] if partial else [[] for _ in queries]
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+
+def get_scorer():
+    """ShardedScorer z RECOMMEND_SHARDS, albo None, gdy podział jest wyłączony."""
+    global _scorer
+    shards = getattr(settings, 'RECOMMEND_SHARDS', 0)
+    if shards < 2:
+        return None
+    if _scorer is None:
+        with _scorer_lock:
+            if _scorer is None:
+                workers = getattr(settings, 'RECOMMEND_SHARD_WORKERS', None) or min(shards, os.cpu_count() or 1)
+                _scorer = ShardedScorer(shards, workers)
+    return _scorer
+
+
+def top_k_many(matrix, queries, k, ranking=DEFAULT_RANKING):
+    """Jak matrix.top_k_many; równolegle po shardach, jeśli są włączone i macierz ma pokolenie na dysku."""
+    scorer = get_scorer()
+    if scorer is None or not isinstance(matrix, LiveMatrix) or matrix.generation is None:
+        return matrix.top_k_many(queries, k, ranking)
+    return scorer.top_k_many(matrix, queries, k, ranking)
@@ -0,0 +1,240 @@
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from api.generations import current_generation, publish
+from api.models import Recipe
+from api.recipe_matrix import dense_columns, lookup_columns
+
+
+ARRAYS = ('ingredient_ids', 'recipe_ids', 'indptr', 'indices', 'hash_a', 'hash_b', 'bucket_keys', 'bucket_rows')
+
+# Liczba pierwsza > 2^32. Haszowane są numery kolumn słownika (< 2^31), nie Ingredient.id (bigint),
+# więc a * x mieści się w uint64.
+PRIME = np.uint64(4294967311)
+CHUNK = 4096  # przepisów na raz przy liczeniu sygnatur (pamięć: CHUNK x składniki x permutacje)
+
+
+def band_multipliers(rows):
+    # Stałe nieparzyste mnożniki do złożenia wierszy pasma w jeden klucz uint64.
+    return np.random.default_rng(0x5EED).integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+
+
+class SimilarityIndex:
+    """
+    MinHash LSH nad zbiorami składników przepisów (Recipe.ingredient_ids, czyli kanoniczne Recipe.ner).
+    Sygnatura przepisu to minima permutations funkcji haszujących; dzielimy ją na bands pasm i przepisy
+    z identycznym pasmem trafiają do wspólnego kubełka. Kandydaci z kubełków są oceniani dokładnym
+    Jaccardem na zbiorach składników. Składniki są kolumnami słownika ingredient_ids (jak w RecipeMatrix).
+    Wszystkie tablice są zapisywane na dysk i mapowane w pamięć.
+    """
+
+    def __init__(self, bands, ingredient_ids, recipe_ids, indptr, indices, hash_a, hash_b, bucket_keys, bucket_rows):
+        self.bands = bands
+        self.ingredient_ids = ingredient_ids
+        self.recipe_ids = recipe_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.hash_a = hash_a
+        self.hash_b = hash_b
+        self.bucket_keys = bucket_keys  # (bands, przepisy) - klucze pasm posortowane w każdym paśmie
+        self.bucket_rows = bucket_rows  # (bands, przepisy) - wiersze przepisów w tej samej kolejności
+        self.multipliers = band_multipliers(len(hash_a) // bands)
+
+    @classmethod
+    def build(cls, rows, permutations=64, bands=16, seed=1):
+        if permutations % bands:
+            raise ValueError("permutations must be divisible by bands")
+
+        recipe_ids, indptr, vocabulary, indices = dense_columns(rows)
+        rng = np.random.default_rng(seed)
+        index = cls(
+            bands,
+            vocabulary,
+            recipe_ids,
+            indptr,
+            indices,
+            rng.integers(1, PRIME, size=permutations, dtype=np.uint64),
+            rng.integers(0, PRIME, size=permutations, dtype=np.uint64),
+            None,
+            None,
+        )
+        index._build_buckets()
+        return index
+
+    @classmethod
+    def from_database(cls, permutations=64, bands=16):
+        rows = Recipe.objects.order_by('id').values_list('id', 'ingredient_ids').iterator(chunk_size=5000)
+        return cls.build(rows, permutations, bands)
+
+    def _build_buckets(self):
+        keys = self.band_keys(self.signatures())
+        # Przepisy bez składników miałyby wspólną pustą sygnaturę - nie trafiają do kubełków.
+        rows = np.flatnonzero(np.diff(self.indptr))
+        keys = keys[rows]
+        order = np.argsort(keys, axis=0, kind='stable')
+        self.bucket_keys = np.ascontiguousarray(np.take_along_axis(keys, order, axis=0).T)
+        self.bucket_rows = np.ascontiguousarray(rows[order].T.astype(np.int32))
+
+    def signatures(self):
+        """Sygnatury MinHash wszystkich przepisów, liczone paczkami po CHUNK wierszy."""
+        count = len(self.recipe_ids)
+        result = np.zeros((count, len(self.hash_a)), dtype=np.uint64)
+        for start in range(0, count, CHUNK):
+            stop = min(count, start + CHUNK)
+            low, high = self.indptr[start], self.indptr[stop]
+            if low == high:
+                continue
+            hashes = self._hash(self.indices[low:high])
+            offsets = self.indptr[start:stop] - low
+            non_empty = self.indptr[start + 1:stop + 1] > self.indptr[start:stop]
+            result[start:stop][non_empty] = np.minimum.reduceat(hashes, offsets[non_empty], axis=0)
+        return result
+
+    def signature(self, columns):
+        return self._hash(np.asarray(columns)).min(axis=0)
+
+    def _hash(self, columns):
+        return (columns.astype(np.uint64)[:, None] * self.hash_a + self.hash_b) % PRIME
+
+    def band_keys(self, signatures):
+        rows = len(self.hash_a) // self.bands
+        bands = signatures.reshape(*signatures.shape[:-1], self.bands, rows)
+        return (bands * self.multipliers).sum(axis=-1, dtype=np.uint64)
+
+    def candidates(self, columns, max_bucket=None):
+        """Wiersze przepisów, które z zapytaniem (kolumnami jego składników) dzielą co najmniej jedno pasmo."""
+        keys = self.band_keys(self.signature(columns))
+        found = []
+        for band, key in enumerate(keys):
+            low = np.searchsorted(self.bucket_keys[band], key, side='left')
+            high = np.searchsorted(self.bucket_keys[band], key, side='right')
+            if max_bucket:
+                high = min(high, low + max_bucket)
+            found.append(self.bucket_rows[band, low:high])
+        return np.unique(np.concatenate(found))
+
+    def jaccard(self, rows, columns, query_size):
+        """
+        Dokładny Jaccard zapytania ze zbiorami składników przepisów z podanych wierszy. columns to kolumny
+        składników zapytania ze słownika, query_size - liczba wszystkich jego składników (także spoza słownika).
+        """
+        if not len(rows):
+            return np.empty(0)
+        starts, stops = self.indptr[rows], self.indptr[rows + 1]
+        members = np.concatenate([self.indices[start:stop] for start, stop in zip(starts, stops)])
+        sizes = stops - starts
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        hits = np.isin(members, columns).astype(np.int64)
+        intersection = np.add.reduceat(hits, offsets) if len(members) else np.zeros(len(rows), dtype=np.int64)
+        intersection[sizes == 0] = 0
+        return intersection / (query_size + sizes - intersection)
+
+    def similar(self, ingredient_ids, limit, exclude=None, max_bucket=None):
+        """Zwraca [(recipe_id, jaccard)] - limit najbardziej podobnych przepisów, bez przepisu exclude."""
+        ingredient_ids = np.unique(np.asarray(ingredient_ids, dtype=np.int64))
+        columns, known = lookup_columns(self.ingredient_ids, ingredient_ids)
+        columns = columns[known]
+        # Składniki spoza słownika nie występują w żadnym przepisie - liczą się tylko do sumy zbiorów.
+        if not len(columns):
+            return []
+
+        rows = self.candidates(columns, max_bucket)
+        recipe_ids = self.recipe_ids[rows]
+        if exclude is not None:
+            keep = recipe_ids != exclude
+            rows, recipe_ids = rows[keep], recipe_ids[keep]
+
+        similarity = np.round(self.jaccard(rows, columns, len(ingredient_ids)), 4)
+        order = np.lexsort((recipe_ids, -similarity))[:limit]
+        return list(zip(recipe_ids[order].tolist(), similarity[order].tolist()))
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(path / f'{name}.npy', getattr(self, name))
+        with open(path / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'bands': self.bands}, f)
+
+    @classmethod
+    def load(cls, path):
+        """Jak RecipeMatrix.load - tablice mapowane w pamięć, współdzielone przez workery."""
+        path = Path(path)
+        with open(path / 'meta.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r') for name in ARRAYS if (path / f'{name}.npy').exists()
+        }
+        if 'ingredient_ids' not in arrays:
+            # Indeks sprzed słownika: w indices są wprost Ingredient.id.
+            arrays['ingredient_ids'] = np.arange(int(arrays['indices'].max(initial=-1)) + 1, dtype=np.int64)
+        return cls(meta['bands'], **arrays)
+
+
+def brute_force_similar(matrix, ingredient_ids, limit, exclude=None):
+    """Dokładne top-N po Jaccardzie przez całą macierz RecipeMatrix - punkt odniesienia dla LSH."""
+    rows, intersection, sizes = matrix.match(ingredient_ids)
+    intersection, sizes = intersection.astype(np.int64), sizes.astype(np.int64)
+    recipe_ids = matrix.recipe_ids[rows]
+    if exclude is not None:
+        keep = recipe_ids != exclude
+        rows, recipe_ids, intersection, sizes = rows[keep], recipe_ids[keep], intersection[keep], sizes[keep]
+    similarity = np.round(intersection / (len(set(ingredient_ids)) + sizes - intersection), 4)
+    order = np.lexsort((recipe_ids, -similarity))[:limit]
+    return list(zip(recipe_ids[order].tolist(), similarity[order].tolist()))
+
+
+# Indeks jest publikowany jak macierz (api.generations): każda przebudowa trafia do nowego katalogu
+# pokolenia, a workery przełączają się po zmianie CURRENT. Nadpisanie plików, które workery mają
+# zmapowane (np.save w miejscu), kończy się SIGBUS przy następnym odczycie.
+
+_index = None  # (katalog pokolenia, SimilarityIndex)
+_index_lock = threading.Lock()
+
+
+def index_path():
+    return Path(getattr(settings, 'SIMILARITY_INDEX_PATH', Path(settings.BASE_DIR) / 'var' / 'similarity'))
+
+
+def get_index():
+    """
+    Indeks bieżącego pokolenia - po opublikowaniu nowego ładowany przy następnym zapytaniu.
+    Rzuca FileNotFoundError, gdy indeks nie został zbudowany (manage.py build_similarity_index).
+    """
+    global _index
+    generation = current_generation(index_path())
+    loaded = _index
+    if loaded is None or loaded[0] != generation:
+        with _index_lock:
+            if _index is None or _index[0] != generation:
+                _index = generation, SimilarityIndex.load(generation)
+            loaded = _index
+    return loaded[1]
+
+
+def publish_index(permutations=None, bands=None):
+    """Buduje indeks z bazy i publikuje go jako nowe pokolenie w SIMILARITY_INDEX_PATH."""
+    index = SimilarityIndex.from_database(
+        permutations or settings.SIMILARITY_PERMUTATIONS, bands or settings.SIMILARITY_BANDS
+    )
+    return index, publish(index_path(), index.save, keep=settings.SIMILARITY_GENERATIONS_KEPT)
+
+
+def similar_recipes(recipe_id, ingredient_ids, limit):
+    """Podobne przepisy z tytułem i linkiem - jedno zapytanie do bazy na hydratację."""
+    scored = get_index().similar(
+        ingredient_ids, limit, exclude=recipe_id, max_bucket=getattr(settings, 'SIMILARITY_MAX_BUCKET', None)
+    )
+    recipes = Recipe.objects.only('id', 'title', 'link').in_bulk([similar_id for similar_id, _ in scored])
+
+    results = []
+    for similar_id, similarity in scored:
+        recipe = recipes.get(similar_id)
+        if recipe is None:
+            continue
+        results.append({"id": recipe.id, "title": recipe.title, "link": recipe.link, "similarity": similarity})
+    return results
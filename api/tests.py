@@ -1,3 +1,1121 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import random
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncClient, AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from drf_spectacular.generators import SchemaGenerator
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import (
+    async_views, benchmarks, detection, ingredient_index, metrics, personalization, recipe_matrix, recommendations,
+    sharding, similarity, update_log, views,
+)
+from api.imaging import prepare_image, scale_box
+from api.import_recipes import import_recipes_from_csv
+from api.ingredients import canonical_names, canonicalize
+from api.middleware import QueryCounter
+from api.models import FavouriteRecipe, Ingredient, Recipe, RecipeChange
+from api.recipe_matrix import LiveMatrix, RecipeMatrix
+from api.ranking import Ranking, idf, top_k, top_k_arrays
+from api.recommendations import (
+    get_result_cache, recommend, recommend_many, score_with_database, score_with_index,
+)
+from api.vocabulary import get_vocabulary
+
+
+def make_recipe(title, ner):
+    return Recipe.objects.create_with_detail(
+        title=title,
+        ingredients=[f'1 c. {name}' for name in ner],
+        directions=['Mix.'],
+        link=f'www.example.com/{title}',
+        source='Gathered',
+        ner=ner,
+        site='www.example.com',
+    )
+
+
+class StubModel:
+    """Zamiast YOLO: dla każdego obrazu te same detekcje, zapamiętuje rozmiary paczek."""
+
+    names = {0: 'eggs', 1: 'saffron'}
+    detections = [([10, 20, 30, 40], 0, 0.91), ([0, 0, 5, 5], 1, 0.3)]
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.entered = threading.Event()
+        self.batch_sizes = []
+
+    def predict(self, images, verbose=False):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.batch_sizes.append(len(images))
+        boxes = SimpleNamespace(
+            xyxy=[box for box, _, _ in self.detections],
+            cls=[cls for _, cls, _ in self.detections],
+            conf=[conf for _, _, conf in self.detections],
+        )
+        return [SimpleNamespace(boxes=boxes, names=self.names) for _ in images]
+
+
+def jpeg_bytes(size=(64, 48), color='white', exif=None):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', **({'exif': exif} if exif is not None else {}))
+    return buffer.getvalue()
+
+
+def install_stub_detector(test, **options):
+    """Podstawia BatchingDetector ze StubModel i czysty cache wyników; zwraca model."""
+    model = StubModel(options.pop('gate', None))
+    test.addCleanup(setattr, detection, '_detector', None)
+    test.addCleanup(setattr, detection, '_result_cache', None)
+    test.addCleanup(setattr, detection, '_weights_version', None)
+    detection._detector = detection.BatchingDetector(lambda: model, **options)
+    detection._result_cache = None
+    detection._weights_version = 'test-weights'
+    return model
+
+
+class QueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipes = [make_recipe(f'recipe-{i}', ['eggs', 'milk', f'spice {i}']) for i in range(20)]
+
+    def add_favourites(self, recipes):
+        return [FavouriteRecipe.objects.create(user=self.user, recipe=recipe) for recipe in recipes]
+
+    def test_favourites_list_query_count_does_not_depend_on_size(self):
+        self.add_favourites(self.recipes[:1])
+        with QueryCounter() as one:
+            response = self.client.get('/api/favourites/')
+        self.assertEqual(len(response.json()), 1)
+
+        self.add_favourites(self.recipes[1:])
+        with QueryCounter() as many:
+            response = self.client.get('/api/favourites/')
+        self.assertEqual(len(response.json()), 20)
+        self.assertEqual(one.count, many.count)
+
+    def test_favourites_list_is_single_query(self):
+        self.add_favourites(self.recipes)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/favourites/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()[0]['recipe']), {'id', 'title', 'link', 'ner', 'ingredient_count'})
+        self.assertEqual(response.json()[0]['recipe']['ner'], ['eggs', 'milk', 'spice 0'])
+
+    def test_favourite_detail_is_single_query(self):
+        favourite = self.add_favourites(self.recipes[:1])[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/favourites/{favourite.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['recipe']['id'], favourite.recipe_id)
+        self.assertEqual(response.json()['recipe']['ner'], ['eggs', 'milk', 'spice 0'])
+
+    def test_recipe_detail_is_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/recipes/{self.recipes[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'recipe-0')
+        self.assertEqual(response.json()['ner'], ['eggs', 'milk', 'spice 0'])
+        self.assertEqual(response.json()['ingredient_count'], 3)
+
+    @override_settings(QUERY_COUNT_HEADERS=True)
+    def test_query_count_headers(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/recipes/{self.recipes[0].pk}/')
+        self.assertEqual(response['X-DB-Query-Count'], '1')
+        self.assertIn('X-DB-Time', response)
+
+
+class IngredientCanonicalizationTests(TestCase):
+    def test_plurals(self):
+        self.assertEqual(canonicalize('Tomatoes'), 'tomato')
+        self.assertEqual(canonicalize('cherries'), 'cherry')
+        self.assertEqual(canonicalize('bay leaves'), 'bay leaf')
+        self.assertEqual(canonicalize('peaches'), 'peach')
+        self.assertEqual(canonicalize('eggs'), 'egg')
+        self.assertEqual(canonicalize('asparagus'), 'asparagus')
+        self.assertEqual(canonicalize('molasses'), 'molasses')
+        self.assertEqual(canonicalize('oats'), 'oats')
+
+    def test_synonyms(self):
+        self.assertEqual(canonicalize('  Scallions '), 'green onion')
+        self.assertEqual(canonicalize('fresh cilantro'), 'coriander')
+        self.assertEqual(canonicalize('All-Purpose  Flour'), 'flour')
+        self.assertEqual(canonicalize('prawns'), 'shrimp')
+
+    def test_unknown_and_invalid_names(self):
+        self.assertEqual(canonicalize('Dragon   Fruit'), 'dragon fruit')
+        self.assertEqual(canonical_names(['', '   ', 'salt', 'Salt']), {'salt'})
+        self.assertEqual(canonical_names('salt'), set())
+        self.assertEqual(canonical_names(None), set())
+
+    @override_settings(RECOMMEND_BACKEND='database')
+    def test_recipes_match_by_canonical_id(self):
+        vocabulary = get_vocabulary()
+        recipe = make_recipe('salad', ['Scallions', 'Tomatoes', 'rocket'])
+        make_recipe('bread', ['flour', 'salt'])
+        self.assertEqual(vocabulary.lookup(['green onion']), vocabulary.lookup(['spring onions']))
+        self.assertEqual(vocabulary.lookup(['unknown thing']), [])
+        self.assertEqual([row['id'] for row in recommend(['spring onions', 'tomato', 'arugula'])], [recipe.pk])
+
+    def test_ingredient_ids_beyond_int32(self):
+        saffron = Ingredient.objects.create(id=2 ** 31 + 5, name='saffron')
+        get_vocabulary().ids['saffron'] = saffron.pk
+        self.addCleanup(get_vocabulary().ids.pop, 'saffron')
+        recipe = make_recipe('paella', ['saffron', 'rice', 'peas'])
+        twin = make_recipe('paella valenciana', ['saffron', 'rice', 'peas', 'chicken'])
+        make_recipe('risotto', ['rice', 'butter'])
+        self.assertIn(saffron.pk, Recipe.objects.get(pk=recipe.pk).ingredient_ids)
+        self.assertEqual(RecipeChange.objects.filter(ingredient_ids__contains=[saffron.pk]).count(), 2)
+
+        ingredient_index.rebuild_index()
+        self.addCleanup(setattr, ingredient_index, '_index', None)
+        recipe_matrix._matrix = RecipeMatrix.from_database()
+        self.addCleanup(setattr, recipe_matrix, '_matrix', None)
+        # Kolumny to pozycje w słowniku, nie Ingredient.id - wektor zapytania nie rośnie z największym id.
+        self.assertEqual(recipe_matrix._matrix.columns, 5)
+        self.assertEqual(RecipeMatrix.build([(1, [3, saffron.pk])]).top_k([saffron.pk], 5), [(1, 1, 2, 50.0, 50.0)])
+
+        for backend in ('index', 'matrix', 'database'):
+            for ranking in (Ranking(), Ranking('idf')):
+                if backend == 'database' and ranking.mode == 'idf':
+                    continue
+                with self.subTest(backend=backend, ranking=ranking), override_settings(RECOMMEND_BACKEND=backend):
+                    get_result_cache().local.clear()
+                    rows = recommend(['saffron', 'peas'], ranking=ranking)
+                    self.assertEqual([row['id'] for row in rows], [recipe.pk, twin.pk])
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        similarity.SimilarityIndex.from_database().save(directory.name)
+        similarity._index = None
+        self.addCleanup(setattr, similarity, '_index', None)
+        with override_settings(SIMILARITY_INDEX_PATH=directory.name):
+            similar = similarity.similar_recipes(recipe.pk, Recipe.objects.get(pk=recipe.pk).ingredient_ids, 5)
+        self.assertEqual([row['id'] for row in similar], [twin.pk])
+        self.assertEqual(similar[0]['similarity'], 0.75)
+
+
+class IngredientIndexTests(TestCase):
+    queries = [['eggs', 'milk'], ['rice'], ['salt', 'spice 2', 'saffron'], ['unknown thing']]
+
+    def setUp(self):
+        for i in range(25):
+            make_recipe(f'recipe-{i}', ['salt', f'spice {i % 4}'] + (['eggs', 'milk'] if i % 2 else ['rice']))
+        self.index = ingredient_index.rebuild_index()
+        self.addCleanup(setattr, ingredient_index, '_index', None)
+
+    def database_counts(self, ingredient_ids):
+        return {
+            recipe_id: len(set(ids) & set(ingredient_ids))
+            for recipe_id, ids in Recipe.objects.values_list('id', 'ingredient_ids')
+            if set(ids) & set(ingredient_ids)
+        }
+
+    def assert_matches_database(self):
+        queries = [get_vocabulary().lookup(ingredients) for ingredients in self.queries]
+        for ingredient_ids, counts in zip(queries, self.index.match_many(queries)):
+            with self.subTest(ingredient_ids=ingredient_ids):
+                self.assertEqual(dict(self.index.match(ingredient_ids)), self.database_counts(ingredient_ids))
+                self.assertEqual(dict(counts), self.database_counts(ingredient_ids))
+                self.assertEqual(score_with_index(ingredient_ids, 10), score_with_database(ingredient_ids, 10))
+
+    def test_match_equals_database(self):
+        self.assert_matches_database()
+
+    def test_apply_changes_and_remove_follow_database(self):
+        position = update_log.latest_change_id()
+        edited = Recipe.objects.get(title='recipe-3')
+        edited.detail.ner = ['saffron', 'rice']
+        edited.detail.save()
+        Recipe.objects.get(title='recipe-4').delete()
+        make_recipe('late', ['eggs', 'saffron'])
+        self.index.apply_changes(update_log.ChangeFollower(position).poll())
+        self.assert_matches_database()
+
+        removed = Recipe.objects.get(title='recipe-5')
+        removed_id = removed.pk
+        self.index.remove(removed_id, removed.ingredient_ids)
+        removed.delete()
+        self.assertEqual(self.index.size(removed_id), 0)
+        self.assert_matches_database()
+
+
+class BatchRecommendationTests(TestCase):
+    queries = [
+        ['eggs', 'milk'],
+        ['Eggs', 'milk '],
+        ['flour', 'sugar', 'butter'],
+        ['spice 3', 'eggs'],
+        ['unknown thing'],
+        ['eggs', 'milk'],
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(30):
+            make_recipe(f'recipe-{i}', ['eggs', 'milk', f'spice {i}'] + (['flour', 'sugar'] if i % 3 else []))
+        ingredient_index.rebuild_index()
+        recipe_matrix._matrix = RecipeMatrix.from_database()
+
+    def tearDown(self):
+        recipe_matrix._matrix = None
+
+    def test_batch_matches_single_queries_for_every_backend(self):
+        for backend in ('index', 'matrix', 'database'):
+            with self.subTest(backend=backend), override_settings(RECOMMEND_BACKEND=backend):
+                get_result_cache().local.clear()
+                batch = recommend_many(self.queries, limit=10)
+                get_result_cache().local.clear()
+                self.assertEqual(batch, [recommend(ingredients, limit=10) for ingredients in self.queries])
+
+    def test_batch_endpoint(self):
+        response = self.client.post('/api/recommend/batch/', {'queries': self.queries, 'limit': 5}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), len(self.queries))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[4], [])
+
+    def test_batch_endpoint_rejects_empty_query(self):
+        response = self.client.post('/api/recommend/batch/', {'queries': [['eggs'], []]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(23):
+            make_recipe(f'recipe-{i}', ['eggs', f'spice {i}'] + (['milk'] if i % 3 else []))
+        ingredient_index.rebuild_index()
+
+    def post(self, data):
+        return self.client.post('/api/recommend/', data, format='json')
+
+    def test_cursor_round_trip(self):
+        expected = recommend(['eggs', 'milk'], limit=20)
+        page = self.post({'ingredients': ['eggs', 'milk'], 'limit': 20, 'page_size': 6}).json()
+        self.assertIsNone(page['previous'])
+        pages = [page]
+        while page['next']:
+            page = self.post({'cursor': page['next']}).json()
+            pages.append(page)
+
+        self.assertEqual([len(page['results']) for page in pages], [6, 6, 6, 2])
+        self.assertEqual([row for page in pages for row in page['results']], expected)
+        self.assertEqual({page['count'] for page in pages}, {20})
+        self.assertEqual(self.post({'cursor': pages[2]['previous']}).json(), pages[1])
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = self.post({'ingredients': ['eggs'], 'page_size': 5}).json()['next']
+        tampered = cursor[:-3] + ('AAA' if not cursor.endswith('AAA') else 'BBB')
+        for value in (tampered, 'not-a-cursor'):
+            with self.subTest(cursor=value):
+                response = self.post({'cursor': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_expired_cursor_is_rejected(self):
+        cursor = self.post({'ingredients': ['eggs'], 'page_size': 5}).json()['next']
+        self.assertEqual(self.post({'cursor': cursor}).status_code, 200)
+        with override_settings(RECOMMEND_CURSOR_MAX_AGE=-1):  # każdy kursor jest już przeterminowany
+            response = self.post({'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+
+class TopKTests(TestCase):
+    def scored(self, count):
+        # Mało różnych wartości - dużo remisów po score i match_count.
+        rng = random.Random(count)
+        items = []
+        for recipe_id in rng.sample(range(10 * count), count):
+            total = rng.randint(1, 4)
+            match_count = rng.randint(1, total)
+            percentage = round(match_count / total * 100, 2)
+            items.append((recipe_id, match_count, total, percentage, percentage))
+        return items
+
+    def test_top_k_equals_full_sort(self):
+        for count in (0, 1, 7, 200):
+            items = self.scored(count)
+            expected = sorted(items, key=lambda item: (-item[4], -item[1], item[0]))
+            for k in (1, 5, count, count + 3):
+                with self.subTest(count=count, k=k):
+                    self.assertEqual(top_k(iter(items), k), expected[:k])
+                    arrays = [np.array(column) for column in zip(*items)] if items else [np.array([])] * 5
+                    self.assertEqual(top_k_arrays(*arrays[:4], k, arrays[4]), expected[:k])
+
+
+class RankingModeTests(TestCase):
+    queries = [['eggs', 'milk'], ['saffron', 'rice', 'salt'], ['salt', 'eggs', 'spice 2'], ['flour']]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(40):
+            ner = ['salt', f'spice {i % 7}']
+            ner += ['eggs', 'milk'] if i % 2 else ['rice']
+            ner += ['saffron'] if i % 9 == 0 else []
+            ner += ['flour', 'sugar', 'butter'][:i % 4]
+            make_recipe(f'recipe-{i}', ner)
+        ingredient_index.rebuild_index()
+        recipe_matrix._matrix = RecipeMatrix.from_database()
+
+    def tearDown(self):
+        recipe_matrix._matrix = None
+
+    def expected(self, ingredients, ranking, limit):
+        """Ranking liczony wprost w Pythonie, przepis po przepisie."""
+        query = set(get_vocabulary().lookup(ingredients))
+        recipes = list(Recipe.objects.values_list('id', 'ingredient_ids'))
+        frequency = {}
+        for _, ids in recipes:
+            for ingredient_id in ids:
+                frequency[ingredient_id] = frequency.get(ingredient_id, 0) + 1
+        weight = {ingredient_id: idf(len(recipes), count) for ingredient_id, count in frequency.items()}
+
+        scored = []
+        for recipe_id, ids in recipes:
+            matched = query & set(ids)
+            if not matched:
+                continue
+            missing = len(ids) - len(matched)
+            if ranking.mode == 'idf':
+                score = round(sum(weight[i] for i in matched) / sum(weight[i] for i in ids) * 100, 2)
+            elif ranking.mode == 'jaccard':
+                score = round(len(matched) / len(query | set(ids)), 4)
+            elif ranking.mode == 'missing':
+                if missing > ranking.max_missing:
+                    continue
+                score = -missing
+            else:
+                score = round(len(matched) / len(ids) * 100, 2)
+            scored.append((-score, -len(matched), recipe_id))
+        return [recipe_id for *_, recipe_id in sorted(scored)[:limit]]
+
+    def test_backends_agree_with_reference(self):
+        rankings = [Ranking(), Ranking('idf'), Ranking('jaccard'), Ranking('missing', 1), Ranking('missing', 3)]
+        for backend in ('index', 'matrix', 'database'):
+            for ranking in rankings:
+                if backend == 'database' and ranking.mode == 'idf':
+                    continue
+                with self.subTest(backend=backend, ranking=ranking), override_settings(RECOMMEND_BACKEND=backend):
+                    get_result_cache().local.clear()
+                    batch = recommend_many(self.queries, limit=8, ranking=ranking)
+                    for ingredients, recommendations in zip(self.queries, batch):
+                        self.assertEqual(
+                            [recipe['id'] for recipe in recommendations], self.expected(ingredients, ranking, 8)
+                        )
+                        self.assertEqual(recommendations, recommend(ingredients, limit=8, ranking=ranking))
+
+    def test_rare_ingredient_weighs_more_with_idf(self):
+        ranking = Ranking('idf')
+        top = recommend(['saffron', 'rice', 'salt'], limit=1, ranking=ranking)[0]
+        self.assertIn('saffron', Recipe.objects.get(pk=top['id']).detail.ner)
+        self.assertIn('score', top)
+
+    def test_index_weights_follow_updates(self):
+        index = ingredient_index.get_index()
+        index.ensure_weights()
+        recipe = make_recipe('late', ['saffron', 'salt'])
+        index.add(recipe.pk, recipe.ingredient_ids)
+        rows, _, _, matched, weights = index.match_arrays(get_vocabulary().lookup(['saffron', 'salt']), weighted=True)
+        self.assertIn(recipe.pk, rows.tolist())
+        position = rows.tolist().index(recipe.pk)
+        self.assertAlmostEqual(matched[position], weights[position])
+
+        index.remove(recipe.pk, recipe.ingredient_ids)
+        rows, *_ = index.match_arrays(get_vocabulary().lookup(['saffron']), weighted=True)
+        self.assertNotIn(recipe.pk, rows.tolist())
+
+    def test_ranking_validation(self):
+        for data in ({'ranking': 'best'}, {'ranking': 'missing', 'max_missing': -1}, {'max_missing': 2}):
+            with self.subTest(data=data):
+                response = self.client.post('/api/recommend/', {'ingredients': ['eggs'], **data}, format='json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_ranking_survives_pagination(self):
+        data = {'ingredients': ['eggs', 'salt'], 'ranking': 'missing', 'max_missing': 2, 'page_size': 3}
+        first = self.client.post('/api/recommend/', data, format='json').json()
+        second = self.client.post('/api/recommend/', {'cursor': first['next']}, format='json').json()
+        self.assertTrue(all('missing_count' in recipe for recipe in first['results'] + second['results']))
+        self.assertLessEqual(first['results'][-1]['missing_count'], second['results'][0]['missing_count'])
+
+
+class SimilarRecipesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.base = make_recipe('pancakes', ['flour', 'eggs', 'milk', 'sugar', 'butter', 'salt'])
+        self.twin = make_recipe('crepes', ['flour', 'eggs', 'milk', 'sugar', 'butter', 'salt', 'vanilla'])
+        for i in range(30):
+            make_recipe(f'other-{i}', [f'spice {i}', f'herb {i % 5}', 'water'])
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        similarity.SimilarityIndex.from_database().save(self.directory.name)
+        similarity._index = None
+        self.addCleanup(setattr, similarity, '_index', None)
+
+    def test_near_duplicate_is_most_similar(self):
+        with override_settings(SIMILARITY_INDEX_PATH=self.directory.name):
+            response = self.client.get(f'/recipes/{self.base.pk}/similar/?limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['id'], self.twin.pk)
+        self.assertEqual(response.json()[0]['similarity'], round(6 / 7, 4))
+        self.assertNotIn(self.base.pk, [recipe['id'] for recipe in response.json()])
+
+    def test_matches_brute_force(self):
+        index = similarity.SimilarityIndex.load(self.directory.name)
+        matrix = RecipeMatrix.from_database()
+        for recipe in Recipe.objects.all():
+            with self.subTest(recipe=recipe.title):
+                expected = similarity.brute_force_similar(matrix, recipe.ingredient_ids, 1, exclude=recipe.pk)
+                found = index.similar(recipe.ingredient_ids, 1, exclude=recipe.pk)
+                if expected[0][1] >= 0.8:
+                    self.assertEqual(found, expected)
+
+    def test_rebuild_while_loaded_publishes_new_generation(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(SIMILARITY_INDEX_PATH=directory.name):
+            call_command('build_similarity_index', stdout=io.StringIO())
+            old = similarity.get_index()
+            old_ids = old.recipe_ids.tolist()
+
+            added = make_recipe('pancakes again', ['flour', 'eggs', 'milk', 'sugar', 'butter', 'salt'])
+            for _ in range(3):
+                call_command('build_similarity_index', stdout=io.StringIO())
+
+            # Pliki starego pokolenia zostały usunięte, ale nie nadpisane - zmapowane tablice nadal się czytają.
+            self.assertEqual(old.recipe_ids.tolist(), old_ids)
+            self.assertEqual(old.similar(self.base.ingredient_ids, 1, exclude=self.base.pk)[0][0], self.twin.pk)
+
+            current = similarity.get_index()
+            self.assertIsNot(current, old)
+            self.assertIn(added.pk, current.recipe_ids.tolist())
+            self.assertEqual(current.similar(self.base.ingredient_ids, 1, exclude=self.base.pk), [(added.pk, 1.0)])
+            self.assertEqual(len(list((Path(directory.name) / 'generations').iterdir())), 2)
+
+    def test_missing_recipe_and_missing_index(self):
+        with override_settings(SIMILARITY_INDEX_PATH=self.directory.name):
+            self.assertEqual(self.client.get('/recipes/999999/similar/').status_code, 404)
+        with override_settings(SIMILARITY_INDEX_PATH=f'{self.directory.name}/missing'):
+            self.assertEqual(self.client.get(f'/recipes/{self.base.pk}/similar/').status_code, 503)
+
+
+class PersonalizationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.savoury = make_recipe('savoury omelette', ['eggs', 'milk', 'bacon'])
+        self.sweet = make_recipe('sweet omelette', ['eggs', 'milk', 'sugar'])
+        self.cake = make_recipe('cake', ['flour', 'sugar', 'butter'])
+        ingredient_index.rebuild_index()
+        personalization.get_profile_cache().local.clear()
+        self.addCleanup(personalization.get_profile_cache().local.clear)
+
+    def recommend(self, **data):
+        return self.client.post('/api/recommend/', {'ingredients': ['eggs', 'milk'], **data}, format='json')
+
+    def test_profile_follows_favourites(self):
+        self.assertEqual(personalization.get_profile(self.user.id), {'favourites': 0, 'ingredients': {}})
+        sugar = get_vocabulary().lookup(['sugar'])[0]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/favourites/', {'recipe_id': self.cake.pk}, format='json')
+        profile = personalization.get_profile(self.user.id)
+        self.assertEqual(profile['favourites'], 1)
+        self.assertEqual(profile['ingredients'][sugar], 1)
+        self.assertEqual(profile, personalization.load_profile(self.user.id))
+
+        favourite = FavouriteRecipe.objects.get(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/favourites/{favourite.pk}/')
+        self.assertEqual(personalization.get_profile(self.user.id), {'favourites': 0, 'ingredients': {}})
+
+    @override_settings(PERSONALIZATION_CACHE_BACKEND='default')
+    def test_profile_follows_favourites_across_workers(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.addCleanup(setattr, personalization, '_profile_cache', None)
+
+        def worker():
+            personalization._profile_cache = None
+            return personalization.get_profile_cache()
+
+        first, second = worker(), worker()
+
+        def favourite(cache, recipe):
+            personalization._profile_cache = cache
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/favourites/', {'recipe_id': recipe.pk}, format='json')
+
+        def profile(cache):
+            personalization._profile_cache = cache
+            return personalization.get_profile(self.user.id)
+
+        self.assertEqual(profile(first)['favourites'], 0)
+        self.assertEqual(profile(second)['favourites'], 0)
+        favourite(first, self.cake)
+        self.assertEqual(profile(second)['favourites'], 1)
+        favourite(second, self.sweet)
+        favourite(first, self.savoury)
+        for cache in (first, second):
+            self.assertEqual(profile(cache), personalization.load_profile(self.user.id))
+            self.assertEqual(profile(cache)['favourites'], 3)
+
+    def test_favourites_boost_similar_recipes(self):
+        base = self.recommend(limit=2).json()
+        self.assertEqual([recipe['id'] for recipe in base], [self.savoury.pk, self.sweet.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/favourites/', {'recipe_id': self.cake.pk}, format='json')
+        personalized = self.recommend(limit=2, personalize=True).json()
+        self.assertEqual([recipe['id'] for recipe in personalized], [self.sweet.pk, self.savoury.pk])
+        self.assertEqual(personalized[0]['affinity'], round(1 / 3, 4))
+        self.assertEqual(personalized[1]['personal_score'], personalized[1]['match_percentage'])
+
+    def test_personalize_validation(self):
+        self.assertEqual(self.recommend(personalize=True, page_size=10).status_code, 400)
+        self.assertEqual(self.recommend(personalize=True, ranking='missing').status_code, 400)
+        self.assertEqual(self.recommend(personalize=True, ranking='jaccard').status_code, 200)
+
+
+class BenchmarkTests(TestCase):
+    def test_corpus_is_deterministic_and_droppable(self):
+        self.assertEqual(benchmarks.corpus_chunk(3)[:20], benchmarks.corpus_chunk(3)[:20])
+        self.assertTrue(benchmarks.ensure_corpus(50, log=lambda *args: None))
+        self.assertFalse(benchmarks.ensure_corpus(50, log=lambda *args: None))
+
+        recipes = Recipe.objects.filter(detail__source=benchmarks.SYNTHETIC_SOURCE)
+        self.assertEqual(recipes.count(), 50)
+        recipe = recipes.get(title='Synthetic recipe 7')
+        self.assertEqual(len(recipe.ingredient_ids), len(recipe.detail.ner))
+        self.assertEqual(recipe.detail.ner, benchmarks.corpus_chunk(0)[7][0]['ner'])
+        self.assertEqual(benchmarks.drop_corpus(), 50)
+
+    def test_recipe_storage_compares_hot_and_wide_rows(self):
+        for i in range(5):
+            make_recipe(f'recipe-{i}', ['eggs', 'milk', f'spice {i}'])
+        results = benchmarks.WORKLOADS['recipe_storage']({'queries': 2})
+        self.assertEqual(results['recipes'], 5)
+        self.assertLess(results['hot']['buffers_per_row'], results['wide']['buffers_per_row'])
+
+    def test_compare_marks_regressions(self):
+        baseline = {'results': {'recommend': {'p50_ms': 10.0, 'runs': 5}, 'import': {'rows_per_s': 100.0}}}
+        current = {'results': {'recommend': {'p50_ms': 12.0, 'runs': 5}, 'import': {'rows_per_s': 150.0}}}
+        self.assertEqual(benchmarks.compare(baseline, current), [
+            ('import.rows_per_s', 100.0, 150.0, 50.0, True),
+            ('recommend.p50_ms', 10.0, 12.0, 20.0, False),
+        ])
+
+
+class ImportRecipesTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = Path(directory.name) / 'recipes.csv'
+        self.checkpoint_path = Path(directory.name) / 'recipes.checkpoint.json'
+
+    def write_csv(self, rows):
+        with open(self.csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, ['title', 'ingredients', 'directions', 'link', 'source', 'NER', 'site'])
+            writer.writeheader()
+            for title, ner, *source in rows:
+                writer.writerow({
+                    'title': title,
+                    'ingredients': json.dumps([f'1 c. {name}' for name in ner]) if isinstance(ner, list) else ner,
+                    'directions': '["Mix."]',
+                    'link': f'www.example.com/{title}',
+                    'source': source[0] if source else 'Gathered',
+                    'NER': json.dumps(ner) if isinstance(ner, list) else ner,
+                    'site': 'www.example.com',
+                })
+
+    def run_import(self, chunk_size):
+        return import_recipes_from_csv(
+            self.csv_path, chunk_size=chunk_size, workers=1, checkpoint_path=self.checkpoint_path, log=lambda _: None,
+        )
+
+    def test_resume_skips_imported_rows_with_different_chunk_size(self):
+        self.write_csv([(f'recipe-{i}', ['eggs', f'spice {i}']) for i in range(7)])
+        self.checkpoint_path.write_text(json.dumps({
+            'source': str(self.csv_path.resolve()), 'rows': 3, 'chunks': 1, 'success': 3, 'failed': 0, 'finished': False,
+        }))
+
+        self.assertEqual(self.run_import(chunk_size=2), (7, 0))
+        self.assertEqual(sorted(Recipe.objects.values_list('title', flat=True)), [f'recipe-{i}' for i in range(3, 7)])
+        checkpoint = json.loads(self.checkpoint_path.read_text())
+        self.assertEqual((checkpoint['rows'], checkpoint['finished']), (7, True))
+
+    def test_checkpoint_of_another_file_is_not_resumed(self):
+        self.write_csv([('recipe', ['eggs'])])
+        self.checkpoint_path.write_text(json.dumps({
+            'source': '/elsewhere/recipes.csv', 'rows': 1, 'chunks': 1, 'success': 1, 'failed': 0, 'finished': False,
+        }))
+        with self.assertRaises(ValueError):
+            self.run_import(chunk_size=10)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_rejected_chunk_is_written_row_by_row_and_failures_are_counted(self):
+        self.write_csv([
+            ('good-1', ['eggs']),
+            ('too-long-source', ['milk'], 'x' * 300),
+            ('good-2', ['eggs', 'milk']),
+            ('broken-ner', '[not json'),
+            ('good-3', ['salt']),
+        ])
+        self.assertEqual(self.run_import(chunk_size=10), (3, 2))
+        self.assertEqual(sorted(Recipe.objects.values_list('title', flat=True)), ['good-1', 'good-2', 'good-3'])
+        self.assertEqual(RecipeChange.objects.count(), 3)
+        self.assertEqual(json.loads(self.checkpoint_path.read_text())['failed'], 2)
+
+
+class DetectionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_full_queue_raises_busy_and_returns_429(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        model = install_stub_detector(self, gate=gate, batch_size=1, max_wait=0, queue_size=2)
+        detector = detection.get_detector()
+
+        running = detector.submit(Image.new('RGB', (8, 8)))
+        self.assertTrue(model.entered.wait(5))
+        queued = [detector.submit(Image.new('RGB', (8, 8))) for _ in range(2)]
+        with self.assertRaises(detection.DetectorBusy):
+            detector.submit(Image.new('RGB', (8, 8)))
+
+        upload = io.BytesIO(jpeg_bytes())
+        upload.name = 'photo.jpg'
+        response = self.client.post('/api/process-image/', {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, 429)
+
+        gate.set()
+        for future in [running] + queued:
+            self.assertEqual(len(future.result(timeout=5).boxes.xyxy), 2)
+
+    def test_exif_rotated_image_boxes_scale_to_original(self):
+        # Zapisany obraz 80x40 z czerwoną lewą ćwiartką; orientacja 6 = obrót o 90° w prawo przy
+        # wyświetlaniu, więc oryginał ma 40x80, a czerwony pas jest u góry (y < 20).
+        stored = Image.new('RGB', (80, 40), 'white')
+        stored.paste((255, 0, 0), (0, 0, 20, 40))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        stored.save(buffer, 'JPEG', exif=exif, quality=95)
+        buffer.seek(0)
+
+        image, scale = prepare_image(buffer, 20)
+        self.assertEqual(image.size, (10, 20))
+        self.assertEqual(scale, (4.0, 4.0))
+        red_rows = [y for y in range(image.height) if image.getpixel((5, y))[1] < 128]
+        self.assertEqual((min(red_rows), max(red_rows)), (0, 4))
+
+        box = [0, 0, image.width, max(red_rows) + 1]
+        self.assertEqual(scale_box(box, scale), [0, 0, 40, 20])
+        self.assertEqual(scale_box([0, 0, image.width, image.height], scale), [0, 0, 40, 80])
+
+    def test_repeated_image_is_served_from_cache(self):
+        model = install_stub_detector(self, batch_size=1, max_wait=0)
+        decoded = []
+
+        def counting_prepare_image(image_file, target_size):
+            decoded.append(image_file)
+            return prepare_image(image_file, target_size)
+
+        self.addCleanup(setattr, detection, 'prepare_image', prepare_image)
+        detection.prepare_image = counting_prepare_image
+        content = jpeg_bytes()
+
+        first = detection.detect(SimpleUploadedFile('a.jpg', content))
+        timings = {}
+        second = detection.detect(SimpleUploadedFile('b.jpg', content), timings)
+        self.assertEqual(second, first)
+        self.assertEqual((len(decoded), model.batch_sizes), (1, [1]))
+        self.assertNotIn('inference', timings)
+
+        detection.detect(SimpleUploadedFile('c.jpg', jpeg_bytes(color='black')))
+        self.assertEqual((len(decoded), model.batch_sizes), (2, [1, 1]))
+
+    def test_cache_key_changes_with_weights_version(self):
+        model = install_stub_detector(self, batch_size=1, max_wait=0)
+        content = jpeg_bytes()
+        key = detection.content_key(SimpleUploadedFile('a.jpg', content))
+        detection.detect(SimpleUploadedFile('a.jpg', content))
+
+        detection._weights_version = 'retrained-weights'
+        upload = SimpleUploadedFile('a.jpg', content)
+        self.assertNotEqual(detection.content_key(upload), key)
+        _, cached, image, _ = detection._lookup_or_prepare(upload)
+        self.assertIs(cached, detection.ResultCache.MISSING)
+        self.assertIsNotNone(image)
+
+        detection.detect(SimpleUploadedFile('a.jpg', content))
+        self.assertEqual(model.batch_sizes, [1, 1])
+
+    def test_queued_images_are_predicted_in_one_batch(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        model = install_stub_detector(self, gate=gate, batch_size=4, max_wait=0.2, queue_size=8)
+        detector = detection.get_detector()
+
+        first = detector.submit(Image.new('RGB', (8, 8)))
+        self.assertTrue(model.entered.wait(5))
+        waiting = [detector.submit(Image.new('RGB', (8, 8))) for _ in range(4)]
+        gate.set()
+        for future in [first] + waiting:
+            future.result(timeout=5)
+
+        self.assertEqual(model.batch_sizes, [1, 4])
+        stats = detector.stats()
+        self.assertEqual((stats['batches'], stats['images'], stats['avg_batch_size']), (2, 5, 2.5))
+
+
+class RecipeChangeLogTests(TestCase):
+    def setUp(self):
+        for i in range(20):
+            make_recipe(f'recipe-{i}', ['salt', f'spice {i % 5}'] + (['eggs', 'milk'] if i % 2 else ['rice']))
+
+    def edit_recipes(self):
+        edited = Recipe.objects.get(title='recipe-3')
+        edited.detail.ner = ['saffron', 'rice']
+        edited.detail.save()
+        Recipe.objects.get(title='recipe-4').delete()
+        return edited, make_recipe('late', ['eggs', 'saffron'])
+
+    def test_saves_and_deletes_are_logged(self):
+        position = update_log.latest_change_id()
+        edited, added = self.edit_recipes()
+        changes = update_log.ChangeFollower(position).poll()
+        self.assertEqual([recipe_id for recipe_id, *_ in changes], [edited.pk, changes[1][0], added.pk])
+        self.assertEqual(changes[0][2], edited.ingredient_ids)
+        self.assertIsNone(changes[1][2])
+        self.assertIsNone(changes[2][1])
+
+    def test_follower_revisits_gaps(self):
+        position = update_log.latest_change_id()
+        first, second, third = (RecipeChange.objects.create(recipe_id=i, ingredient_ids=[1]) for i in range(3))
+        missing_id = second.id
+        second.delete()
+        follower = update_log.ChangeFollower(position)
+        self.assertEqual([recipe_id for recipe_id, *_ in follower.poll()], [0, 2])
+        self.assertEqual(set(follower.gaps), {missing_id})
+
+        RecipeChange.objects.create(id=missing_id, recipe_id=1, ingredient_ids=[1])
+        self.assertEqual([recipe_id for recipe_id, *_ in follower.poll()], [1])
+        self.assertEqual(follower.gaps, {})
+
+    def test_index_follows_log_after_commit(self):
+        ingredient_index.rebuild_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            edited, added = self.edit_recipes()
+        rows, *_ = ingredient_index.get_index().match_arrays(get_vocabulary().lookup(['saffron']))
+        self.assertEqual(sorted(rows.tolist()), sorted([edited.pk, added.pk]))
+
+    @override_settings(RECOMMEND_BACKEND='database')
+    def test_save_invalidates_cached_recommendations(self):
+        before = [row['id'] for row in recommend(['saffron'])]
+        with self.captureOnCommitCallbacks(execute=True):
+            edited, added = self.edit_recipes()
+        after = [row['id'] for row in recommend(['saffron'])]
+        self.assertEqual(before, [])
+        self.assertEqual(sorted(after), sorted([edited.pk, added.pk]))
+
+    @override_settings(RECOMMEND_BACKEND='database')
+    def test_change_from_another_process_invalidates_cached_recommendations(self):
+        self.assertEqual(recommend(['saffron']), [])
+        recipe = Recipe.objects.get(title='recipe-3')
+        saffron = get_vocabulary().resolve(['saffron'])
+        # Zapis z innego procesu: bez sygnałów, tylko wpis w dzienniku - widoczny po odczycie z wątku w tle.
+        Recipe.objects.filter(pk=recipe.pk).update(ingredient_ids=saffron, ingredient_count=1)
+        RecipeChange.objects.create(
+            recipe_id=recipe.pk, old_ingredient_ids=recipe.ingredient_ids, ingredient_ids=saffron,
+        )
+        self.assertEqual(recommend(['saffron']), [])
+        update_log.sync_now()
+        self.assertEqual([row['id'] for row in recommend(['saffron'])], [recipe.pk])
+
+    @override_settings(RECOMMEND_CACHE_BACKEND='default')
+    def test_worker_behind_the_log_does_not_write_under_newer_version(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.addCleanup(setattr, ingredient_index, '_index', None)
+        self.addCleanup(setattr, recommendations, '_result_cache', None)
+        behind = ingredient_index.rebuild_index()
+        edited, added = self.edit_recipes()
+        ahead = ingredient_index.IngredientIndex.from_database()
+
+        def worker(index):
+            # Osobny proces: własny indeks i lokalne LRU, wspólny backend cache.
+            ingredient_index._index = index
+            recommendations._result_cache = None
+            return [row['id'] for row in recommend(['saffron'])]
+
+        self.assertEqual(worker(behind), [])
+        self.assertEqual(sorted(worker(ahead)), sorted([edited.pk, added.pk]))
+        self.assertNotEqual(behind.follower.version, ahead.follower.version)
+
+        behind.follower.follow(behind.apply_changes)
+        self.assertEqual(behind.follower.version, ahead.follower.version)
+        self.assertEqual(sorted(worker(behind)), sorted([edited.pk, added.pk]))
+        self.assertEqual(get_result_cache().stats()['shared_hits'], 1)
+
+    def test_sync_thread_starts_only_in_server_process(self):
+        ingredient_index.rebuild_index()
+        self.assertIsNone(update_log._thread)
+
+        self.addCleanup(setattr, update_log, '_background', False)
+        self.addCleanup(setattr, update_log, '_thread', None)
+        update_log.enable_background_sync()
+        with override_settings(INDEX_SYNC_INTERVAL=3600):
+            update_log.register(ingredient_index.refresh)
+        self.assertTrue(update_log._thread.is_alive())
+
+    def test_live_matrix_matches_fresh_build(self):
+        live = LiveMatrix(RecipeMatrix.from_database())
+        self.edit_recipes()
+        live.follower.follow(live.apply_changes)
+        fresh = RecipeMatrix.from_database()
+
+        queries = [get_vocabulary().lookup(ingredients) for ingredients in (['saffron'], ['eggs', 'rice'], ['salt'])]
+        for ranking in (Ranking(), Ranking('jaccard'), Ranking('missing', 2)):
+            with self.subTest(ranking=ranking):
+                self.assertEqual(live.top_k_many(queries, 10, ranking), fresh.top_k_many(queries, 10, ranking))
+                self.assertEqual(live.top_k(queries[0], 10, ranking), fresh.top_k(queries[0], 10, ranking))
+        # idf nakładki pochodzi z pokolenia bazowego - zgadza się zbiór wyników, nie wartości.
+        for live_result, fresh_result in zip(live.top_k_many(queries, 30, Ranking('idf')),
+                                             fresh.top_k_many(queries, 30, Ranking('idf'))):
+            self.assertEqual({row[0] for row in live_result}, {row[0] for row in fresh_result})
+
+    def test_new_generation_is_swapped_in(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, recipe_matrix, '_matrix', None)
+        with override_settings(RECIPE_MATRIX_PATH=directory.name):
+            first = recipe_matrix.rebuild_matrix()
+            added = make_recipe('late', ['eggs', 'saffron'])
+            for _ in range(3):
+                recipe_matrix.publish_matrix()
+            recipe_matrix.refresh()
+
+            current = recipe_matrix.get_matrix()
+            self.assertNotEqual(current.generation, first.generation)
+            self.assertEqual(current.changed, {})
+            self.assertIn(added.pk, current.base.recipe_ids.tolist())
+            self.assertEqual(len(list((current.generation.parent).iterdir())), 2)
+
+    def test_unpublished_matrix_directory_is_not_loaded(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, recipe_matrix, '_matrix', None)
+        with override_settings(RECIPE_MATRIX_PATH=directory.name, RECOMMEND_BACKEND='matrix'):
+            (Path(directory.name) / 'build.lock').touch()
+            self.assertFalse(recipe_matrix.is_published())
+            self.assertFalse(recipe_matrix.warmup())
+            call_command('check', stdout=io.StringIO())
+            self.assertIsNone(recipe_matrix._matrix)
+
+            recipe_matrix.publish_matrix()
+            self.assertTrue(recipe_matrix.warmup())
+            self.assertIsInstance(recipe_matrix._matrix, LiveMatrix)
+
+
+class ShardedScoringTests(TestCase):
+    def test_shard_bounds_cover_all_rows(self):
+        indptr = np.array([0, 5, 5, 6, 20, 21, 22, 30])
+        bounds = sharding.shard_bounds(indptr, 3)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], 7)
+        self.assertTrue(all(end == start for (_, end), (start, _) in zip(bounds, bounds[1:])))
+        self.assertEqual(sharding.shard_bounds(indptr, 20)[-1][1], 7)
+
+    def test_shard_weights_are_lazy_slices_of_generation_weights(self):
+        for i in range(12):
+            make_recipe(f'recipe-{i}', ['salt', f'spice {i % 4}'] + (['eggs'] if i % 2 else []))
+        generation = RecipeMatrix.from_database()
+        shard = sharding.MatrixShard(generation, 4, 9)
+        shard.top_k(get_vocabulary().lookup(['salt', 'eggs']), 5)
+        self.assertIsNone(generation._weights)
+        self.assertIsNone(shard._weights)
+
+        idf, weights = shard.ingredient_weights()
+        self.assertIs(idf, generation.ingredient_weights()[0])
+        np.testing.assert_array_equal(weights, generation.ingredient_weights()[1][4:9])
+
+    def test_sharded_matches_single_process(self):
+        for i in range(60):
+            make_recipe(f'recipe-{i}', ['salt', f'spice {i % 7}'] + (['eggs', 'milk'] if i % 2 else ['rice']))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        RecipeMatrix.from_database().save(directory.name)
+        live = LiveMatrix(RecipeMatrix.load(directory.name), directory.name)
+
+        edited = Recipe.objects.get(title='recipe-3')
+        edited.detail.ner = ['saffron', 'eggs']
+        edited.detail.save()
+        Recipe.objects.get(title='recipe-8').delete()
+        live.follower.follow(live.apply_changes)
+
+        scorer = sharding.ShardedScorer(3, workers=2)
+        self.addCleanup(scorer.close)
+        queries = [get_vocabulary().lookup(ingredients) for ingredients in (['eggs', 'saffron'], ['rice'], ['salt'])]
+        for ranking in (Ranking(), Ranking('idf'), Ranking('jaccard'), Ranking('missing', 2)):
+            with self.subTest(ranking=ranking):
+                self.assertEqual(scorer.top_k_many(live, queries, 15, ranking), live.top_k_many(queries, 15, ranking))
+
+
+@override_settings(METRICS_ENABLED=True, SERVER_TIMING_HEADER=True)
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.admin = User.objects.create_superuser(username='admin', password='secret')
+        self.client = APIClient()
+        for i in range(5):
+            make_recipe(f'recipe-{i}', ['eggs', 'milk', f'spice {i}'])
+        ingredient_index.rebuild_index()
+
+    def test_server_timing_and_metrics(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/recommend/', {'ingredients': ['eggs', 'spice 1']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for name in ('parse', 'lookup', 'cache', 'score', 'hydrate', 'render', 'total'):
+            self.assertIn(name, stages)
+
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        body = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('recipes_stage_duration_seconds_count{view="recommend_recipes",stage="score"} 1', body)
+        self.assertIn('recipes_http_requests_total{view="recommend_recipes",method="POST",status="200"}', body)
+        self.assertIn('recipes_recommend_cache_misses_total', body)
+
+    def test_async_middleware_chain(self):
+        token = Token.objects.create(user=self.user)
+        response = async_to_sync(AsyncClient().get)(
+            f'/recipes/{Recipe.objects.first().pk}/', headers={'authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_disabled(self):
+        self.assertIs(metrics.stage('score'), metrics.stage('hydrate'))
+        self.client.force_authenticate(self.admin)
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+
+@override_settings(RECOMMEND_BACKEND='database')
+class AsyncViewTests(TransactionTestCase):
+    # Widoki async liczą w pulach wątków z osobnymi połączeniami - dane muszą być zatwierdzone.
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cook', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(10):
+            make_recipe(f'recipe-{i}', ['eggs', 'milk', f'spice {i}'])
+        self.factory = AsyncRequestFactory()
+
+    def post(self, view, data, **headers):
+        request = self.factory.post(
+            '/api/recommend/', json.dumps(data), content_type='application/json', headers=headers
+        )
+        return async_to_sync(view)(request)
+
+    def test_async_recommend_matches_sync_view(self):
+        data = {'ingredients': ['eggs', 'spice 3'], 'limit': 5}
+        response = self.post(async_views.recommend_recipes, data, authorization=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), self.client.post('/api/recommend/', data, format='json').json())
+
+    def test_async_recommend_requires_token(self):
+        response = self.post(async_views.recommend_recipes, {'ingredients': ['eggs']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_async_views_have_sync_schema(self):
+        def paths(module):
+            patterns = [
+                path('api/recommend/', module.recommend_recipes),
+                path('api/process-image/', module.process_image),
+                path('api/recipes-from-image/', module.recipes_from_image),
+            ]
+            return SchemaGenerator(patterns=patterns).get_schema(request=None, public=True)['paths']
+
+        async_paths = paths(async_views)
+        self.assertEqual(set(async_paths), {'/api/recommend/', '/api/process-image/', '/api/recipes-from-image/'})
+        self.assertEqual(async_paths, paths(views))
+
+    def recipes_from_image(self, asynchronous, content, **fields):
+        data = {'image': SimpleUploadedFile('photo.jpg', content, content_type='image/jpeg'), **fields}
+        if not asynchronous:
+            response = self.client.post('/api/recipes-from-image/', data, format='multipart')
+            return response.status_code, response.json()
+        request = self.factory.post('/api/recipes-from-image/', data, headers={'authorization': f'Token {self.token.key}'})
+        response = async_to_sync(async_views.recipes_from_image)(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_recipes_from_image_confidence_filter_and_timings(self):
+        install_stub_detector(self, batch_size=1, max_wait=0)
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                detection._result_cache = None
+                content = jpeg_bytes(color='white' if asynchronous else 'black')
+
+                code, body = self.recipes_from_image(asynchronous, content)
+                self.assertEqual(code, 200)
+                self.assertEqual([item['confidence'] for item in body['ingredients']], [0.91, 0.3])
+                self.assertEqual(body['labels'], ['eggs'])
+                self.assertEqual(len(body['recommendations']), 10)
+                self.assertEqual(set(body['timings_ms']), {'preprocess', 'inference', 'recommendation', 'total'})
+                self.assertGreaterEqual(body['timings_ms']['total'], body['timings_ms']['recommendation'])
+
+                code, body = self.recipes_from_image(asynchronous, content, min_confidence='0.2', limit='3')
+                self.assertEqual(code, 200)
+                self.assertEqual(body['labels'], ['eggs', 'saffron'])
+                self.assertEqual(len(body['recommendations']), 3)
+                # Drugi raz to samo zdjęcie - wynik z cache, bez etapu inference.
+                self.assertEqual(set(body['timings_ms']), {'preprocess', 'recommendation', 'total'})
+
+                code, body = self.recipes_from_image(asynchronous, content, min_confidence='0.95')
+                self.assertEqual((code, body['labels'], body['recommendations']), (200, [], []))
+
+                code, body = self.recipes_from_image(asynchronous, content, min_confidence='2')
+                self.assertEqual((code, body), (400, {'error': 'min_confidence must be a number between 0 and 1'}))
+
+    def test_async_recommend_validation_errors(self):
+        response = self.post(async_views.recommend_recipes, {}, authorization=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'error': 'Missing ingredients'})
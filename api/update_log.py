@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from api.models import Recipe, RecipeChange
+
+
+logger = logging.getLogger(__name__)
+
+# Dziennik zmian przepisów. Każdy zapis Recipe (sygnały - także z panelu admina) i każdy chunk
+# importu dopisuje w tej samej transakcji wpisy RecipeChange. Struktury liczone z Recipe
+# (indeks w pamięci, macierz na dysku) pamiętają pozycję w dzienniku, od której są aktualne,
+# i co INDEX_SYNC_INTERVAL sekund dogrywają nowe wpisy w wątku w tle - bez przebudowy
+# i bez blokowania zapytań. Zastosowanie wpisu to "usuń stare składniki, dodaj nowe", więc
+# ponowne dogranie zmiany już zawartej w strukturze jest nieszkodliwe.
+
+GAP_TIMEOUT = 60  # sekundy czekania na id zarezerwowane przez jeszcze niezatwierdzoną transakcję
+MAX_GAPS = 10000
+POLL_LIMIT = 10000
+
+
+def record_changes(changes):
+    """changes: [(recipe_id, stare ingredient_ids albo None, nowe albo None)] - w bieżącej transakcji."""
+    RecipeChange.objects.bulk_create([
+        RecipeChange(recipe_id=recipe_id, old_ingredient_ids=old, ingredient_ids=new) for recipe_id, old, new in changes
+    ])
+    transaction.on_commit(sync_now)
+
+
+def latest_change_id():
+    return RecipeChange.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+# Ostatnie id dziennika widziane przez ten proces - wersja zbioru przepisów dla rankingów liczonych
+# wprost w bazie (recommendations.dataset_version) bez zapytania przy każdym żądaniu. Podbijają je
+# followery struktur i odczyt w sync_now (po commicie w tym procesie i w wątku w tle).
+
+_known_change_id = None
+
+
+def known_change_id():
+    if _known_change_id is None:
+        refresh_known_change_id()
+        register(refresh_known_change_id)
+    return _known_change_id
+
+
+def note_change_id(change_id):
+    global _known_change_id
+    if _known_change_id is None or change_id > _known_change_id:
+        _known_change_id = change_id
+
+
+def refresh_known_change_id():
+    note_change_id(latest_change_id())
+
+
+def prune(retention=None):
+    """Usuwa wpisy starsze niż RECIPE_CHANGE_RETENTION - po opublikowaniu nowego pokolenia macierzy."""
+    retention = retention if retention is not None else settings.RECIPE_CHANGE_RETENTION
+    # Ostatni wpis zostaje - bez niego nowe struktury startowałyby z pozycji 0
+    # i wersja zbioru przepisów (recommendations.dataset_version) by się cofnęła.
+    old = RecipeChange.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=retention))
+    return old.exclude(id=latest_change_id()).delete()[0]
+
+
+class ChangeFollower:
+    """
+    Pozycja jednej struktury w dzienniku. Id wpisów są nadawane przy INSERT, a widoczne dopiero
+    po zatwierdzeniu transakcji, więc wpis o mniejszym id może pojawić się po większym - pominięte
+    id (luki) są odpytywane ponownie przez GAP_TIMEOUT sekund (potem uznajemy je za wycofane).
+    """
+
+    def __init__(self, position):
+        self.position = position
+        self.gaps = {}  # id -> kiedy zauważona
+        self.version = str(position)
+
+    def poll(self, limit=POLL_LIMIT):
+        """Zwraca nowe wpisy [(recipe_id, stare, nowe)] w kolejności id."""
+        condition = Q(id__gt=self.position)
+        if self.gaps:
+            condition |= Q(id__in=list(self.gaps))
+        rows = list(
+            RecipeChange.objects.filter(condition).order_by('id')
+            .values_list('id', 'recipe_id', 'old_ingredient_ids', 'ingredient_ids')[:limit]
+        )
+
+        now = time.monotonic()
+        for change_id, *_ in rows:
+            if self.gaps.pop(change_id, None) is not None:
+                continue
+            for missing in range(max(self.position + 1, change_id - MAX_GAPS), change_id):
+                self.gaps[missing] = now
+            self.position = max(self.position, change_id)
+        self.gaps = {
+            change_id: seen for change_id, seen in self.gaps.items() if now - seen < GAP_TIMEOUT
+        }
+        if len(self.gaps) > MAX_GAPS:
+            self.gaps = dict(sorted(self.gaps.items())[-MAX_GAPS:])
+        note_change_id(self.position)
+        return [(recipe_id, old, new) for _, recipe_id, old, new in rows]
+
+    def follow(self, apply):
+        """Przekazuje do apply kolejne paczki nowych wpisów, aż dziennik się skończy; zwraca ich liczbę."""
+        applied = 0
+        while True:
+            changes = self.poll()
+            if changes:
+                apply(changes)
+                applied += len(changes)
+            self.version = self.applied_version()
+            if len(changes) < POLL_LIMIT:
+                return applied
+
+    def applied_version(self):
+        """
+        Stan dziennika zawarty w strukturze: pozycja, a przy lukach także skrót ich id - wpis z luki
+        może być już w innym procesie na tej samej pozycji. Ustawiane w follow() dopiero po apply,
+        więc proces, który jeszcze nie dograł zmian, nie poda nowszej wersji niż ma dane.
+        """
+        if not self.gaps:
+            return str(self.position)
+        digest = hashlib.sha1(','.join(map(str, sorted(self.gaps))).encode()).hexdigest()[:12]
+        return f'{self.position}-{digest}'
+
+
+# Struktury do odświeżania: funkcje wywoływane przez sync_now (rejestrowane przy zbudowaniu
+# indeksu / załadowaniu macierzy). Wątek w tle startuje przy pierwszej rejestracji, ale tylko
+# w procesie serwera (enable_background_sync z wsgi.py / asgi.py) - komendy manage.py go nie uruchamiają.
+
+_refreshers = []
+_sync_lock = threading.Lock()
+_thread = None
+_background = False
+
+
+def enable_background_sync():
+    global _background
+    _background = True
+
+
+def register(refresh):
+    global _thread
+    with _sync_lock:
+        if refresh not in _refreshers:
+            _refreshers.append(refresh)
+        interval = getattr(settings, 'INDEX_SYNC_INTERVAL', 0)
+        # Po fork wątek rodzica nie istnieje w procesie potomnym (is_alive() == False).
+        if _background and interval and (_thread is None or not _thread.is_alive()):
+            _thread = threading.Thread(target=_run, args=(interval,), name='recipe-sync', daemon=True)
+            _thread.start()
+
+
+def sync_now():
+    """Dogrywa dziennik do wszystkich zarejestrowanych struktur (też po commicie zmian w tym procesie)."""
+    with _sync_lock:
+        refreshers = list(_refreshers)
+        for refresh in refreshers:
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Recipe change sync failed: %s", refresh)
+
+
+def _run(interval):
+    while True:
+        time.sleep(interval)
+        close_old_connections()
+        try:
+            sync_now()
+        finally:
+            connection.close()
+
+
+# Sygnały Recipe
+
+def recipe_pre_save(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._old_ingredient_ids = None
+        return
+    instance._old_ingredient_ids = (
+        Recipe.objects.filter(pk=instance.pk).values_list('ingredient_ids', flat=True).first()
+    )
+
+
+def recipe_post_save(sender, instance, **kwargs):
+    record_changes([(instance.pk, getattr(instance, '_old_ingredient_ids', None), instance.ingredient_ids)])
+
+
+def recipe_post_delete(sender, instance, **kwargs):
+    record_changes([(instance.pk, instance.ingredient_ids, None)])
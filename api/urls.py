@@ -1,24 +1,40 @@
+from django.conf import settings
 from django.urls import path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from rest_framework.authtoken.views import obtain_auth_token
 
 from .views import (
     recommend_recipes,
+    recommend_recipes_batch,
+    recommendation_stats,
+    metrics,
     RegisterView,
     FavouriteRecipeListCreateView,
     RecipeDetailView,
+    SimilarRecipesView,
     FavouriteRecipeDeleteView,
     FavouriteRecipeDetailView,
-    process_image
+    process_image,
+    recipes_from_image,
+    detection_stats
 )
 
+if settings.ASYNC_VIEWS:
+    from .async_views import recommend_recipes, process_image, recipes_from_image
+
 
 urlpatterns = [
     path('api/recommend/', recommend_recipes, name='recommend_recipes'),
+    path('api/recommend/batch/', recommend_recipes_batch, name='recommend_recipes_batch'),
+    path('api/recommend/stats/', recommendation_stats, name='recommendation_stats'),
     path('api/process-image/', process_image, name='process_image'),
+    path('api/recipes-from-image/', recipes_from_image, name='recipes_from_image'),
+    path('api/process-image/stats/', detection_stats, name='detection_stats'),
+    path('api/metrics/', metrics, name='metrics'),
     path('api/token/', obtain_auth_token),
     path('api/register/', RegisterView.as_view(), name='register'),
     path('recipes/<int:pk>/', RecipeDetailView.as_view(), name='recipe-detail'),
+    path('recipes/<int:pk>/similar/', SimilarRecipesView.as_view(), name='recipe-similar'),
     path('api/favourites/', FavouriteRecipeListCreateView.as_view(), name='favourite-list-create'),
     path('favourites/<int:pk>/', FavouriteRecipeDeleteView.as_view(), name='favourite-delete'),
     path('api/favourites/<int:pk>/', FavouriteRecipeDetailView.as_view(), name='favourite-detail'),
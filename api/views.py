@@ -1,29 +1,59 @@
-from PIL import Image
-from django.db.models import Q
+import time
+
+from django.core import signing
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, permissions, status
-from rest_framework.decorators import api_view, permission_classes, parser_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes, renderer_classes
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from .models import Recipe, FavouriteRecipe
-import json
+from .recommendations import (
+    DEFAULT_LIMIT,
+    cache_stats,
+    paginate,
+    paginate_cursor,
+    parse_limit,
+    parse_ranking,
+    recommend,
+    recommend_many,
+)
+from .metrics import exposition, stage
+from .personalization import recommend_personalized
+from .renderers import NDJSONRenderer, ndjson_lines
+from .similarity import similar_recipes
+from .vocabulary import get_vocabulary
 from django.contrib.auth.models import User
 
-from .serializers import RegisterSerializer, FavouriteRecipeSerializer, RecipeSerializer, RecipeSummarySerializer, \
-    FavouriteRecipeSummarySerializer, PaginatedRecipeMatchSerializer
+from .serializers import RegisterSerializer, FavouriteRecipeSerializer, RecipeSerializer, RecipeMatchSerializer, \
+    FavouriteRecipeSummarySerializer, PaginatedRecipeMatchSerializer, favourite_dict, favourite_summary_dicts, \
+    recipe_dict
 
-from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample, OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample, OpenApiTypes, \
+    PolymorphicProxySerializer
 from rest_framework.parsers import MultiPartParser
-from ultralytics import YOLO
 
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from django.conf import settings
+
+from .detection import (
+    DetectorBusy,
+    InvalidImage,
+    detect,
+    detected_labels,
+    get_detector,
+    get_result_cache,
+    is_loaded,
+    parse_confidence,
+)
 
-model = YOLO('api/best.pt')
 
 @extend_schema(
     request={
@@ -33,61 +63,193 @@ model = YOLO('api/best.pt')
                 'ingredients': {
                     'type': 'array',
                     'items': {'type': 'string'}
+                },
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Maksymalna liczba zwróconych przepisów (domyślnie 100, '
+                                   'przy stronicowaniu RECOMMEND_MAX_LIMIT).'
+                },
+                'ranking': {
+                    'type': 'string',
+                    'enum': ['match_percentage', 'idf', 'jaccard', 'missing'],
+                    'description': 'Sposób oceniania: match_percentage (domyślnie), idf - składniki ważone '
+                                   'rzadkością, jaccard, missing - przepisy z najwyżej max_missing brakującymi '
+                                   'składnikami. Poza domyślnym wyniki mają pole score albo missing_count.'
+                },
+                'max_missing': {
+                    'type': 'integer',
+                    'description': 'Tylko z ranking=missing: maksymalna liczba brakujących składników (domyślnie 0).'
+                },
+                'personalize': {
+                    'type': 'boolean',
+                    'description': 'Podbija przepisy podobne składnikami do ulubionych użytkownika; wyniki mają '
+                                   'pola affinity i personal_score. Nie łączy się ze stronicowaniem ani ranking=missing.'
+                },
+                'page_size': {
+                    'type': 'integer',
+                    'description': 'Włącza stronicowanie: odpowiedź ma postać {count, next, previous, results}.'
+                },
+                'cursor': {
+                    'type': 'string',
+                    'description': 'Wartość next/previous z poprzedniej strony; zastępuje pozostałe pola.'
                 }
             },
             'required': ['ingredients']
         }
     },
-    responses=OpenApiTypes.OBJECT,
+    responses={
+        # Lista dopasowań, a z page_size (albo cursor) strona {count, next, previous, results}.
+        200: PolymorphicProxySerializer(
+            component_name='RecommendResponse',
+            serializers=[RecipeMatchSerializer(many=True), PaginatedRecipeMatchSerializer],
+            resource_type_field_name=None,
+            many=False,
+        ),
+        400: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
+    },
     methods=["POST"],
-    description="Zwraca rekomendacje przepisów na podstawie listy składników."
+    description="Zwraca rekomendacje przepisów na podstawie listy składników. "
+                "Z nagłówkiem Accept: application/x-ndjson (lub ?format=ndjson) wyniki są "
+                "strumieniowane po jednym przepisie na linię."
 )
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer])
 def recommend_recipes(request):
-    user_ingredients = request.data.get('ingredients', [])
+    with stage('parse'):
+        data = request.data
+    payload, code = recommendation_payload(data, request.user)
 
-    if not user_ingredients:
-        return Response({"error": "Missing ingredients"}, status=400)
+    if code == status.HTTP_200_OK and isinstance(payload, list) and request.accepted_renderer.format == 'ndjson':
+        return StreamingHttpResponse(ndjson_lines(payload), content_type=NDJSONRenderer.media_type)
 
-    user_ingredients_set = set(user_ingredients)
+    return Response(payload, status=code)
 
-    query = Q()
-    for ing in user_ingredients:
-        query |= Q(ner__icontains=ing)
 
-    recipes = Recipe.objects.filter(query).only('id', 'title', 'link', 'ner')
+def recommendation_payload(data, user=None):
+    """Logika recommend_recipes wspólna dla widoku DRF i widoku async: zwraca (dane, status)."""
+    cursor = data.get('cursor')
+    if cursor:
+        try:
+            return paginate_cursor(cursor), status.HTTP_200_OK
+        except signing.BadSignature:
+            return {"error": "Invalid cursor"}, status.HTTP_400_BAD_REQUEST
 
-    recommendations = []
+    user_ingredients = data.get('ingredients', [])
 
-    for recipe in recipes:
-        try:
-            recipe_ingredients = set(recipe.ner)
-        except json.JSONDecodeError:
-            continue
+    if not user_ingredients:
+        return {"error": "Missing ingredients"}, status.HTTP_400_BAD_REQUEST
+
+    paginated = data.get('page_size') is not None
+    personalized = data.get('personalize') in (True, 1, 'true', '1')
+    try:
+        limit = parse_limit(
+            data.get('limit'),
+            default=settings.RECOMMEND_MAX_LIMIT if paginated else DEFAULT_LIMIT,
+        )
+        page_size = parse_limit(data.get('page_size'), name='page_size') if paginated else None
+        ranking = parse_ranking(data.get('ranking'), data.get('max_missing'))
+    except ValueError as e:
+        return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+
+    if personalized:
+        if paginated:
+            return {"error": "personalize cannot be combined with page_size"}, status.HTTP_400_BAD_REQUEST
+        if ranking.mode == 'missing':
+            return {"error": "personalize cannot be combined with ranking 'missing'"}, status.HTTP_400_BAD_REQUEST
+        return recommend_personalized(user_ingredients, user.id, limit, ranking), status.HTTP_200_OK
+
+    if paginated:
+        ingredient_ids = get_vocabulary().lookup(user_ingredients)
+        return paginate(ingredient_ids, limit, page_size, ranking=ranking), status.HTTP_200_OK
+
+    return recommend(user_ingredients, limit=limit, ranking=ranking), status.HTTP_200_OK
 
-        matched = user_ingredients_set & recipe_ingredients
-        match_count = len(matched)
 
-        if match_count == 0:
-            continue
+@extend_schema(
+    request={
+        'application/json': {
+            'type': 'object',
+            'properties': {
+                'queries': {
+                    'type': 'array',
+                    'items': {'type': 'array', 'items': {'type': 'string'}},
+                    'description': 'Lista list składników (np. jedna lista na spiżarnię).'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Maksymalna liczba przepisów na zapytanie (domyślnie 100).'
+                },
+                'ranking': {
+                    'type': 'string',
+                    'enum': ['match_percentage', 'idf', 'jaccard', 'missing'],
+                    'description': 'Sposób oceniania: match_percentage (domyślnie), idf - składniki ważone '
+                                   'rzadkością, jaccard, missing - przepisy z najwyżej max_missing brakującymi '
+                                   'składnikami. Poza domyślnym wyniki mają pole score albo missing_count.'
+                },
+                'max_missing': {
+                    'type': 'integer',
+                    'description': 'Tylko z ranking=missing: maksymalna liczba brakujących składników (domyślnie 0).'
+                }
+            },
+            'required': ['queries']
+        }
+    },
+    responses=OpenApiTypes.OBJECT,
+    methods=["POST"],
+    description="Rekomendacje dla wielu list składników w jednym żądaniu. Odpowiedź {results} zawiera "
+                "listy w kolejności zapytań - takie same jak z /api/recommend/ dla każdej listy osobno."
+)
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def recommend_recipes_batch(request):
+    queries = request.data.get('queries')
+
+    if not queries or not isinstance(queries, list):
+        return Response({"error": "Missing queries"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(queries) > settings.RECOMMEND_BATCH_MAX_QUERIES:
+        return Response(
+            {"error": f"Too many queries (max {settings.RECOMMEND_BATCH_MAX_QUERIES})"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    for position, ingredients in enumerate(queries):
+        if not ingredients or not isinstance(ingredients, list):
+            return Response(
+                {"error": f"Missing ingredients in query {position}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+    try:
+        limit = parse_limit(request.data.get('limit'))
+        ranking = parse_ranking(request.data.get('ranking'), request.data.get('max_missing'))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"results": recommend_many(queries, limit=limit, ranking=ranking)}, status=status.HTTP_200_OK)
 
-        match_percentage = (match_count / len(recipe_ingredients)) * 100
 
-        if match_count > 0:
-            recommendations.append({
-                "id": recipe.id,
-                "title": recipe.title,
-                "match_count": match_count,
-                "total_ingredients": len(recipe_ingredients),
-                "match_percentage": round(match_percentage, 2),
-                "link": recipe.link
-            })
+@extend_schema(
+    responses={(200, 'text/plain'): OpenApiTypes.STR},
+    description="Metryki w formacie tekstowym Prometheusa: liczniki i histogramy czasów żądań "
+                "oraz etapów, stan cache i kolejki detekcji. Wymaga METRICS_ENABLED (inaczej 404)."
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404()
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    recommendations.sort(key=lambda x: (-x['match_percentage'], -x['match_count']))
 
-    return Response(recommendations[:100], status=status.HTTP_200_OK)
+@extend_schema(
+    responses=OpenApiTypes.OBJECT,
+    description="Statystyki cache rekomendacji: trafienia, chybienia i zaoszczędzony czas liczenia."
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def recommendation_stats(request):
+    return Response(cache_stats(), status=status.HTTP_200_OK)
 
 
 @extend_schema(
@@ -125,7 +287,8 @@ def recommend_recipes(request):
                 }
             }
         },
-        400: {'type': 'object', 'properties': {'error': {'type': 'string'}}}
+        400: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
+        429: {'type': 'object', 'properties': {'error': {'type': 'string'}}}
     },
     methods=["POST"],
     description="Przetwarza zdjęcie i zwraca listę wykrytych składników z bounding boxami."
@@ -139,22 +302,115 @@ def process_image(request):
     if not image_file:
         return Response({"error": "Image is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    image = Image.open(image_file)
-    results = model.predict(image)[0]
+    try:
+        ingredients = detect(image_file)
+    except InvalidImage:
+        return Response({"error": "Invalid image"}, status=status.HTTP_400_BAD_REQUEST)
+    except DetectorBusy:
+        return Response({"error": "Too many images in progress, try again later"},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS)
+    except FutureTimeoutError:
+        return Response({"error": "Image processing timed out"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if not ingredients:
+        return Response({"error": "No ingredients detected"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"ingredients": ingredients}, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    request={
+        'multipart/form-data': {
+            'type': 'object',
+            'properties': {
+                'image': {'type': 'string', 'format': 'binary'},
+                'min_confidence': {
+                    'type': 'number',
+                    'description': 'Minimalna pewność detekcji, od której etykieta trafia do rekomendacji '
+                                   '(domyślnie DETECTION_MIN_CONFIDENCE).'
+                },
+                'limit': {'type': 'integer', 'description': 'Maksymalna liczba przepisów (domyślnie 100).'}
+            },
+            'required': ['image']
+        }
+    },
+    responses={
+        200: {
+            'type': 'object',
+            'properties': {
+                'ingredients': {'type': 'array', 'items': {'type': 'object'}},
+                'labels': {'type': 'array', 'items': {'type': 'string'}},
+                'recommendations': {'type': 'array', 'items': {'type': 'object'}},
+                'timings_ms': {
+                    'type': 'object',
+                    'description': 'Czasy etapów: preprocess, inference (brak przy trafieniu w cache), '
+                                   'recommendation i total.'
+                }
+            }
+        },
+        400: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
+        429: {'type': 'object', 'properties': {'error': {'type': 'string'}}}
+    },
+    methods=["POST"],
+    description="Zdjęcie -> przepisy w jednym żądaniu: wykrywa składniki, etykiety z pewnością "
+                "co najmniej min_confidence przekazuje do rekomendacji i zwraca oba wyniki."
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def recipes_from_image(request):
+    started = time.perf_counter()
+    image_file = request.FILES.get('image')
+
+    if not image_file:
+        return Response({"error": "Image is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    if results.boxes is None or len(results.boxes) == 0:
+    try:
+        limit = parse_limit(request.data.get('limit'))
+        min_confidence = parse_confidence(request.data.get('min_confidence'), settings.DETECTION_MIN_CONFIDENCE)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    timings = {}
+    try:
+        ingredients = detect(image_file, timings)
+    except InvalidImage:
+        return Response({"error": "Invalid image"}, status=status.HTTP_400_BAD_REQUEST)
+    except DetectorBusy:
+        return Response({"error": "Too many images in progress, try again later"},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS)
+    except FutureTimeoutError:
+        return Response({"error": "Image processing timed out"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if not ingredients:
         return Response({"error": "No ingredients detected"}, status=status.HTTP_400_BAD_REQUEST)
 
-    ingredients = []
-    for box, cls, conf in zip(results.boxes.xyxy, results.boxes.cls, results.boxes.conf):
-        label = results.names[int(cls)]
-        ingredients.append({
-            "label": label,
-            "confidence": round(float(conf), 3),
-            "box": [round(float(coord), 2) for coord in box]
-        })
+    labels = detected_labels(ingredients, min_confidence)
+    recommendation_started = time.perf_counter()
+    recommendations = recommend(labels, limit=limit) if labels else []
+    finished = time.perf_counter()
+    timings['recommendation'] = round((finished - recommendation_started) * 1000, 2)
+    timings['total'] = round((finished - started) * 1000, 2)
 
-    return Response({"ingredients": ingredients}, status=status.HTTP_200_OK)
+    return Response({
+        "ingredients": ingredients,
+        "labels": labels,
+        "recommendations": recommendations,
+        "timings_ms": timings,
+    }, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    responses=OpenApiTypes.OBJECT,
+    description="Statystyki detekcji: głębokość kolejki, rozmiary paczek, czas predict i trafienia cache."
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def detection_stats(request):
+    stats = {"loaded": is_loaded(), "cache": get_result_cache().stats()}
+    if is_loaded():
+        stats.update(get_detector().stats())
+    return Response(stats, status=status.HTTP_200_OK)
 
 
 class RegisterView(generics.CreateAPIView):
@@ -168,7 +424,15 @@ class FavouriteRecipeListCreateView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return FavouriteRecipe.objects.filter(user=self.request.user)
+        # Jedno zapytanie z JOIN-ami; z przepisu i szczegółów tylko kolumny potrzebne w podsumowaniu.
+        return (
+            FavouriteRecipe.objects.filter(user=self.request.user)
+            .select_related('recipe__detail')
+            .only(
+                'id', 'user_id', 'recipe__id', 'recipe__title', 'recipe__link', 'recipe__ingredient_count',
+                'recipe__detail__ner',
+            )
+        )
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -176,6 +440,10 @@ class FavouriteRecipeListCreateView(generics.ListCreateAPIView):
         else:
             return FavouriteRecipeSerializer
 
+    def list(self, request, *args, **kwargs):
+        # To samo co FavouriteRecipeSummarySerializer(many=True), ale bez narzutu DRF na każdy obiekt.
+        return Response(favourite_summary_dicts(self.get_queryset()))
+
     def perform_create(self, serializer):
         user = self.request.user
         recipe = serializer.validated_data.get('recipe')
@@ -190,14 +458,46 @@ class FavouriteRecipeListCreateView(generics.ListCreateAPIView):
 class RecipeDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @extend_schema(
+        responses={200: RecipeSerializer, 404: {'type': 'object', 'properties': {'error': {'type': 'string'}}}},
+        description="Pełny przepis (w tym kolumny z RecipeDetail).",
+    )
     def get(self, request, pk):
         try:
-            recipe = Recipe.objects.get(pk=pk)
+            recipe = recipe_dict(Recipe.objects, pk=pk)
         except Recipe.DoesNotExist:
             return Response({"error": "Recipe not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = RecipeSerializer(recipe)
-        return Response(serializer.data)
+        return Response(recipe)
+
+
+class SimilarRecipesView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('limit', int, description='Liczba podobnych przepisów (domyślnie 10).')
+        ],
+        responses=OpenApiTypes.OBJECT,
+        description="Przepisy o najbardziej podobnym zestawie składników (Jaccard), wyszukiwane "
+                    "w indeksie MinHash LSH zbudowanym przez manage.py build_similarity_index."
+    )
+    def get(self, request, pk):
+        try:
+            limit = parse_limit(request.query_params.get('limit'), default=10)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ingredient_ids = Recipe.objects.filter(pk=pk).values_list('ingredient_ids', flat=True).first()
+        if ingredient_ids is None:
+            return Response({"error": "Recipe not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            recipes = similar_recipes(pk, ingredient_ids, limit)
+        except FileNotFoundError:
+            return Response({"error": "Similarity index is not built"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response(recipes)
 
 
 class FavouriteRecipeDeleteView(generics.DestroyAPIView):
@@ -205,7 +505,7 @@ class FavouriteRecipeDeleteView(generics.DestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return FavouriteRecipe.objects.filter(user=self.request.user)
+        return FavouriteRecipe.objects.filter(user=self.request.user).only('id', 'user_id', 'recipe_id')
 
 
 class FavouriteRecipeDetailView(generics.RetrieveDestroyAPIView):
@@ -213,4 +513,11 @@ class FavouriteRecipeDetailView(generics.RetrieveDestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return FavouriteRecipe.objects.filter(user=self.request.user)
+        return FavouriteRecipe.objects.filter(user=self.request.user).select_related('recipe__detail')
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            favourite = favourite_dict(self.get_queryset(), pk=kwargs['pk'])
+        except FavouriteRecipe.DoesNotExist:
+            raise Http404("No FavouriteRecipe matches the given query.")
+        return Response(favourite)
@@ -0,0 +1,59 @@
+import threading
+
+from api.ingredients import canonical_names
+from api.models import Ingredient
+
+
+class IngredientVocabulary:
+    """Słownik kanoniczna nazwa składnika -> Ingredient.id, trzymany w pamięci procesu."""
+
+    def __init__(self, ids=None):
+        self.ids = dict(ids or {})
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls):
+        return cls(Ingredient.objects.values_list('name', 'id').iterator(chunk_size=20000))
+
+    def lookup(self, ner):
+        """Id znanych składników (bez zapytań do bazy); nieznane nazwy są pomijane."""
+        return sorted({self.ids[name] for name in canonical_names(ner) if name in self.ids})
+
+    def resolve(self, ner):
+        """Jak lookup, ale brakujące składniki są dodawane do tabeli Ingredient."""
+        names = canonical_names(ner)
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            self.add_names(missing)
+        return sorted(self.ids[name] for name in names)
+
+    def add_names(self, names):
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], ignore_conflicts=True)
+        created = Ingredient.objects.filter(name__in=names).values_list('name', 'id')
+        with self.lock:
+            self.ids.update(created)
+
+
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+def get_vocabulary():
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                _vocabulary = IngredientVocabulary.from_database()
+    return _vocabulary
+
+
+def recipe_detail_saved(sender, instance, raw=False, **kwargs):
+    """Zmiana ner w szczegółach (np. w panelu admina) przelicza ingredient_ids przepisu."""
+    if raw:
+        return
+    ingredient_ids = get_vocabulary().resolve(instance.ner)
+    recipe = instance.recipe
+    if recipe.ingredient_ids != ingredient_ids:
+        recipe.ingredient_ids = ingredient_ids
+        recipe.ingredient_count = len(ingredient_ids)
+        recipe.save(update_fields=['ingredient_ids', 'ingredient_count'])